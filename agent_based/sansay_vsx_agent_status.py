@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+
+# License: GNU General Public License v2
+
+
+from collections.abc import Mapping
+from typing import Any
+
+from cmk.agent_based.v2 import (
+    AgentSection,
+    CheckPlugin,
+    CheckResult,
+    DiscoveryResult,
+    Metric,
+    Result,
+    Service,
+    State,
+)
+
+from cmk_addons.plugins.sansay_vsx.lib import parse_sansay_vsx
+
+
+Section = Mapping[str, Any]
+
+# Special Agent Output to Parse for this service
+"""
+<<<sansay_vsx_agent:sep(0)>>>
+{"response_times": {"media_server": 0.412, "realtime": 0.388, "resource": 6.204},
+ "timeouts": {"media_server": 3.0, "realtime": 3.0, "resource": 10.0},
+ "breaker": {"state": "closed", "failures": 0, "next_probe_in": 0},
+ "degraded": {"resource": {"tables": ["ingress_stat"], "fallback_age": 60}},
+ "transfer": {"resource": {"encoding": "gzip", "wire_bytes": 812345, "bytes": 9876543}, ...,
+              "media_server": {"encoding": "identity", "wire_bytes": 312, "bytes": 312,
+                               "aborted": {"limit": "deadline", "reason": "deadline of 60s exceeded after 312 bytes"}}},
+ "sections": {"sansay_vsx_system": true, "sansay_vsx_trunks": true, "sansay_vsx_media": false}}
+
+Information about the special agent run itself rather than the VSX. "timeouts"
+is only present when adaptive timeouts are enabled, "breaker" only when the
+circuit breaker is enabled. "degraded" lists reports that still missed tables
+after a re-poll (HA switchover), with the age of the last complete report the
+tables were taken from or null if there was none recent enough. "transfer" has
+the size of every report on the wire and after decompression, and why a
+download was aborted by the deadline, rate or size limits. The section is
+written last as a trailer, "sections" tells which of the other sections carry
+data.
+Parser 'parse_sansay_vsx' is in sansay_vsx.lib. It filters out the string and performs a json.load.
+"""
+
+
+agent_section_sansay_vsx_agent = AgentSection(
+    name="sansay_vsx_agent",
+    parse_function=parse_sansay_vsx,
+    parsed_section_name="sansay_vsx_agent",
+)
+
+
+def _render_reports(values: Mapping[str, float]) -> str:
+    return ", ".join(f"{report} {value:.1f}s" for report, value in sorted(values.items()))
+
+
+def _render_bytes(value: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}" if unit != "B" else f"{value} B"
+        value /= 1024
+    return f"{value:.1f} GiB"
+
+
+def discovery_sansay_vsx_agent(section: Section) -> DiscoveryResult:
+    if section:
+        yield Service()
+
+
+def check_sansay_vsx_agent(section: Section) -> CheckResult:
+    breaker = section.get("breaker", {})
+    if breaker.get("state") == "open":
+        yield Result(
+            state=State.CRIT,
+            summary=f"Circuit breaker open after {breaker['failures']} failed runs",
+            details=f"VSX polling is suspended, next probe in {breaker['next_probe_in']}s",
+        )
+
+    for report, degraded in sorted(section.get("degraded", {}).items()):
+        tables = ", ".join(degraded["tables"])
+        if degraded.get("fallback_age") is None:
+            yield Result(state=State.WARN, summary=f"Degraded {report} report, tables missing: {tables}")
+        else:
+            yield Result(
+                state=State.OK,
+                summary=f"Degraded {report} report, using last complete data for: {tables}",
+                details=f"Last complete {report} report is {degraded['fallback_age']}s old",
+            )
+
+    empty_sections = sorted(name for name, complete in section.get("sections", {}).items() if not complete)
+    if empty_sections:
+        yield Result(state=State.WARN, summary=f"Sections without data: {', '.join(empty_sections)}")
+
+    response_times = section.get("response_times", {})
+    if response_times:
+        yield Result(state=State.OK, summary=f"Response times: {_render_reports(response_times)}")
+    for report, seconds in sorted(response_times.items()):
+        yield Metric(name=f"agent_response_time_{report}", value=seconds)
+
+    transfer = section.get("transfer", {})
+    if transfer:
+        wire_bytes = sum(report["wire_bytes"] for report in transfer.values())
+        total_bytes = sum(report["bytes"] for report in transfer.values())
+        yield Result(
+            state=State.OK,
+            summary=f"Transferred: {_render_bytes(wire_bytes)} ({_render_bytes(total_bytes)} uncompressed)",
+            details=", ".join(
+                f"{report} {_render_bytes(info['wire_bytes'])} {info['encoding']}" for report, info in sorted(transfer.items())
+            ),
+        )
+    for report, info in sorted(transfer.items()):
+        if "aborted" in info:
+            yield Result(state=State.WARN, summary=f"Download of {report} report aborted: {info['aborted']['reason']}")
+    for report, info in sorted(transfer.items()):
+        yield Metric(name=f"agent_transfer_bytes_{report}", value=info["wire_bytes"])
+
+    timeouts = section.get("timeouts", {})
+    if timeouts:
+        yield Result(state=State.OK, summary=f"Adaptive timeouts: {_render_reports(timeouts)}")
+
+
+check_plugin_sansay_vsx_agent = CheckPlugin(
+    name="sansay_vsx_agent",
+    service_name="VSX Agent Status",
+    discovery_function=discovery_sansay_vsx_agent,
+    sections=["sansay_vsx_agent"],
+    check_function=check_sansay_vsx_agent,
+)
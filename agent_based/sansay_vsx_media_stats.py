@@ -4,6 +4,8 @@
 # License: GNU General Public License v2
 
 
+import re
+from collections.abc import Mapping
 from typing import Any
 
 from cmk.agent_based.v2 import (
@@ -44,10 +46,16 @@ agent_section_sansay_vsx_cpu = AgentSection(
 )
 
 
-def discovery_sansay_vsx_media(section: Section) -> DiscoveryResult:
-    # print(f"discover media {section=}\n{type(section)}")
+def discovery_sansay_vsx_media(params: Mapping[str, Any], section: Section) -> DiscoveryResult:
+    include_switch_type = re.compile(params["include_switch_type"]) if params.get("include_switch_type") else None
+    exclude_switch_type = re.compile(params["exclude_switch_type"]) if params.get("exclude_switch_type") else None
     for media_server in section:
-        yield Service(item=f"{media_server["alias"]}")
+        switch_type = media_server.get("switchType", "")
+        if include_switch_type is not None and not include_switch_type.search(switch_type):
+            continue
+        if exclude_switch_type is not None and exclude_switch_type.search(switch_type):
+            continue
+        yield Service(item=f"{media_server['alias']}")
 
 
 def check_sansay_vsx_media(item, params, section: Section) -> CheckResult:
@@ -101,6 +109,8 @@ check_plugin_sansay_vsx_media = CheckPlugin(
     name="sansay_vsx_media",
     service_name="VSX Media Server %s",
     discovery_function=discovery_sansay_vsx_media,
+    discovery_ruleset_name="sansay_vsx_media_discovery",
+    discovery_default_parameters={},
     sections=["sansay_vsx_media"],
     check_function=check_sansay_vsx_media,
     check_ruleset_name="sansay_vsx_media",
@@ -3,6 +3,7 @@
 
 # License: GNU General Public License v2
 
+import math
 import time
 from collections.abc import Mapping
 
@@ -11,6 +12,8 @@ from cmk.agent_based.v2 import (
     CheckPlugin,
     CheckResult,
     DiscoveryResult,
+    GetRateError,
+    get_rate,
     get_value_store,
     Metric,
     Result,
@@ -18,7 +21,7 @@ from cmk.agent_based.v2 import (
     State,
 )
 
-from cmk_addons.plugins.sansay_vsx.lib import parse_sansay_vsx
+from cmk_addons.plugins.sansay_vsx.lib import check_levels_state, parse_sansay_vsx
 
 
 Section = Mapping[str, object]
@@ -33,6 +36,10 @@ Section = Mapping[str, object]
 "outbound_sip_leg": 0,"peak_active_session": 23,"peak_h323_leg": 0,"peak_sip_leg": 46,"slave_stat": 64,
 "sum_active_session": 0,"sum_attempt_session": 27412,"switch_over_flag": 3}
 
+In cluster mode (--cluster-peer) the agent adds the HA state of both members:
+"cluster": {"active_node": "10.0.0.2", "nodes": {"10.0.0.1": {"reachable": true, "ha_current_state": "standby", ...},
+                                                 "10.0.0.2": {"reachable": true, "ha_current_state": "active", ...}}}
+
 section comes in as a list within a list containing the dictionary as a string.
 Parser 'parse_sansay_vsx' is in sansay_vsx.lib. It filters out the string and performs a json.load.
 [['{values above}']]
@@ -46,27 +53,89 @@ agent_section_sansay_vsx_cpu = AgentSection(
 )
 
 
-def _check_levels(value: float, level_spec: tuple, bound: str = "upper") -> int:
+# Monotonic system counters and the rate metric derived from each of them.
+_RATE_COUNTERS = {
+    "sum_attempt_session": "attempt_rate",
+    "max_cps_exceed": "cps_exceed_rate",
+    "max_session_exceed": "session_exceed_rate",
+}
+
+
+def _counter_rates(section: Section, now: float, value_store: dict) -> dict[str, float]:
+    """
+    Per-second rates of the monotonic system counters, via get_rate like
+    the limit counters of the trunk plugin.
+
+    The counters restart on the newly active node after an HA switchover, so
+    all baselines are dropped when ha_current_state, switch_over_flag or the
+    active cluster member change. A counter that went backwards for any other
+    reason is re-baselined instead of producing a negative rate. Counters
+    without a usable baseline yield no rate for this check cycle.
+    """
+    ha_marker = (
+        section.get("ha_current_state"),
+        section.get("switch_over_flag"),
+        (section.get("cluster") or {}).get("active_node"),
+    )
+    if value_store.get("sansay_vsx.ha_marker") != ha_marker:
+        for counter in _RATE_COUNTERS:
+            value_store.pop(f"sansay_vsx.counter.{counter}", None)
+    value_store["sansay_vsx.ha_marker"] = ha_marker
+
+    rates = {}
+    for counter, metric in _RATE_COUNTERS.items():
+        value = section.get(counter)
+        if value is None:
+            continue
+        try:
+            rates[metric] = get_rate(value_store, f"sansay_vsx.counter.{counter}", now, value, raise_overflow=True)
+        except GetRateError:
+            continue
+    return rates
+
+
+def _check_ha(params, section: Section, value_store: dict) -> CheckResult:
     """
-    Evaluate a value against a SimpleLevels spec, returning 0/1/2.
+    HA state of the polled node and, in cluster mode, of both members.
 
-    Handles both ("fixed", (warn, crit)) and ("no_levels", None) — the latter
-    always returns 0, allowing metric collection without alerting.
+    A change of the local HA state or of the active cluster member since the
+    previous check is reported once with the configured state change state.
     """
-    if level_spec[0] == "no_levels":
-        return 0
-    _, (warn, crit) = level_spec
-    if bound == "upper":
-        if value >= crit:
-            return 2
-        if value >= warn:
-            return 1
-    else:  # lower
-        if value <= crit:
-            return 2
-        if value <= warn:
-            return 1
-    return 0
+    change_state = State(params.get("ha_state_change_state", 1))
+    cluster = section.get("cluster")
+    ha_state = section.get("ha_current_state")
+    active_node = cluster.get("active_node") if cluster else None
+
+    previous = value_store.get("sansay_vsx.ha_state")
+    value_store["sansay_vsx.ha_state"] = (ha_state, active_node)
+    if previous is not None:
+        previous_state, previous_node = previous
+        if cluster and previous_node and active_node and previous_node != active_node:
+            yield Result(state=change_state, summary=f"Failover: active member changed from {previous_node} to {active_node}")
+        elif not cluster and previous_state and ha_state and previous_state != ha_state:
+            yield Result(state=change_state, summary=f"HA state changed from {previous_state} to {ha_state}")
+
+    if not cluster:
+        return
+
+    nodes = cluster.get("nodes", {})
+    active_nodes = [node for node, info in nodes.items() if info.get("ha_current_state") == "active"]
+    if len(active_nodes) > 1:
+        yield Result(state=State.CRIT, summary=f"All HA members report active: {', '.join(active_nodes)}")
+    elif not active_nodes:
+        yield Result(state=State.CRIT, summary="No active HA member")
+    else:
+        standby = ", ".join(f"{node} {info.get('ha_current_state') or 'unknown'}" for node, info in nodes.items()
+                            if node != active_node)
+        yield Result(state=State.OK, summary=f"HA active member: {active_node}", details=f"Other members: {standby}")
+    for node, info in nodes.items():
+        if not info.get("reachable"):
+            yield Result(state=State.WARN, summary=f"HA member {node} unreachable")
+
+    for field, metric in (("cluster_active_session", "cluster_active_sessions"),
+                          ("cluster_peak_session", "cluster_peak_sessions")):
+        if section.get(field) is not None:
+            yield Metric(name=metric, value=section[field])
 
 
 def _rolling_average(
@@ -89,6 +158,49 @@ def _rolling_average(
     return sum(s["v"] for s in history) / len(history)
 
 
+def _seasonal_forecast(
+    current_value: float,
+    now: float,
+    alpha: float,
+    value_store: dict,
+) -> tuple[float, float, int]:
+    """
+    Return (expected value, standard deviation, sample count) of the
+    hour-of-week bucket of now, and add current_value to the running
+    average of the current hour.
+
+    Each of the 168 buckets holds an exponentially weighted mean and
+    variance, so the stored state is bounded no matter how long the
+    history is. A bucket takes one sample per week: the values of an hour
+    are averaged, and the average is folded into its bucket once the next
+    hour starts. The check interval therefore does not change how fast a
+    baseline adapts, and the returned baseline never includes the current
+    hour.
+    """
+    local_time = time.localtime(now)
+    bucket = local_time.tm_wday * 24 + local_time.tm_hour
+    hour = int(now // 3600)
+    baselines = value_store.get("sansay_vsx.session_forecast", {})
+    pending_hour, pending_bucket, total, count = value_store.get("sansay_vsx.session_forecast_hour", (hour, bucket, 0.0, 0))
+
+    if pending_hour != hour:
+        if count:
+            hourly_mean = total / count
+            mean, variance, samples = baselines.get(pending_bucket, (hourly_mean, 0.0, 0))
+            if samples == 0:
+                baselines[pending_bucket] = (hourly_mean, 0.0, 1)
+            else:
+                diff = hourly_mean - mean
+                increment = alpha * diff
+                baselines[pending_bucket] = (mean + increment, (1 - alpha) * (variance + diff * increment), samples + 1)
+        total, count = 0.0, 0
+    value_store["sansay_vsx.session_forecast_hour"] = (hour, bucket, total + current_value, count + 1)
+    value_store["sansay_vsx.session_forecast"] = baselines
+
+    mean, variance, samples = baselines.get(bucket, (current_value, 0.0, 0))
+    return mean, math.sqrt(variance), samples
+
+
 def discovery_sansay_vsx_system(section: Section) -> DiscoveryResult:
     if "cpu_idle_percent" in section.keys():
         yield Service()
@@ -105,10 +217,42 @@ def check_sansay_vsx_system(params, section: Section) -> CheckResult:
 
     # --- CPU utilization ---
     cpu_utilization = 100.0 - section["cpu_idle_percent"]
-    cpu_state = _check_levels(cpu_utilization, params["cpu_levels"])
+    cpu_state = check_levels_state(cpu_utilization, params["cpu_levels"])
     yield Result(state=State(cpu_state), summary=f"CPU at {cpu_utilization}%.")
     yield Metric(name="cpu_utilization", value=cpu_utilization, boundaries=(0, 100))
 
+    # --- HA state ---
+    yield from _check_ha(params, section, value_store)
+
+    # --- Current CPS against the CPS limit ---
+    # current_cps is what the VSX limits on. The attempt rate below averages
+    # over the whole check interval and would hide the bursts hitting the limit.
+    if section.get("max_cps_allowed") and section.get("current_cps") is not None:
+        cps_utilization = round((section["current_cps"] / section["max_cps_allowed"]) * 100, 1)
+        cps_state = check_levels_state(cps_utilization, params.get("cps_utilization_levels", ("no_levels", None)))
+        yield Result(
+            state=State(cps_state),
+            summary=f"Current CPS: {section['current_cps']} ({cps_utilization}% of {section['max_cps_allowed']} allowed)",
+        )
+        yield Metric(name="cps_utilization", value=cps_utilization, boundaries=(0, 100))
+
+    # --- Call attempt and limit exceed rates ---
+    rates = _counter_rates(section, time.time(), value_store)
+    if "attempt_rate" in rates:
+        attempt_rate = round(rates["attempt_rate"], 2)
+        attempt_state = check_levels_state(attempt_rate, params.get("attempt_rate_levels", ("no_levels", None)))
+        yield Metric(name="attempt_rate", value=attempt_rate)
+        yield Result(state=State(attempt_state), summary=f"Call attempts: {attempt_rate}/s")
+
+    for metric, label in (("cps_exceed_rate", "CPS limit"), ("session_exceed_rate", "Max session limit")):
+        if metric not in rates:
+            continue
+        exceed_rate = round(rates[metric], 3)
+        exceed_state = check_levels_state(exceed_rate, params.get(f"{metric}_levels", ("no_levels", None)))
+        yield Metric(name=metric, value=exceed_rate)
+        if exceed_rate > 0 or exceed_state:
+            yield Result(state=State(exceed_state), summary=f"{label} exceeded: {exceed_rate}/s")
+
     # --- Session utilization ---
     if not (section["max_session_allowed"] and section["sum_active_session"] is not None):
         return
@@ -133,7 +277,7 @@ def check_sansay_vsx_system(params, section: Section) -> CheckResult:
         eval_utilization = session_utilization
         util_label = f"{session_utilization}%"
 
-    session_state = _check_levels(eval_utilization, params["session_levels"])
+    session_state = check_levels_state(eval_utilization, params["session_levels"])
 
     # Drop detection always compares instantaneous values so it reflects actual
     # sudden changes regardless of whether the utilization threshold uses averaging.
@@ -141,7 +285,7 @@ def check_sansay_vsx_system(params, section: Section) -> CheckResult:
     drop = None
     if prev is not None:
         drop = round(prev - session_utilization, 1)
-        drop_state = _check_levels(drop, params["session_drop_levels"])
+        drop_state = check_levels_state(drop, params["session_drop_levels"])
         session_state = max(session_state, drop_state)
     value_store["sansay_vsx.session_utilization"] = session_utilization
 
@@ -156,6 +300,31 @@ def check_sansay_vsx_system(params, section: Section) -> CheckResult:
         boundaries=(None, None),
     )
 
+    # Forecast mode compares the instantaneous value with the seasonal
+    # baseline of the same hour of the week. The deviation is measured in
+    # standard deviations, with a floor so a perfectly flat history does not
+    # turn every small change into an alert.
+    forecast_levels = params.get("session_forecast_levels", ("no_levels", None))
+    if forecast_levels[0] == "no_levels":
+        return
+    expected, deviation, samples = _seasonal_forecast(
+        session_utilization, time.time(), params.get("session_forecast_alpha", 0.2), value_store
+    )
+    min_samples = params.get("session_forecast_min_samples", 4)
+    if samples < min_samples:
+        yield Result(
+            state=State.OK,
+            notice=f"Forecast baseline for this hour of the week is learning ({samples}/{min_samples} samples)",
+        )
+        return
+    sigma = round(abs(session_utilization - expected) / max(deviation, 1.0), 1)
+    yield Result(
+        state=State(check_levels_state(sigma, forecast_levels)),
+        summary=f"Expected for this hour of the week: {round(expected, 1)}% (deviation {sigma} sigma)",
+    )
+    yield Metric(name="session_utilization_expected", value=round(expected, 1), boundaries=(0, 100))
+    yield Metric(name="session_utilization_deviation", value=sigma)
+
 
 check_plugin_sansay_vsx_system = CheckPlugin(
     name="sansay_vsx_system",
@@ -170,5 +339,13 @@ check_plugin_sansay_vsx_system = CheckPlugin(
         "session_drop_levels": ("fixed", (10.0, 20.0)),
         "session_rolling_average": "instantaneous",
         "session_rolling_window": 15,
+        "session_forecast_levels": ("no_levels", None),
+        "session_forecast_alpha": 0.2,
+        "session_forecast_min_samples": 4,
+        "attempt_rate_levels": ("no_levels", None),
+        "cps_utilization_levels": ("fixed", (80.0, 90.0)),
+        "cps_exceed_rate_levels": ("no_levels", None),
+        "session_exceed_rate_levels": ("no_levels", None),
+        "ha_state_change_state": 1,
     },
 )
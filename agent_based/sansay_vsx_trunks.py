@@ -4,21 +4,33 @@
 # License: GNU General Public License v2
 
 
+import math
+import re
+import time
+from collections import OrderedDict
 from collections.abc import Mapping
-from typing import Any
+from typing import Any, Optional
 
 from cmk.agent_based.v2 import (
     AgentSection,
     CheckPlugin,
     CheckResult,
     DiscoveryResult,
+    GetRateError,
+    get_rate,
+    get_value_store,
     Metric,
     Result,
     Service,
     State,
 )
 
-from cmk_addons.plugins.sansay_vsx.lib import parse_sansay_vsx
+from cmk_addons.plugins.sansay_vsx.lib import (
+    LevelsEvaluator,
+    check_levels_state,
+    compile_levels,
+    parse_sansay_vsx_trunks,
+)
 
 
 Section = Mapping[str, Any]
@@ -33,8 +45,12 @@ Section = Mapping[str, Any]
             "egress": {"answer_seize_ratio": 0, "avg_call_duration": 0, "avg_postdial_delay": 0, "failed_call_ratio": 0},
             "gw_egress_stat": {"answer_seize_ratio": 100.0, "avg_call_duration": 275.0, "avg_postdial_delay": 2.3, "failed_call_ratio": 0.0},
             "ingress": {"answer_seize_ratio": 0, "avg_call_duration": 0, "avg_postdial_delay": 0, "failed_call_ratio": 0},
-            "realtime": {"origination_sessions": 1, "origination_utilization": 0.1, "termination_sessions": 3, "termination_utilization": 0.1}
+            "realtime": {"origination_sessions": 1, "origination_utilization": 0.1, "termination_sessions": 3, "termination_utilization": 0.1,
+                         "cps": 2, "cps_utilization": 20.0, "peak_sessions": 9, "peak_utilization": 0.9,
+                         "call_limit_exceeded": 0, "cps_limit_exceeded": 0}
         },
+        "counters": {"egress": {"call_attempt": 4, "call_fail": 0, "call_answer": 4, "call_duration": 1100, "pdd_ms": 9200},
+                     "ingress": {"call_attempt": 0, "call_fail": 0, "call_answer": 0, "call_duration": 0, "pdd_ms": 0}},
       "recid": 1
     },
     "2000": {
@@ -48,8 +64,18 @@ Section = Mapping[str, Any]
     },
 }
 Section comes in as a list within a list containing the dictionary as a string.
-Parser 'parse_sansay_vsx' is in sansay_vsx.lib. It filters out the string and performs a json.load.
+Parser 'parse_sansay_vsx_trunks' is in sansay_vsx.lib. It filters out the string and performs a json.load.
 [['{values above}']]
+
+With --delta-sections the agent only sends the trunks that changed since the
+previous cycle and the parser rebuilds the full view shown above:
+{"sansay_vsx_delta": {"generation": 42, "base": 41, "snapshot": "/omd/.../trunks_10.0.0.1.json",
+                      "members": ["1", "2000"], "changed": {"1": {...}}}}
+
+With --mmap-snapshot the section only refers to a snapshot file the parser
+maps into memory, with the JSON state file as fallback:
+{"sansay_vsx_mmap": {"generation": 42, "snapshot": "/omd/.../trunks_10.0.0.1.snap",
+                     "json": "/omd/.../trunks_10.0.0.1.json"}}
 """
 
 # Maps (direction_group, metric_name) -> "upper" or "lower" bound direction.
@@ -73,20 +99,291 @@ _METRIC_LEVEL_DIRECTION: dict[str, dict[str, str]] = {
     "realtime": {
         "origination_utilization": "upper",
         "termination_utilization": "upper",
+        "cps_utilization": "upper",
+        "peak_utilization": "upper",
+        "call_limit_exceeded": "upper",
+        "cps_limit_exceeded": "upper",
     },
 }
 
+# Metric groups of a trunk service recorded unless the metric_groups
+# parameter says otherwise. The fourth group, "history" (the last 1h/24h
+# ratios), adds six metrics per trunk and is only recorded when selected.
+_DEFAULT_METRIC_GROUPS = ("ingress", "egress", "realtime")
+
+# Legacy groups of older agents -> the group they duplicate. Their metrics
+# are only emitted when the agent does not send the current group as well.
+_LEGACY_METRIC_GROUPS = {"gw_egress_stat": "egress"}
+
+TrunkEvaluators = dict[str, dict[str, LevelsEvaluator]]
+
+# Compiled evaluator tables, least recently used first, keyed by id() of
+# the params they were compiled from. Each entry keeps its params alive, so
+# the id cannot be reused by another object while the entry is cached, and
+# the lookup is a dict access instead of a walk over every level.
+_EVALUATORS: OrderedDict[int, tuple[Mapping[str, Any], TrunkEvaluators]] = OrderedDict()
+_EVALUATOR_CACHE_SIZE = 64
+
+
+def _compile_trunk_evaluators(params: Mapping[str, Any]) -> TrunkEvaluators:
+    """Compile every configured level of _METRIC_LEVEL_DIRECTION once, skipping no_levels"""
+    evaluators: TrunkEvaluators = {}
+    for direction, metrics in _METRIC_LEVEL_DIRECTION.items():
+        direction_params = params.get(direction, {})
+        direction_label = direction.replace("_", " ").title()
+        for metric, bound in metrics.items():
+            evaluator = compile_levels(
+                direction_params.get(f"{metric}_levels"),
+                bound,
+                f"{direction_label} {metric.replace('_', ' ').title().replace('Cps', 'CPS')}",
+            )
+            if evaluator is not None:
+                evaluators.setdefault(direction, {})[metric] = evaluator
+    return evaluators
+
+
+def _trunk_evaluators(params: Mapping[str, Any]) -> TrunkEvaluators:
+    key = id(params)
+    entry = _EVALUATORS.get(key)
+    if entry is not None and entry[0] is params:
+        _EVALUATORS.move_to_end(key)
+        return entry[1]
+    evaluators = _compile_trunk_evaluators(params)
+    _EVALUATORS[key] = (params, evaluators)
+    if len(_EVALUATORS) > _EVALUATOR_CACHE_SIZE:
+        _EVALUATORS.popitem(last=False)
+    return evaluators
+
 
 agent_section_sansay_vsx_cpu = AgentSection(
     name="sansay_vsx_trunks",
-    parse_function=parse_sansay_vsx,
+    parse_function=parse_sansay_vsx_trunks,
     parsed_section_name="sansay_vsx_trunks",
 )
 
 
-def discovery_sansay_vsx_trunks(section: Section) -> DiscoveryResult:
-    for trunk_id, trunk_data in section.items():
-        yield Service(item=f"{trunk_id} {trunk_data['alias']}")
+def _trunk_item(trunk_id: str, trunk_data: Mapping[str, Any]) -> str:
+    return f"{trunk_id} {trunk_data['alias']}"
+
+
+def _trunk_traffic(trunk_data: Mapping[str, Any]) -> float:
+    """Current sessions of a trunk in both directions, used to rank trunks"""
+    realtime = trunk_data.get("calculated_stats", {}).get("realtime", {})
+    return realtime.get("origination_sessions", 0) + realtime.get("termination_sessions", 0)
+
+
+def _trunk_has_traffic(trunk_data: Mapping[str, Any]) -> bool:
+    """
+    Current sessions or call attempts in the last 15 minutes. Without raw
+    counters (older agent) any non-zero call ratio counts as traffic.
+    """
+    if _trunk_traffic(trunk_data) or _trunk_is_active(trunk_data):
+        return True
+    if trunk_data.get("counters"):
+        return False
+    return any(
+        value
+        for direction, stats in trunk_data.get("calculated_stats", {}).items()
+        if direction != "realtime"
+        for value in stats.values()
+    )
+
+
+def _metric_groups(params: Mapping[str, Any], trunk_data: Mapping[str, Any]) -> set[str]:
+    """The metric groups emitted for a trunk, none for idle trunks with skip_idle_metrics"""
+    if params.get("skip_idle_metrics") and not _trunk_has_traffic(trunk_data):
+        return set()
+    groups = set(params.get("metric_groups", _DEFAULT_METRIC_GROUPS))
+    calculated_stats = trunk_data.get("calculated_stats", {})
+    for legacy, group in _LEGACY_METRIC_GROUPS.items():
+        if group in groups and group not in calculated_stats:
+            groups.add(legacy)
+    return groups
+
+
+def _in_id_ranges(trunk_id: str, ranges: list[Mapping[str, int]]) -> bool:
+    try:
+        number = int(trunk_id)
+    except ValueError:
+        return False
+    return any(id_range["min_id"] <= number <= id_range["max_id"] for id_range in ranges)
+
+
+def _trunk_is_active(trunk_data: Mapping[str, Any]) -> bool:
+    """Any call attempt in the last 15 minutes in either direction"""
+    return any(counters.get("call_attempt", 0) for counters in trunk_data.get("counters", {}).values())
+
+
+def _trunk_discovery_filter(params: Mapping[str, Any]):
+    """
+    Build the include/exclude predicate of the discovery rule, compiling the
+    alias regexes once per discovery run.
+    """
+    include_ranges = params.get("include_id_ranges", [])
+    exclude_ranges = params.get("exclude_id_ranges", [])
+    include_alias = re.compile(params["include_alias"]) if params.get("include_alias") else None
+    exclude_alias = re.compile(params["exclude_alias"]) if params.get("exclude_alias") else None
+    only_active = params.get("only_active", False)
+
+    def _accept(trunk_id: str, trunk_data: Mapping[str, Any]) -> bool:
+        if include_ranges and not _in_id_ranges(trunk_id, include_ranges):
+            return False
+        if exclude_ranges and _in_id_ranges(trunk_id, exclude_ranges):
+            return False
+        alias = trunk_data.get("alias", "")
+        if include_alias is not None and not include_alias.search(alias):
+            return False
+        if exclude_alias is not None and exclude_alias.search(alias):
+            return False
+        return not only_active or _trunk_is_active(trunk_data)
+
+    return _accept
+
+
+def _per_trunk_ids(params: Mapping[str, Any], section: Section) -> list[str]:
+    """Trunk ids that get their own service according to the discovery rule"""
+    accept = _trunk_discovery_filter(params)
+    candidates = [(trunk_id, trunk_data) for trunk_id, trunk_data in section.items() if accept(trunk_id, trunk_data)]
+
+    filter_type, filter_value = params.get("per_trunk_filter", ("all", None))
+    if filter_type == "regex":
+        pattern = re.compile(filter_value)
+        return [
+            trunk_id for trunk_id, trunk_data in candidates
+            if pattern.search(_trunk_item(trunk_id, trunk_data))
+        ]
+    if filter_type == "top_n":
+        ranked = sorted(candidates, key=lambda entry: (-_trunk_traffic(entry[1]), entry[0]))
+        return [trunk_id for trunk_id, _ in ranked[:filter_value]]
+    return [trunk_id for trunk_id, _ in candidates]
+
+
+def discovery_sansay_vsx_trunks(params: Mapping[str, Any], section: Section) -> DiscoveryResult:
+    if params.get("mode", "per_trunk") == "aggregated":
+        return
+    for trunk_id in _per_trunk_ids(params, section):
+        yield Service(item=_trunk_item(trunk_id, section[trunk_id]))
+
+
+def discovery_sansay_vsx_trunks_summary(params: Mapping[str, Any], section: Section) -> DiscoveryResult:
+    if section and params.get("mode", "per_trunk") in ("aggregated", "both"):
+        yield Service()
+
+
+# The resource report only carries the counters of the last completed
+# 15 minute interval. Every check run stores that interval as a window, and the
+# windows are aggregated over these horizons.
+_COUNTER_FIELDS = ("call_attempt", "call_fail", "call_answer", "call_duration", "pdd_ms")
+_WINDOW_SECONDS = 15 * 60
+_HISTORY_HORIZONS = (("1h", 3600), ("24h", 86400))
+
+
+def _record_counter_window(direction: str, counters: Mapping[str, int], now: float, value_store) -> list:
+    """
+    Add the 15 minute counters of one direction to the window history in the
+    value store and return the history.
+
+    The check runs every minute but the device only moves on every 15
+    minutes, so a window identical to the newest stored one is the same
+    interval seen again and is not stored twice. An identical window that
+    turns up after a full interval has passed is a new interval with the same
+    traffic. Windows older than the longest horizon are dropped.
+    """
+    key = f"sansay_vsx.windows.{direction}"
+    sample = tuple(int(counters.get(field, 0)) for field in _COUNTER_FIELDS)
+    history = [window for window in value_store.get(key, []) if window[0] > now - _HISTORY_HORIZONS[-1][1]]
+    if not history or tuple(history[-1][1:]) != sample or now - history[-1][0] >= _WINDOW_SECONDS:
+        history.append((now, *sample))
+    value_store[key] = history
+    return history
+
+
+def _aggregate_windows(history: list, since: float) -> Optional[dict[str, float]]:
+    """attempt weighted ratios over all windows stored after since, None without attempts"""
+    totals = [0] * len(_COUNTER_FIELDS)
+    windows = 0
+    for window in history:
+        if window[0] <= since:
+            continue
+        windows += 1
+        for index, value in enumerate(window[1:]):
+            totals[index] += value
+    attempts, fails, answers, duration, pdd = totals
+    if not attempts:
+        return None
+    return {
+        "attempts": attempts,
+        "windows": windows,
+        "answer_seize_ratio": round((answers / attempts) * 100, 1),
+        "avg_call_duration": round(duration / attempts, 1),
+        "avg_postdial_delay": round((pdd / attempts) / 1000, 1),
+        "failed_call_ratio": round((fails / attempts) * 100, 1),
+    }
+
+
+def _counter_history(counters: Mapping[str, Mapping[str, int]], now: float, value_store) -> dict[str, dict]:
+    """record the current windows and return {direction: {horizon: aggregate}} for horizons with attempts"""
+    aggregates: dict[str, dict] = {}
+    for direction, direction_counters in sorted(counters.items()):
+        history = _record_counter_window(direction, direction_counters, now, value_store)
+        for horizon, seconds in _HISTORY_HORIZONS:
+            aggregate = _aggregate_windows(history, now - seconds)
+            if aggregate is not None:
+                aggregates.setdefault(direction, {})[horizon] = aggregate
+    return aggregates
+
+
+def _check_counter_history(aggregates: Mapping[str, Mapping[str, dict]], metrics: bool = True) -> CheckResult:
+    for direction, horizons in aggregates.items():
+        for horizon, aggregate in horizons.items():
+            yield Result(
+                state=State.OK,
+                notice=(
+                    f"{direction.title()} last {horizon}: ASR {aggregate['answer_seize_ratio']}%, "
+                    f"ACD {aggregate['avg_call_duration']}s, failed {aggregate['failed_call_ratio']}% "
+                    f"({aggregate['attempts']} attempts in {aggregate['windows']} intervals)"
+                ),
+            )
+            if not metrics:
+                continue
+            for metric in ("answer_seize_ratio", "avg_call_duration", "failed_call_ratio"):
+                yield Metric(name=f"{direction}_{metric}_{horizon}", value=aggregate[metric])
+
+
+def _insufficient_sample(direction: str, params: Mapping[str, Any], counters: Mapping[str, Any]) -> Optional[str]:
+    """
+    Explain why the ratio levels of a direction are not evaluated, None if
+    they are. Trunks without raw counters (older agent) are always evaluated.
+    """
+    min_attempts = params.get(direction, {}).get("min_call_attempts", 0)
+    attempts = counters.get(direction, {}).get("call_attempt")
+    if not min_attempts or attempts is None or attempts >= min_attempts:
+        return None
+    return f"{direction.title()}: insufficient sample ({attempts} of {min_attempts} call attempts)"
+
+
+# Calls rejected by the session and CPS limits are running totals on the
+# VSX. Levels and metrics work on their per-second rate.
+_LIMIT_COUNTERS = ("call_limit_exceeded", "cps_limit_exceeded")
+
+
+def _with_limit_rates(trunk_id: str, realtime: Mapping[str, Any], now: float, value_store) -> dict[str, Any]:
+    """
+    The realtime stats with the limit counters replaced by their rate. A
+    counter without a baseline, or one that went backwards after a restart
+    of the VSX, is left out for this cycle.
+    """
+    stats = dict(realtime)
+    for counter in _LIMIT_COUNTERS:
+        if counter not in stats:
+            continue
+        value = stats.pop(counter)
+        try:
+            rate = get_rate(value_store, f"sansay_vsx.{trunk_id}.{counter}", now, value, raise_overflow=True)
+        except GetRateError:
+            continue
+        stats[counter] = round(rate, 4)
+    return stats
 
 
 def check_sansay_vsx_trunks(item, params, section: Section) -> CheckResult:
@@ -104,69 +401,196 @@ def check_sansay_vsx_trunks(item, params, section: Section) -> CheckResult:
     if "calculated_stats" not in trunk_data:
         return
 
+    now = time.time()
+    value_store = get_value_store()
+    counters = trunk_data.get("counters") or {}
+    aggregates = _counter_history(counters, now, value_store) if counters else {}
+
+    # Every metric is an RRD update per cycle, which adds up on devices with
+    # thousands of trunks: only the configured groups are emitted.
+    metric_groups = _metric_groups(params, trunk_data)
+    evaluators = _trunk_evaluators(params)
     for direction, stats in trunk_data["calculated_stats"].items():
-        direction_params = params.get(direction, {})
-        direction_level_config = _METRIC_LEVEL_DIRECTION.get(direction, {})
+        direction_evaluators = evaluators.get(direction, {})
+        if direction == "realtime":
+            stats = _with_limit_rates(trunk_id, stats, now, value_store)
 
-        for metric, value in stats.items():
-            yield Metric(name=f"{direction}_{metric}", value=value)
+        if direction in metric_groups:
+            for metric, value in stats.items():
+                yield Metric(name=f"{direction}_{metric}", value=value)
 
-            bound = direction_level_config.get(metric)
-            if bound is None:
-                continue
+        if not direction_evaluators:
+            continue
 
-            level_spec = direction_params.get(f"{metric}_levels", ("no_levels", None))
-            if level_spec[0] == "no_levels":
+        # Ratios of a handful of calls are noise. Below the minimum number of
+        # attempts the levels are evaluated against the last hour instead,
+        # provided the windows of that hour add up to enough attempts.
+        level_stats, level_source = stats, ""
+        insufficient = _insufficient_sample(direction, params, counters)
+        if insufficient:
+            hourly = aggregates.get(direction, {}).get("1h")
+            if hourly is None or hourly["attempts"] < params[direction]["min_call_attempts"]:
+                yield Result(state=State.OK, notice=f"{insufficient}, ratio levels not evaluated")
                 continue
+            level_stats, level_source = hourly, " (last 1h)"
 
-            warn, crit = level_spec[1]
-            if bound == "upper":
-                state = 0
-                if value >= warn:
-                    state = 1
-                if value >= crit:
-                    state = 2
-            else:  # lower
-                state = 0
-                if value <= warn:
-                    state = 1
-                if value <= crit:
-                    state = 2
+        for metric, value in level_stats.items():
+            evaluator = direction_evaluators.get(metric)
+            if evaluator is None:
+                continue
 
+            state = evaluator.state(value)
             if state > 0:
-                label = metric.replace("_", " ").title()
-                yield Result(
-                    state=State(state),
-                    summary=f"{direction.replace('_', ' ').title()} {label}: {value}",
-                )
+                yield Result(state=State(state), summary=f"{evaluator.label}{level_source}: {value}")
+
+    yield from _check_counter_history(aggregates, "history" in metric_groups)
+
+
+def _percentile(ordered: list[float], percent: float) -> float:
+    """nearest-rank percentile of an already sorted, non-empty list"""
+    rank = max(1, math.ceil(len(ordered) * percent / 100))
+    return ordered[rank - 1]
+
+
+def check_sansay_vsx_trunks_summary(params, section: Section) -> CheckResult:
+    if not section:
+        yield Result(state=State.UNKNOWN, summary="No data from agent - check agent connectivity")
+        return
+
+    now = time.time()
+    value_store = get_value_store()
+    evaluators = _trunk_evaluators(params)
+    state_counts = {State.OK: 0, State.WARN: 0, State.CRIT: 0}
+    offenders: list[tuple[int, str, list[str]]] = []
+    origination_sessions = termination_sessions = 0
+    asr_values: list[float] = []
+
+    for trunk_id, trunk_data in section.items():
+        calculated_stats = trunk_data.get("calculated_stats", {})
+        realtime = calculated_stats.get("realtime", {})
+        origination_sessions += realtime.get("origination_sessions", 0)
+        termination_sessions += realtime.get("termination_sessions", 0)
+
+        trunk_state = 0
+        problems = []
+        for direction, stats in calculated_stats.items():
+            direction_evaluators = evaluators.get(direction, {})
+            if direction == "realtime" and any(metric in direction_evaluators for metric in _LIMIT_COUNTERS):
+                stats = _with_limit_rates(trunk_id, stats, now, value_store)
+            if direction in ("ingress", "egress") and (stats.get("answer_seize_ratio") or stats.get("failed_call_ratio")):
+                asr_values.append(stats.get("answer_seize_ratio", 0))
+            if _insufficient_sample(direction, params, trunk_data.get("counters") or {}):
+                continue
+            for metric, evaluator in direction_evaluators.items():
+                if metric not in stats:
+                    continue
+                state = evaluator.state(stats[metric])
+                if state > 0:
+                    trunk_state = max(trunk_state, state)
+                    problems.append(f"{evaluator.label}: {stats[metric]}")
+
+        state_counts[State(trunk_state)] += 1
+        if trunk_state > 0:
+            offenders.append((trunk_state, _trunk_item(trunk_id, trunk_data), problems))
+
+    problem_count = state_counts[State.WARN] + state_counts[State.CRIT]
+    yield Result(
+        state=State(check_levels_state(problem_count, params["problem_trunks_levels"])),
+        summary=(
+            f"{len(section)} trunks: {state_counts[State.OK]} OK, "
+            f"{state_counts[State.WARN]} WARN, {state_counts[State.CRIT]} CRIT"
+        ),
+    )
+
+    offenders.sort(key=lambda offender: (-offender[0], offender[1]))
+    worst = offenders[:params["worst_offenders"]]
+    if worst:
+        yield Result(
+            state=State.OK,
+            notice=f"Worst trunks: {', '.join(item for _, item, _ in worst)}",
+            details="\n".join(
+                f"{item} ({State(state).name}): {'; '.join(problems)}" for state, item, problems in worst
+            ),
+        )
+
+    yield Result(
+        state=State.OK,
+        summary=f"Sessions: {origination_sessions} origination, {termination_sessions} termination",
+    )
+    yield Metric(name="trunks_total", value=len(section))
+    yield Metric(name="trunks_warn", value=state_counts[State.WARN])
+    yield Metric(name="trunks_crit", value=state_counts[State.CRIT])
+    yield Metric(name="total_origination_sessions", value=origination_sessions)
+    yield Metric(name="total_termination_sessions", value=termination_sessions)
+
+    if asr_values:
+        asr_values.sort()
+        yield Metric(name="trunks_asr_p10", value=_percentile(asr_values, 10))
+        yield Metric(name="trunks_asr_median", value=_percentile(asr_values, 50))
+        yield Metric(name="trunks_asr_p90", value=_percentile(asr_values, 90))
+
+
+_TRUNK_DEFAULT_PARAMETERS = {
+    "egress": {
+        "failed_call_ratio_levels": ("fixed", (5.0, 15.0)),
+        "answer_seize_ratio_levels": ("fixed", (70.0, 50.0)),
+        "avg_postdial_delay_levels": ("no_levels", None),
+        "min_call_attempts": 10,
+    },
+    "ingress": {
+        "failed_call_ratio_levels": ("fixed", (5.0, 15.0)),
+        "answer_seize_ratio_levels": ("fixed", (70.0, 50.0)),
+        "avg_postdial_delay_levels": ("no_levels", None),
+        "min_call_attempts": 10,
+    },
+    "gw_egress_stat": {
+        "failed_call_ratio_levels": ("fixed", (5.0, 15.0)),
+        "answer_seize_ratio_levels": ("fixed", (70.0, 50.0)),
+        "avg_postdial_delay_levels": ("no_levels", None),
+    },
+    "realtime": {
+        "origination_utilization_levels": ("fixed", (80.0, 90.0)),
+        "termination_utilization_levels": ("fixed", (80.0, 90.0)),
+        "cps_utilization_levels": ("fixed", (80.0, 90.0)),
+        "peak_utilization_levels": ("no_levels", None),
+        "call_limit_exceeded_levels": ("no_levels", None),
+        "cps_limit_exceeded_levels": ("no_levels", None),
+    },
+    "metric_groups": list(_DEFAULT_METRIC_GROUPS),
+    "skip_idle_metrics": False,
+}
+
+_TRUNK_DISCOVERY_DEFAULT_PARAMETERS = {
+    "mode": "per_trunk",
+    "per_trunk_filter": ("all", None),
+}
 
 
 check_plugin_sansay_vsx_trunks = CheckPlugin(
     name="sansay_vsx_trunks",
     service_name="VSX trunk %s",
     discovery_function=discovery_sansay_vsx_trunks,
+    discovery_ruleset_name="sansay_vsx_trunks_discovery",
+    discovery_default_parameters=_TRUNK_DISCOVERY_DEFAULT_PARAMETERS,
     sections=["sansay_vsx_trunks"],
     check_function=check_sansay_vsx_trunks,
     check_ruleset_name="sansay_vsx_trunks",
+    check_default_parameters=_TRUNK_DEFAULT_PARAMETERS,
+)
+
+
+check_plugin_sansay_vsx_trunks_summary = CheckPlugin(
+    name="sansay_vsx_trunks_summary",
+    service_name="VSX Trunks Summary",
+    discovery_function=discovery_sansay_vsx_trunks_summary,
+    discovery_ruleset_name="sansay_vsx_trunks_discovery",
+    discovery_default_parameters=_TRUNK_DISCOVERY_DEFAULT_PARAMETERS,
+    sections=["sansay_vsx_trunks"],
+    check_function=check_sansay_vsx_trunks_summary,
+    check_ruleset_name="sansay_vsx_trunks_summary",
     check_default_parameters={
-        "egress": {
-            "failed_call_ratio_levels": ("fixed", (5.0, 15.0)),
-            "answer_seize_ratio_levels": ("fixed", (70.0, 50.0)),
-            "avg_postdial_delay_levels": ("no_levels", None),
-        },
-        "ingress": {
-            "failed_call_ratio_levels": ("fixed", (5.0, 15.0)),
-            "answer_seize_ratio_levels": ("fixed", (70.0, 50.0)),
-            "avg_postdial_delay_levels": ("no_levels", None),
-        },
-        "gw_egress_stat": {
-            "failed_call_ratio_levels": ("fixed", (5.0, 15.0)),
-            "answer_seize_ratio_levels": ("fixed", (70.0, 50.0)),
-            "avg_postdial_delay_levels": ("no_levels", None),
-        },
-        "realtime": {
-            "origination_utilization_levels": ("fixed", (80.0, 90.0)),
-            "termination_utilization_levels": ("fixed", (80.0, 90.0)),
-        },
+        **_TRUNK_DEFAULT_PARAMETERS,
+        "problem_trunks_levels": ("fixed", (1, 10)),
+        "worst_offenders": 10,
     },
 )
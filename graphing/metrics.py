@@ -5,7 +5,7 @@
 
 # License: GNU General Public License v2
 
-from cmk.graphing.v1.metrics import Color, DecimalNotation, Metric, StrictPrecision, Title, Unit, Product
+from cmk.graphing.v1.metrics import Color, DecimalNotation, IECNotation, Metric, StrictPrecision, Title, Unit, Product
 from cmk.graphing.v1.graphs import Graph
 
 unit_percent = Unit(
@@ -23,6 +23,16 @@ unit_seconds = Unit(
     StrictPrecision(1)
 )
 
+unit_per_second = Unit(
+    DecimalNotation("/s"),
+    StrictPrecision(2)
+)
+
+unit_bytes = Unit(
+    IECNotation("B"),
+    StrictPrecision(1)
+)
+
 
 metric_sansay_cpu_utilization = Metric(
     name="cpu_utilization",
@@ -52,6 +62,34 @@ metric_sansay_session_utilization_avg = Metric(
     color=Color.CYAN,
 )
 
+metric_sansay_cluster_active_sessions = Metric(
+    name="cluster_active_sessions",
+    title=Title("Cluster Active Sessions"),
+    unit=unit_count,
+    color=Color.BLUE,
+)
+
+metric_sansay_cluster_peak_sessions = Metric(
+    name="cluster_peak_sessions",
+    title=Title("Cluster Peak Sessions"),
+    unit=unit_count,
+    color=Color.ORANGE,
+)
+
+metric_sansay_session_utilization_expected = Metric(
+    name="session_utilization_expected",
+    title=Title("Session Utilization (Forecast)"),
+    unit=unit_percent,
+    color=Color.GRAY,
+)
+
+metric_sansay_session_utilization_deviation = Metric(
+    name="session_utilization_deviation",
+    title=Title("Session Utilization Deviation from Forecast"),
+    unit=Unit(DecimalNotation("sigma"), StrictPrecision(1)),
+    color=Color.PINK,
+)
+
 metric_sansay_session_utilization_trend = Product(
     title=Title("Session Utilization Trend"),
     unit=unit_percent,
@@ -63,6 +101,44 @@ metric_sansay_session_utilization_trend = Product(
 )
 
 
+metric_sansay_attempt_rate = Metric(
+    name="attempt_rate",
+    title=Title("Call Attempt Rate"),
+    unit=unit_per_second,
+    color=Color.BLUE,
+)
+
+metric_sansay_cps_utilization = Metric(
+    name="cps_utilization",
+    title=Title("CPS Utilization"),
+    unit=unit_percent,
+    color=Color.ORANGE,
+)
+
+metric_sansay_cps_exceed_rate = Metric(
+    name="cps_exceed_rate",
+    title=Title("CPS Limit Exceeded Rate"),
+    unit=unit_per_second,
+    color=Color.RED,
+)
+
+metric_sansay_session_exceed_rate = Metric(
+    name="session_exceed_rate",
+    title=Title("Session Limit Exceeded Rate"),
+    unit=unit_per_second,
+    color=Color.PURPLE,
+)
+
+graph_sansay_vsx_system_limit_exceed = Graph(
+    name="sansay_vsx_system_limit_exceed",
+    title=Title("Sansay VSX Limit Exceeded Rates"),
+    simple_lines=[
+        "cps_exceed_rate",
+        "session_exceed_rate",
+    ],
+)
+
+
 metric_sansay_num_active_sessions = Metric(
     name="num_active_sessions",
     title=Title("Active Sessions"),
@@ -86,6 +162,7 @@ graph_sansay_vsx_system = Graph(
     simple_lines=[
         "cpu_utilization",
         "metric_sansay_session_utilization_trend",
+        "session_utilization_expected",
     ],
     compound_lines=[
         "session_utilization",
@@ -93,6 +170,8 @@ graph_sansay_vsx_system = Graph(
     optional=[
         # Only emitted when rolling average mode is enabled in check parameters
         "session_utilization_avg",
+        # Only emitted when forecast levels are configured
+        "session_utilization_expected",
     ],
 )
 
@@ -195,6 +274,137 @@ metric_realtime_termination_utilization = Metric(
     color=Color.PURPLE,
 )
 
+metric_realtime_cps = Metric(
+    name="realtime_cps",
+    title=Title("Calls per Second"),
+    unit=unit_count,
+    color=Color.BLUE,
+)
+
+metric_realtime_cps_utilization = Metric(
+    name="realtime_cps_utilization",
+    title=Title("CPS Utilization"),
+    unit=unit_percent,
+    color=Color.BLUE,
+)
+
+metric_realtime_peak_sessions = Metric(
+    name="realtime_peak_sessions",
+    title=Title("Peak Sessions"),
+    unit=unit_count,
+    color=Color.GREEN,
+)
+
+metric_realtime_peak_utilization = Metric(
+    name="realtime_peak_utilization",
+    title=Title("Peak Session Utilization"),
+    unit=unit_percent,
+    color=Color.GREEN,
+)
+
+metric_realtime_call_limit_exceeded = Metric(
+    name="realtime_call_limit_exceeded",
+    title=Title("Calls Rejected by Session Limit per Second"),
+    unit=unit_per_second,
+    color=Color.RED,
+)
+
+metric_realtime_cps_limit_exceeded = Metric(
+    name="realtime_cps_limit_exceeded",
+    title=Title("Calls Rejected by CPS Limit per Second"),
+    unit=unit_per_second,
+    color=Color.ORANGE,
+)
+
+
+# =============================================================================
+# Trunk metrics — hourly and daily aggregates of the 15 minute counters
+# =============================================================================
+
+metric_ingress_answer_seize_ratio_1h = Metric(
+    name="ingress_answer_seize_ratio_1h",
+    title=Title("Ingress Answer Seize Ratio (1h)"),
+    unit=unit_percent,
+    color=Color.BLUE,
+)
+
+metric_ingress_answer_seize_ratio_24h = Metric(
+    name="ingress_answer_seize_ratio_24h",
+    title=Title("Ingress Answer Seize Ratio (24h)"),
+    unit=unit_percent,
+    color=Color.CYAN,
+)
+
+metric_ingress_avg_call_duration_1h = Metric(
+    name="ingress_avg_call_duration_1h",
+    title=Title("Ingress Avg Call Duration (1h)"),
+    unit=unit_seconds,
+    color=Color.BLUE,
+)
+
+metric_ingress_avg_call_duration_24h = Metric(
+    name="ingress_avg_call_duration_24h",
+    title=Title("Ingress Avg Call Duration (24h)"),
+    unit=unit_seconds,
+    color=Color.CYAN,
+)
+
+metric_ingress_failed_call_ratio_1h = Metric(
+    name="ingress_failed_call_ratio_1h",
+    title=Title("Ingress Failed Call Ratio (1h)"),
+    unit=unit_percent,
+    color=Color.BLUE,
+)
+
+metric_ingress_failed_call_ratio_24h = Metric(
+    name="ingress_failed_call_ratio_24h",
+    title=Title("Ingress Failed Call Ratio (24h)"),
+    unit=unit_percent,
+    color=Color.CYAN,
+)
+
+metric_egress_answer_seize_ratio_1h = Metric(
+    name="egress_answer_seize_ratio_1h",
+    title=Title("Egress Answer Seize Ratio (1h)"),
+    unit=unit_percent,
+    color=Color.GREEN,
+)
+
+metric_egress_answer_seize_ratio_24h = Metric(
+    name="egress_answer_seize_ratio_24h",
+    title=Title("Egress Answer Seize Ratio (24h)"),
+    unit=unit_percent,
+    color=Color.YELLOW,
+)
+
+metric_egress_avg_call_duration_1h = Metric(
+    name="egress_avg_call_duration_1h",
+    title=Title("Egress Avg Call Duration (1h)"),
+    unit=unit_seconds,
+    color=Color.GREEN,
+)
+
+metric_egress_avg_call_duration_24h = Metric(
+    name="egress_avg_call_duration_24h",
+    title=Title("Egress Avg Call Duration (24h)"),
+    unit=unit_seconds,
+    color=Color.YELLOW,
+)
+
+metric_egress_failed_call_ratio_1h = Metric(
+    name="egress_failed_call_ratio_1h",
+    title=Title("Egress Failed Call Ratio (1h)"),
+    unit=unit_percent,
+    color=Color.GREEN,
+)
+
+metric_egress_failed_call_ratio_24h = Metric(
+    name="egress_failed_call_ratio_24h",
+    title=Title("Egress Failed Call Ratio (24h)"),
+    unit=unit_percent,
+    color=Color.YELLOW,
+)
+
 
 # =============================================================================
 # Trunk graph groupings
@@ -251,5 +461,226 @@ graph_sansay_vsx_trunk_realtime_utilization = Graph(
     simple_lines=[
         "realtime_origination_utilization",
         "realtime_termination_utilization",
+        "realtime_cps_utilization",
+        "realtime_peak_utilization",
+    ],
+)
+
+graph_sansay_vsx_trunk_limit_exceeded = Graph(
+    name="sansay_vsx_trunk_limit_exceeded",
+    title=Title("Trunk Calls Rejected by Limits per Second"),
+    simple_lines=[
+        "realtime_call_limit_exceeded",
+        "realtime_cps_limit_exceeded",
+    ],
+)
+
+graph_sansay_vsx_trunk_answer_seize_ratio_history = Graph(
+    name="sansay_vsx_trunk_answer_seize_ratio_history",
+    title=Title("Trunk Answer Seize Ratio (1h / 24h)"),
+    simple_lines=[
+        "ingress_answer_seize_ratio_1h",
+        "ingress_answer_seize_ratio_24h",
+        "egress_answer_seize_ratio_1h",
+        "egress_answer_seize_ratio_24h",
+    ],
+)
+
+graph_sansay_vsx_trunk_avg_call_duration_history = Graph(
+    name="sansay_vsx_trunk_avg_call_duration_history",
+    title=Title("Trunk Avg Call Duration (1h / 24h)"),
+    simple_lines=[
+        "ingress_avg_call_duration_1h",
+        "ingress_avg_call_duration_24h",
+        "egress_avg_call_duration_1h",
+        "egress_avg_call_duration_24h",
+    ],
+)
+
+graph_sansay_vsx_trunk_failed_call_ratio_history = Graph(
+    name="sansay_vsx_trunk_failed_call_ratio_history",
+    title=Title("Trunk Failed Call Ratio (1h / 24h)"),
+    simple_lines=[
+        "ingress_failed_call_ratio_1h",
+        "ingress_failed_call_ratio_24h",
+        "egress_failed_call_ratio_1h",
+        "egress_failed_call_ratio_24h",
+    ],
+)
+
+
+# =============================================================================
+# Trunks summary metrics
+# =============================================================================
+
+metric_trunks_total = Metric(
+    name="trunks_total",
+    title=Title("Trunks"),
+    unit=unit_count,
+    color=Color.GRAY,
+)
+
+metric_trunks_warn = Metric(
+    name="trunks_warn",
+    title=Title("Trunks in WARN"),
+    unit=unit_count,
+    color=Color.YELLOW,
+)
+
+metric_trunks_crit = Metric(
+    name="trunks_crit",
+    title=Title("Trunks in CRIT"),
+    unit=unit_count,
+    color=Color.RED,
+)
+
+metric_total_origination_sessions = Metric(
+    name="total_origination_sessions",
+    title=Title("Total Origination Sessions"),
+    unit=unit_count,
+    color=Color.ORANGE,
+)
+
+metric_total_termination_sessions = Metric(
+    name="total_termination_sessions",
+    title=Title("Total Termination Sessions"),
+    unit=unit_count,
+    color=Color.PURPLE,
+)
+
+metric_trunks_asr_p10 = Metric(
+    name="trunks_asr_p10",
+    title=Title("Trunk ASR 10th Percentile"),
+    unit=unit_percent,
+    color=Color.RED,
+)
+
+metric_trunks_asr_median = Metric(
+    name="trunks_asr_median",
+    title=Title("Trunk ASR Median"),
+    unit=unit_percent,
+    color=Color.BLUE,
+)
+
+metric_trunks_asr_p90 = Metric(
+    name="trunks_asr_p90",
+    title=Title("Trunk ASR 90th Percentile"),
+    unit=unit_percent,
+    color=Color.GREEN,
+)
+
+graph_sansay_vsx_trunks_problems = Graph(
+    name="sansay_vsx_trunks_problems",
+    title=Title("Trunks in WARN or CRIT"),
+    compound_lines=[
+        "trunks_warn",
+        "trunks_crit",
+    ],
+)
+
+graph_sansay_vsx_trunks_sessions = Graph(
+    name="sansay_vsx_trunks_sessions",
+    title=Title("Total Trunk Sessions"),
+    compound_lines=[
+        "total_origination_sessions",
+        "total_termination_sessions",
+    ],
+)
+
+graph_sansay_vsx_trunks_asr_distribution = Graph(
+    name="sansay_vsx_trunks_asr_distribution",
+    title=Title("Trunk ASR Distribution"),
+    simple_lines=[
+        "trunks_asr_p10",
+        "trunks_asr_median",
+        "trunks_asr_p90",
+    ],
+)
+
+# =============================================================================
+# Special agent metrics
+# =============================================================================
+
+metric_agent_response_time_resource = Metric(
+    name="agent_response_time_resource",
+    title=Title("Resource Report Response Time"),
+    unit=unit_seconds,
+    color=Color.BLUE,
+)
+
+metric_agent_response_time_realtime = Metric(
+    name="agent_response_time_realtime",
+    title=Title("Realtime Report Response Time"),
+    unit=unit_seconds,
+    color=Color.GREEN,
+)
+
+metric_agent_response_time_media_server = Metric(
+    name="agent_response_time_media_server",
+    title=Title("Media Server Report Response Time"),
+    unit=unit_seconds,
+    color=Color.ORANGE,
+)
+
+metric_agent_response_time_realtime_peer = Metric(
+    name="agent_response_time_realtime_peer",
+    title=Title("Realtime Report Response Time (HA Peer)"),
+    unit=unit_seconds,
+    color=Color.CYAN,
+)
+
+graph_sansay_vsx_agent_response_times = Graph(
+    name="sansay_vsx_agent_response_times",
+    title=Title("Sansay VSX API Response Times"),
+    simple_lines=[
+        "agent_response_time_resource",
+        "agent_response_time_realtime",
+        "agent_response_time_media_server",
+        "agent_response_time_realtime_peer",
+    ],
+    optional=[
+        "agent_response_time_realtime_peer",
+    ],
+)
+
+metric_agent_transfer_bytes_resource = Metric(
+    name="agent_transfer_bytes_resource",
+    title=Title("Resource Report Transfer Size"),
+    unit=unit_bytes,
+    color=Color.BLUE,
+)
+
+metric_agent_transfer_bytes_realtime = Metric(
+    name="agent_transfer_bytes_realtime",
+    title=Title("Realtime Report Transfer Size"),
+    unit=unit_bytes,
+    color=Color.GREEN,
+)
+
+metric_agent_transfer_bytes_media_server = Metric(
+    name="agent_transfer_bytes_media_server",
+    title=Title("Media Server Report Transfer Size"),
+    unit=unit_bytes,
+    color=Color.ORANGE,
+)
+
+metric_agent_transfer_bytes_realtime_peer = Metric(
+    name="agent_transfer_bytes_realtime_peer",
+    title=Title("Realtime Report Transfer Size (HA Peer)"),
+    unit=unit_bytes,
+    color=Color.CYAN,
+)
+
+graph_sansay_vsx_agent_transfer_bytes = Graph(
+    name="sansay_vsx_agent_transfer_bytes",
+    title=Title("Sansay VSX API Transfer Size"),
+    compound_lines=[
+        "agent_transfer_bytes_resource",
+        "agent_transfer_bytes_realtime",
+        "agent_transfer_bytes_media_server",
+        "agent_transfer_bytes_realtime_peer",
+    ],
+    optional=[
+        "agent_transfer_bytes_realtime_peer",
     ],
 )
@@ -6,7 +6,13 @@
 
 import json
 import logging
-from typing import Dict, NamedTuple, Optional, Tuple
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Iterator, Mapping
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Tuple
 
 from cmk.agent_based.v2 import StringTable
 
@@ -14,6 +20,51 @@ from cmk.agent_based.v2 import StringTable
 Levels = Optional[Tuple[float, float]]
 SansayVSXAPIData = Dict[str, object]
 
+# Top level key of an incremental sansay_vsx_trunks section, see
+# parse_sansay_vsx_trunks.
+TRUNK_DELTA_KEY = "sansay_vsx_delta"
+
+# Generations an incremental section can be rebuilt for after the agent has
+# moved on: the trunk state file keeps the undo steps of that many runs.
+TRUNK_DELTA_HISTORY = 10
+
+# Top level key of a sansay_vsx_trunks section that points to a memory
+# mapped trunk snapshot, see parse_sansay_vsx_trunks.
+TRUNK_SNAPSHOT_KEY = "sansay_vsx_mmap"
+
+# snapshot path -> generation -> full trunk view of the last rebuilt
+# sections, kept for the lifetime of the check helper process.
+_TRUNK_VIEW_CACHE: Dict[str, Dict[int, dict]] = {}
+_TRUNK_VIEW_CACHE_GENERATIONS = 3
+
+# snapshot path -> mapped trunk snapshot of the last parsed section
+_TRUNK_SNAPSHOT_CACHE: Dict[str, "TrunkSnapshot"] = {}
+
+# Layout of a trunk snapshot file (little endian):
+#   header   magic, generation, number of trunks
+#   index    one NUL padded trunk id per trunk, sorted
+#   records  one fixed size record per trunk, in index order: offset and
+#            length of alias and recid in the string area, then the values
+#            of _SNAPSHOT_FIELDS as doubles
+#   strings  UTF-8 aliases and record ids
+_SNAPSHOT_MAGIC = b"SVXTRNK1"
+_SNAPSHOT_HEADER = struct.Struct("<8sQI")
+_SNAPSHOT_ID_SIZE = 32
+_SNAPSHOT_RATIOS = ("avg_postdial_delay", "avg_call_duration", "failed_call_ratio", "answer_seize_ratio")
+_SNAPSHOT_FIELDS: Tuple[Tuple[str, str, str, type], ...] = (
+    *(("calculated_stats", direction, name, float) for direction in ("ingress", "egress") for name in _SNAPSHOT_RATIOS),
+    *(("calculated_stats", "realtime", name, kind) for name, kind in (
+        ("origination_sessions", int), ("origination_utilization", float),
+        ("termination_sessions", int), ("termination_utilization", float),
+        ("cps", int), ("cps_utilization", float),
+        ("peak_sessions", int), ("peak_utilization", float),
+        ("call_limit_exceeded", int), ("cps_limit_exceeded", int),
+    )),
+    *(("counters", direction, name, int) for direction in ("ingress", "egress")
+      for name in ("call_attempt", "call_fail", "call_answer", "call_duration", "pdd_ms")),
+)
+_SNAPSHOT_RECORD = struct.Struct("<IIII" + "d" * len(_SNAPSHOT_FIELDS))
+
 
 class Perfdata(NamedTuple):
     """normal monitoring performance data"""
@@ -25,6 +76,51 @@ class Perfdata(NamedTuple):
     boundaries: Optional[Tuple[Optional[float], Optional[float]]]
 
 
+class LevelsEvaluator(NamedTuple):
+    """compiled ("fixed", (warn, crit)) levels with a precomputed result label"""
+
+    warn: float
+    crit: float
+    upper: bool
+    label: str = ""
+
+    def state(self, value: float) -> int:
+        """evaluate value against the levels, returning 0/1/2"""
+        if self.upper:
+            if value >= self.crit:
+                return 2
+            if value >= self.warn:
+                return 1
+        else:
+            if value <= self.crit:
+                return 2
+            if value <= self.warn:
+                return 1
+        return 0
+
+
+def compile_levels(level_spec, bound: str = "upper", label: str = "") -> Optional[LevelsEvaluator]:
+    """
+    Compile a SimpleLevels spec once, None for ("no_levels", None) so that
+    callers can skip the metric without evaluating anything.
+    """
+    if not level_spec or level_spec[0] == "no_levels":
+        return None
+    _, (warn, crit) = level_spec
+    return LevelsEvaluator(float(warn), float(crit), bound == "upper", label)
+
+
+def check_levels_state(value: float, level_spec, bound: str = "upper") -> int:
+    """
+    Evaluate a value against a SimpleLevels spec, returning 0/1/2.
+
+    Handles both ("fixed", (warn, crit)) and ("no_levels", None) — the latter
+    always returns 0, allowing metric collection without alerting.
+    """
+    evaluator = compile_levels(level_spec, bound)
+    return 0 if evaluator is None else evaluator.state(value)
+
+
 def sansay_vsx_logger(file_name, log_format, log_level=logging.ERROR):
     formatter = logging.Formatter(log_format)
     fh = logging.FileHandler(file_name)
@@ -42,3 +138,266 @@ def parse_sansay_vsx(string_table: StringTable) -> SansayVSXAPIData:
         return json_data
     except (IndexError, json.decoder.JSONDecodeError):
         return {}
+
+
+def sansay_vsx_state_dir() -> Path:
+    """Default directory for state files shared by the agent and the parsers"""
+    omd_root = os.environ.get("OMD_ROOT")
+    if omd_root:
+        return Path(omd_root, "tmp", "check_mk", "sansay_vsx")
+    return Path(tempfile.gettempdir(), "sansay_vsx")
+
+
+def load_state_file(path: Path) -> dict:
+    """load a JSON state file, an unreadable or missing file is an empty state"""
+    try:
+        with open(path, encoding="utf-8") as state_file:
+            state = json.load(state_file)
+    except (OSError, json.decoder.JSONDecodeError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def save_state_file(path: Path, state: dict) -> None:
+    """atomically replace a JSON state file so readers never see partial content"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def trunk_view_at(state: Mapping[str, Any], generation: int) -> Optional[dict]:
+    """
+    The full trunk view of an agent trunk state file at generation, undoing
+    the runs after it with the "undo" steps of the state file. Each step of
+    generation G holds the membership before G and the previous data of the
+    trunks G changed or removed. None if the state does not go back that far.
+    """
+    current = state.get("generation")
+    if current is None or generation > current:
+        return None
+    view = state.get("trunks", {})
+    steps = {step["generation"]: step for step in state.get("undo", [])}
+    while current > generation:
+        step = steps.get(current)
+        if step is None:
+            return None
+        previous = step["previous"]
+        view = {trunk_id: previous[trunk_id] if trunk_id in previous else view[trunk_id]
+                for trunk_id in step["members"]}
+        current -= 1
+    return view
+
+
+def _remember_trunk_view(snapshot: str, generation: int, view: dict) -> None:
+    views = _TRUNK_VIEW_CACHE.setdefault(snapshot, {})
+    views[generation] = view
+    for old in sorted(views)[:-_TRUNK_VIEW_CACHE_GENERATIONS]:
+        del views[old]
+
+
+def rebuild_trunk_view(delta: dict) -> dict:
+    """
+    Rebuild the full trunk view from an incremental section.
+
+    The delta carries the generation it was computed against ("base"), the
+    current trunk membership and only the trunks whose data changed. The
+    previous view comes from the in-process cache when it holds "base" (or
+    already this generation), otherwise the view is taken from the agent's
+    state file, which can also go back a few generations for cached agent
+    output that is parsed again after the agent moved on. Without either
+    the view is empty rather than partial. A full section has no "base" and
+    replaces the view outright.
+    """
+    generation = delta["generation"]
+    base = delta.get("base")
+    snapshot = delta.get("snapshot", "")
+    changed = delta.get("changed", {})
+    members = delta.get("members", [])
+
+    if base is None:
+        view = dict(changed)
+    else:
+        cached = _TRUNK_VIEW_CACHE.get(snapshot, {})
+        if generation in cached:
+            return cached[generation]
+        if base in cached:
+            previous = cached[base]
+            view = {}
+            for trunk_id in members:
+                if trunk_id in changed:
+                    view[trunk_id] = changed[trunk_id]
+                elif trunk_id in previous:
+                    view[trunk_id] = previous[trunk_id]
+        else:
+            state = load_state_file(Path(snapshot)) if snapshot else {}
+            view = trunk_view_at(state, generation)
+            if view is None:
+                # Publishing the changed trunks alone would make every unchanged
+                # trunk vanish for this cycle, so report no trunks until the next
+                # full section or a readable state resynchronises the view.
+                logging.getLogger(__name__).warning(
+                    "sansay_vsx: trunk state does not cover generation %s, skipping trunk delta until the next "
+                    "full section", generation
+                )
+                return {}
+
+    _remember_trunk_view(snapshot, generation, view)
+    return view
+
+
+def _snapshot_layout(trunk: Mapping[str, Any]) -> bool:
+    """whether a processed trunk is exactly representable by a snapshot record"""
+    if set(trunk) != {"alias", "recid", "calculated_stats", "counters"}:
+        return False
+    groups: Dict[Tuple[str, str], set] = {}
+    for group, direction, name, _kind in _SNAPSHOT_FIELDS:
+        groups.setdefault((group, direction), set()).add(name)
+    for group in ("calculated_stats", "counters"):
+        directions = {direction for group_name, direction in groups if group_name == group}
+        if not isinstance(trunk[group], dict) or set(trunk[group]) != directions:
+            return False
+        if any(set(trunk[group][direction]) != groups[(group, direction)] for direction in directions):
+            return False
+    return True
+
+
+def write_trunk_snapshot(path: Path, generation: int, trunks: Mapping[str, Any]) -> bool:
+    """
+    Atomically write the trunks as a snapshot file for TrunkSnapshot. Returns
+    False without writing anything when a trunk does not fit the fixed layout.
+    """
+    encoded_ids = {trunk_id: str(trunk_id).encode("utf-8") for trunk_id in trunks}
+    if any(len(encoded) > _SNAPSHOT_ID_SIZE or b"\0" in encoded for encoded in encoded_ids.values()):
+        return False
+    if not all(_snapshot_layout(trunk) for trunk in trunks.values()):
+        return False
+
+    order = sorted(trunks, key=lambda trunk_id: encoded_ids[trunk_id].ljust(_SNAPSHOT_ID_SIZE, b"\0"))
+    index = bytearray()
+    records = bytearray()
+    strings = bytearray()
+    for trunk_id in order:
+        trunk = trunks[trunk_id]
+        index += encoded_ids[trunk_id].ljust(_SNAPSHOT_ID_SIZE, b"\0")
+        alias = str(trunk["alias"]).encode("utf-8")
+        recid = json.dumps(trunk["recid"]).encode("utf-8")
+        alias_offset = len(strings)
+        strings += alias + recid
+        records += _SNAPSHOT_RECORD.pack(
+            alias_offset, len(alias), alias_offset + len(alias), len(recid),
+            *(float(trunk[group][direction][name]) for group, direction, name, _kind in _SNAPSHOT_FIELDS),
+        )
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as snapshot_file:
+        snapshot_file.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, generation, len(order)))
+        snapshot_file.write(index)
+        snapshot_file.write(records)
+        snapshot_file.write(strings)
+    os.replace(tmp_path, path)
+    return True
+
+
+class TrunkSnapshot(Mapping):
+    """
+    Read-only trunk view on a memory mapped snapshot file.
+
+    Check helpers that map the same file share its pages instead of each
+    holding a parsed copy, and a trunk is only decoded when it is looked up.
+    """
+
+    def __init__(self, path: Path) -> None:
+        with open(path, "rb") as snapshot_file:
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self._count = _SNAPSHOT_HEADER.unpack_from(self._map, 0)
+        self._records = _SNAPSHOT_HEADER.size + self._count * _SNAPSHOT_ID_SIZE
+        if magic != _SNAPSHOT_MAGIC or len(self._map) < self._records + self._count * _SNAPSHOT_RECORD.size:
+            self._map.close()
+            raise ValueError(f"{path} is not a trunk snapshot")
+
+    def _key(self, position: int) -> bytes:
+        start = _SNAPSHOT_HEADER.size + position * _SNAPSHOT_ID_SIZE
+        return self._map[start:start + _SNAPSHOT_ID_SIZE]
+
+    def _position(self, trunk_id: object) -> Optional[int]:
+        key = str(trunk_id).encode("utf-8")
+        if len(key) > _SNAPSHOT_ID_SIZE:
+            return None
+        key = key.ljust(_SNAPSHOT_ID_SIZE, b"\0")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self._count and self._key(low) == key else None
+
+    def __getitem__(self, trunk_id: object) -> dict:
+        position = self._position(trunk_id)
+        if position is None:
+            raise KeyError(trunk_id)
+        alias_offset, alias_length, recid_offset, recid_length, *values = _SNAPSHOT_RECORD.unpack_from(
+            self._map, self._records + position * _SNAPSHOT_RECORD.size
+        )
+        strings = self._records + self._count * _SNAPSHOT_RECORD.size
+        trunk: dict = {
+            "alias": self._map[strings + alias_offset:strings + alias_offset + alias_length].decode("utf-8"),
+            "recid": json.loads(self._map[strings + recid_offset:strings + recid_offset + recid_length]),
+            "calculated_stats": {},
+            "counters": {},
+        }
+        for (group, direction, name, kind), value in zip(_SNAPSHOT_FIELDS, values):
+            trunk[group].setdefault(direction, {})[name] = kind(value)
+        return trunk
+
+    def __contains__(self, trunk_id: object) -> bool:
+        return self._position(trunk_id) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(self._count):
+            yield self._key(position).rstrip(b"\0").decode("utf-8")
+
+    def __len__(self) -> int:
+        return self._count
+
+
+def load_trunk_snapshot(reference: Mapping[str, Any]) -> Mapping[str, Any]:
+    """
+    The trunk view of a snapshot section: the mapped snapshot file when it
+    is at the generation of the section, otherwise the agent's JSON state
+    file, otherwise nothing.
+    """
+    generation = reference["generation"]
+    snapshot = reference.get("snapshot", "")
+    cached = _TRUNK_SNAPSHOT_CACHE.get(snapshot)
+    if cached is not None and cached.generation == generation:
+        return cached
+    try:
+        view = TrunkSnapshot(Path(snapshot))
+    except (OSError, ValueError, struct.error):
+        view = None
+    if view is not None and view.generation == generation:
+        _TRUNK_SNAPSHOT_CACHE[snapshot] = view
+        return view
+
+    state = load_state_file(Path(reference["json"])) if reference.get("json") else {}
+    if state.get("generation") == generation:
+        return state.get("trunks", {})
+    logging.getLogger(__name__).warning(
+        "sansay_vsx: no trunk snapshot for generation %s in %s", generation, snapshot
+    )
+    return {}
+
+
+def parse_sansay_vsx_trunks(string_table: StringTable) -> SansayVSXAPIData:
+    """parse the trunk section, which may be a full dump, an incremental delta or a snapshot reference"""
+    parsed = parse_sansay_vsx(string_table)
+    if isinstance(parsed, dict) and TRUNK_DELTA_KEY in parsed:
+        return rebuild_trunk_view(parsed[TRUNK_DELTA_KEY])
+    if isinstance(parsed, dict) and TRUNK_SNAPSHOT_KEY in parsed:
+        return load_trunk_snapshot(parsed[TRUNK_SNAPSHOT_KEY])
+    return parsed
@@ -4,14 +4,18 @@
 
 # License: GNU General Public License v2
 
-from cmk.rulesets.v1 import Help, Title
+from cmk.rulesets.v1 import Help, Label, Title
 from cmk.rulesets.v1.form_specs import (
+    BooleanChoice,
     DefaultValue,
     DictElement,
     Dictionary,
     Float,
     Integer,
     LevelDirection,
+    MultipleChoice,
+    MultipleChoiceElement,
+    ServiceState,
     SimpleLevels,
     SingleChoice,
     SingleChoiceElement,
@@ -111,6 +115,126 @@ def _parameter_form_sansay_vsx_system() -> Dictionary:
                 ),
                 required=False,
             ),
+            "session_forecast_levels": DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title("Session utilization deviation from forecast"),
+                    help_text=Help(
+                        "Learn the expected session utilization for every hour of the week and alert "
+                        "when the current value deviates from it by more than the given number of "
+                        "standard deviations. Useful for strongly diurnal traffic where fixed levels "
+                        "either fire every busy hour or miss anomalies at night. "
+                        "Select 'No levels' to disable forecasting."
+                    ),
+                    form_spec_template=Float(
+                        custom_validate=(
+                            validators.NumberInRange(min_value=0.0),
+                        ),
+                    ),
+                    level_direction=LevelDirection.UPPER,
+                    prefill_fixed_levels=DefaultValue((3.0, 5.0)),
+                ),
+            ),
+            "session_forecast_alpha": DictElement(
+                parameter_form=Float(
+                    title=Title("Forecast smoothing factor"),
+                    help_text=Help(
+                        "Weight of a new sample in the per-hour baseline (0.01 - 1.0). Each hour of "
+                        "the week contributes one sample per week, the average of its checks. Smaller "
+                        "values adapt more slowly to lasting changes in traffic."
+                    ),
+                    prefill=DefaultValue(0.2),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=0.01, max_value=1.0),
+                    ),
+                ),
+            ),
+            "session_forecast_min_samples": DictElement(
+                parameter_form=Integer(
+                    title=Title("Forecast samples before alerting"),
+                    help_text=Help(
+                        "Number of samples, that is weeks, an hour-of-week baseline needs before "
+                        "deviations are evaluated."
+                    ),
+                    prefill=DefaultValue(4),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=1, max_value=1000),
+                    ),
+                ),
+            ),
+            "attempt_rate_levels": DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title("Call attempt rate"),
+                    help_text=Help(
+                        "Upper warning and critical thresholds for call attempts per second, derived "
+                        "from the sum_attempt_session counter."
+                    ),
+                    form_spec_template=Float(
+                        custom_validate=(
+                            validators.NumberInRange(min_value=0.0),
+                        ),
+                    ),
+                    level_direction=LevelDirection.UPPER,
+                    prefill_fixed_levels=DefaultValue((1000.0, 2000.0)),
+                ),
+            ),
+            "cps_utilization_levels": DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title("CPS Utilization"),
+                    help_text=Help(
+                        "Upper warning and critical thresholds for the current calls per second "
+                        "(current_cps) as a percentage of max_cps_allowed."
+                    ),
+                    form_spec_template=Float(
+                        custom_validate=(
+                            validators.NumberInRange(min_value=0.0, max_value=100.0),
+                        ),
+                    ),
+                    level_direction=LevelDirection.UPPER,
+                    prefill_fixed_levels=DefaultValue((80.0, 90.0)),
+                ),
+            ),
+            "cps_exceed_rate_levels": DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title("CPS limit exceeded rate"),
+                    help_text=Help(
+                        "Upper warning and critical thresholds for calls per second rejected because "
+                        "max_cps_allowed was exceeded."
+                    ),
+                    form_spec_template=Float(
+                        custom_validate=(
+                            validators.NumberInRange(min_value=0.0),
+                        ),
+                    ),
+                    level_direction=LevelDirection.UPPER,
+                    prefill_fixed_levels=DefaultValue((0.01, 0.1)),
+                ),
+            ),
+            "session_exceed_rate_levels": DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title("Session limit exceeded rate"),
+                    help_text=Help(
+                        "Upper warning and critical thresholds for calls per second rejected because "
+                        "max_session_allowed was exceeded."
+                    ),
+                    form_spec_template=Float(
+                        custom_validate=(
+                            validators.NumberInRange(min_value=0.0),
+                        ),
+                    ),
+                    level_direction=LevelDirection.UPPER,
+                    prefill_fixed_levels=DefaultValue((0.01, 0.1)),
+                ),
+            ),
+            "ha_state_change_state": DictElement(
+                parameter_form=ServiceState(
+                    title=Title("State on HA state change or failover"),
+                    help_text=Help(
+                        "Monitoring state reported for one check cycle when the HA state of the "
+                        "VSX changes or, in cluster mode, when the active member changes."
+                    ),
+                    prefill=DefaultValue(ServiceState.WARN),
+                ),
+            ),
         },
     )
 
@@ -212,6 +336,22 @@ def _trunk_stat_direction_dictionary(title_str: str) -> Dictionary:
                     prefill_fixed_levels=DefaultValue((3.0, 5.0)),
                 ),
             ),
+            "min_call_attempts": DictElement(
+                parameter_form=Integer(
+                    title=Title("Minimum call attempts"),
+                    help_text=Help(
+                        "Only evaluate the ratio levels above once the last 15 minute interval "
+                        "has at least this many call attempts. Below that, the levels are "
+                        "evaluated against the last hour if it adds up to enough attempts, "
+                        "otherwise the direction is reported OK as an insufficient sample. "
+                        "Set to 0 to always evaluate."
+                    ),
+                    prefill=DefaultValue(10),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=0),
+                    ),
+                ),
+            ),
         },
     )
 
@@ -267,9 +407,104 @@ def _parameter_form_sansay_vsx_trunks() -> Dictionary:
                                 prefill_fixed_levels=DefaultValue((80.0, 90.0)),
                             ),
                         ),
+                        "cps_utilization_levels": DictElement(
+                            parameter_form=SimpleLevels(
+                                title=Title("CPS Utilization"),
+                                help_text=Help(
+                                    "Upper warning and critical thresholds for the current calls per "
+                                    "second of the trunk as a percentage of its CPS limit."
+                                ),
+                                form_spec_template=Float(
+                                    custom_validate=(
+                                        validators.NumberInRange(min_value=0.0, max_value=100.0),
+                                    ),
+                                ),
+                                level_direction=LevelDirection.UPPER,
+                                prefill_fixed_levels=DefaultValue((80.0, 90.0)),
+                            ),
+                        ),
+                        "peak_utilization_levels": DictElement(
+                            parameter_form=SimpleLevels(
+                                title=Title("Peak Session Utilization"),
+                                help_text=Help(
+                                    "Upper warning and critical thresholds for the peak number of "
+                                    "sessions as a percentage of the trunk session limit."
+                                ),
+                                form_spec_template=Float(
+                                    custom_validate=(
+                                        validators.NumberInRange(min_value=0.0, max_value=100.0),
+                                    ),
+                                ),
+                                level_direction=LevelDirection.UPPER,
+                                prefill_fixed_levels=DefaultValue((80.0, 90.0)),
+                            ),
+                        ),
+                        "call_limit_exceeded_levels": DictElement(
+                            parameter_form=SimpleLevels(
+                                title=Title("Rate of calls rejected by session limit"),
+                                help_text=Help(
+                                    "Upper warning and critical thresholds for the calls per second the "
+                                    "device rejects because the trunk session limit is reached. The "
+                                    "rate is derived from the running total the device reports."
+                                ),
+                                form_spec_template=Float(
+                                    unit_symbol="/s",
+                                    custom_validate=(
+                                        validators.NumberInRange(min_value=0.0),
+                                    ),
+                                ),
+                                level_direction=LevelDirection.UPPER,
+                                prefill_fixed_levels=DefaultValue((0.1, 1.0)),
+                            ),
+                        ),
+                        "cps_limit_exceeded_levels": DictElement(
+                            parameter_form=SimpleLevels(
+                                title=Title("Rate of calls rejected by CPS limit"),
+                                help_text=Help(
+                                    "Upper warning and critical thresholds for the calls per second the "
+                                    "device rejects because the trunk CPS limit is reached. The "
+                                    "rate is derived from the running total the device reports."
+                                ),
+                                form_spec_template=Float(
+                                    unit_symbol="/s",
+                                    custom_validate=(
+                                        validators.NumberInRange(min_value=0.0),
+                                    ),
+                                ),
+                                level_direction=LevelDirection.UPPER,
+                                prefill_fixed_levels=DefaultValue((0.1, 1.0)),
+                            ),
+                        ),
                     },
                 ),
             ),
+            "metric_groups": DictElement(
+                parameter_form=MultipleChoice(
+                    title=Title("Metrics per trunk"),
+                    help_text=Help(
+                        "Groups of metrics recorded for every trunk. Every metric is a graph updated "
+                        "on every check cycle, so on devices with many trunks leaving out groups that "
+                        "are not needed considerably reduces the load on the monitoring server. "
+                        "Thresholds are evaluated regardless of this setting. The legacy gateway "
+                        "egress group of older agents is recorded with egress unless it duplicates it. "
+                        "The last hour and day ratios add six metrics per trunk and are not recorded "
+                        "unless selected; they are always shown in the service details."
+                    ),
+                    elements=[
+                        MultipleChoiceElement(name="ingress", title=Title("Ingress call ratios")),
+                        MultipleChoiceElement(name="egress", title=Title("Egress call ratios")),
+                        MultipleChoiceElement(name="realtime", title=Title("Realtime sessions and utilization")),
+                        MultipleChoiceElement(name="history", title=Title("Last hour and day call ratios")),
+                    ],
+                    prefill=DefaultValue(["ingress", "egress", "realtime"]),
+                ),
+            ),
+            "skip_idle_metrics": DictElement(
+                parameter_form=BooleanChoice(
+                    title=Title("Metrics of idle trunks"),
+                    label=Label("do not record metrics of trunks without sessions and call attempts"),
+                ),
+            ),
         },
     )
 
@@ -281,3 +516,55 @@ rule_spec_sansay_vsx_trunks = CheckParameters(
     parameter_form=_parameter_form_sansay_vsx_trunks,
     condition=HostAndItemCondition(item_title=Title("Trunk")),
 )
+
+
+def _parameter_form_sansay_vsx_trunks_summary() -> Dictionary:
+    return Dictionary(
+        title=Title("Sansay VSX Trunks Summary"),
+        elements={
+            **{
+                name: element
+                for name, element in _parameter_form_sansay_vsx_trunks().elements.items()
+                if name not in ("metric_groups", "skip_idle_metrics")
+            },
+            "problem_trunks_levels": DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title("Number of trunks in WARN or CRIT"),
+                    help_text=Help(
+                        "Upper warning and critical thresholds for the number of trunks that "
+                        "exceed one of the trunk thresholds above."
+                    ),
+                    form_spec_template=Integer(
+                        custom_validate=(
+                            validators.NumberInRange(min_value=0),
+                        ),
+                    ),
+                    level_direction=LevelDirection.UPPER,
+                    prefill_fixed_levels=DefaultValue((1, 10)),
+                ),
+                required=True,
+            ),
+            "worst_offenders": DictElement(
+                parameter_form=Integer(
+                    title=Title("Number of worst trunks to list"),
+                    help_text=Help(
+                        "How many of the trunks in WARN or CRIT are listed in the service details."
+                    ),
+                    prefill=DefaultValue(10),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=0, max_value=1000),
+                    ),
+                ),
+                required=True,
+            ),
+        },
+    )
+
+
+rule_spec_sansay_vsx_trunks_summary = CheckParameters(
+    name="sansay_vsx_trunks_summary",
+    title=Title("Sansay VSX Trunks Summary"),
+    topic=Topic.NETWORKING,
+    parameter_form=_parameter_form_sansay_vsx_trunks_summary,
+    condition=HostCondition(),
+)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+"""Discovery rulesets for Sansay VSX check plugins."""
+
+# License: GNU General Public License v2
+
+from cmk.rulesets.v1 import Help, Label, Title
+from cmk.rulesets.v1.form_specs import (
+    BooleanChoice,
+    CascadingSingleChoice,
+    CascadingSingleChoiceElement,
+    DefaultValue,
+    DictElement,
+    Dictionary,
+    FixedValue,
+    Integer,
+    ListOf,
+    MatchingScope,
+    RegularExpression,
+    SingleChoice,
+    SingleChoiceElement,
+    validators,
+)
+from cmk.rulesets.v1.rule_specs import DiscoveryParameters, Topic
+
+
+def _trunk_id_ranges(title_str: str, help_str: str) -> ListOf:
+    """Shared list of trunk id ranges for the include and exclude options."""
+    return ListOf(
+        title=Title(title_str),
+        help_text=Help(help_str),
+        element_template=Dictionary(
+            elements={
+                "min_id": DictElement(
+                    parameter_form=Integer(title=Title("From trunk id")),
+                    required=True,
+                ),
+                "max_id": DictElement(
+                    parameter_form=Integer(title=Title("To trunk id")),
+                    required=True,
+                ),
+            },
+        ),
+    )
+
+
+def _parameter_form_sansay_vsx_trunks_discovery() -> Dictionary:
+    return Dictionary(
+        title=Title("Sansay VSX Trunk Discovery"),
+        elements={
+            "mode": DictElement(
+                parameter_form=SingleChoice(
+                    title=Title("Trunk services"),
+                    help_text=Help(
+                        "Create one service per trunk, a single aggregated 'VSX Trunks Summary' "
+                        "service evaluating all trunks in one pass, or both. The aggregated mode "
+                        "is recommended for devices with thousands of trunks."
+                    ),
+                    elements=[
+                        SingleChoiceElement(
+                            name="per_trunk",
+                            title=Title("One service per trunk"),
+                        ),
+                        SingleChoiceElement(
+                            name="aggregated",
+                            title=Title("One aggregated service per VSX"),
+                        ),
+                        SingleChoiceElement(
+                            name="both",
+                            title=Title("Aggregated service and per trunk services"),
+                        ),
+                    ],
+                    prefill=DefaultValue("per_trunk"),
+                ),
+                required=True,
+            ),
+            "per_trunk_filter": DictElement(
+                parameter_form=CascadingSingleChoice(
+                    title=Title("Restrict per trunk services"),
+                    help_text=Help(
+                        "Only create per trunk services for some trunks. Ignored in aggregated mode."
+                    ),
+                    elements=[
+                        CascadingSingleChoiceElement(
+                            name="all",
+                            title=Title("All trunks"),
+                            parameter_form=FixedValue(value=None),
+                        ),
+                        CascadingSingleChoiceElement(
+                            name="regex",
+                            title=Title("Trunks matching a regular expression"),
+                            parameter_form=RegularExpression(
+                                help_text=Help("Matched against the service item '<trunk id> <alias>'."),
+                                predefined_help_text=MatchingScope.INFIX,
+                            ),
+                        ),
+                        CascadingSingleChoiceElement(
+                            name="top_n",
+                            title=Title("Top N trunks by current sessions"),
+                            parameter_form=Integer(
+                                prefill=DefaultValue(100),
+                                custom_validate=(
+                                    validators.NumberInRange(min_value=1),
+                                ),
+                            ),
+                        ),
+                    ],
+                    prefill=DefaultValue("all"),
+                ),
+            ),
+            "include_id_ranges": DictElement(
+                parameter_form=_trunk_id_ranges(
+                    "Only trunks with ids in these ranges",
+                    "Ranges are inclusive. Trunks with non-numeric ids never match.",
+                ),
+            ),
+            "exclude_id_ranges": DictElement(
+                parameter_form=_trunk_id_ranges(
+                    "Exclude trunks with ids in these ranges",
+                    "Ranges are inclusive, for example the id block reserved for test trunks.",
+                ),
+            ),
+            "include_alias": DictElement(
+                parameter_form=RegularExpression(
+                    title=Title("Only trunks whose alias matches"),
+                    predefined_help_text=MatchingScope.INFIX,
+                ),
+            ),
+            "exclude_alias": DictElement(
+                parameter_form=RegularExpression(
+                    title=Title("Exclude trunks whose alias matches"),
+                    predefined_help_text=MatchingScope.INFIX,
+                ),
+            ),
+            "only_active": DictElement(
+                parameter_form=BooleanChoice(
+                    title=Title("Only active trunks"),
+                    label=Label("only trunks with call attempts in the last 15 minutes"),
+                    help_text=Help(
+                        "Skip trunks without any ingress or egress call attempt in the 15 minute "
+                        "window reported at discovery time."
+                    ),
+                ),
+            ),
+        },
+    )
+
+
+rule_spec_sansay_vsx_trunks_discovery = DiscoveryParameters(
+    name="sansay_vsx_trunks_discovery",
+    title=Title("Sansay VSX trunk discovery"),
+    topic=Topic.NETWORKING,
+    parameter_form=_parameter_form_sansay_vsx_trunks_discovery,
+)
+
+
+def _parameter_form_sansay_vsx_media_discovery() -> Dictionary:
+    return Dictionary(
+        title=Title("Sansay VSX Media Server Discovery"),
+        elements={
+            "include_switch_type": DictElement(
+                parameter_form=RegularExpression(
+                    title=Title("Only media servers whose switch type matches"),
+                    help_text=Help("For example 'External' to skip internal media switching."),
+                    predefined_help_text=MatchingScope.INFIX,
+                ),
+            ),
+            "exclude_switch_type": DictElement(
+                parameter_form=RegularExpression(
+                    title=Title("Exclude media servers whose switch type matches"),
+                    predefined_help_text=MatchingScope.INFIX,
+                ),
+            ),
+        },
+    )
+
+
+rule_spec_sansay_vsx_media_discovery = DiscoveryParameters(
+    name="sansay_vsx_media_discovery",
+    title=Title("Sansay VSX media server discovery"),
+    topic=Topic.NETWORKING,
+    parameter_form=_parameter_form_sansay_vsx_media_discovery,
+)
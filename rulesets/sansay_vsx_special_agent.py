@@ -121,6 +121,60 @@ def _valuespec_special_agents_sansay_vsx() -> Dictionary:
                     ),
                 ),
             ),
+            "download_deadline": DictElement(
+                parameter_form=Integer(
+                    title=Title("Advanced - Total download time per report"),
+                    help_text=Help(
+                        "Seconds after which the download of a report is aborted, however steadily "
+                        "the VSX is still sending. The connection timeout above only applies to each "
+                        "single read. Up to three reports are fetched one after another, so keep "
+                        "three times this value below the special agent timeout of Checkmk, or the "
+                        "whole agent is killed before it can report the abort. 0 disables the limit."
+                    ),
+                    prefill=DefaultValue(20),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=0, max_value=3600),
+                    ),
+                ),
+            ),
+            "min_transfer_rate": DictElement(
+                parameter_form=Integer(
+                    title=Title("Advanced - Minimum transfer rate"),
+                    help_text=Help(
+                        "Bytes per second below which a report download is aborted after its first "
+                        "5 seconds of data. 0 disables the limit."
+                    ),
+                    prefill=DefaultValue(1024),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=0),
+                    ),
+                ),
+            ),
+            "max_body_size": DictElement(
+                parameter_form=Integer(
+                    title=Title("Advanced - Maximum report size"),
+                    help_text=Help(
+                        "Size in MiB of a decompressed report above which its download is aborted, "
+                        "so that a misbehaving device cannot exhaust the memory of the monitoring "
+                        "server. 0 disables the limit."
+                    ),
+                    prefill=DefaultValue(512),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=0),
+                    ),
+                ),
+            ),
+            "adaptive_timeout": DictElement(
+                parameter_form=BooleanChoice(
+                    title=Title("Advanced - Adaptive timeouts"),
+                    label=Label("derive per-report timeouts from observed response times"),
+                    help_text=Help(
+                        "Use the 95th percentile of the recent response times of each report plus "
+                        "a margin as its timeout. The timeout configured above is used as the maximum "
+                        "and until enough response times have been recorded."
+                    ),
+                ),
+            ),
             "retries": DictElement(
                 parameter_form=Integer(
                     title=Title("Advanced - Retries for failed connection"),
@@ -133,6 +187,107 @@ def _valuespec_special_agents_sansay_vsx() -> Dictionary:
                     ),
                 ),
             ),
+            "breaker_threshold": DictElement(
+                parameter_form=Integer(
+                    title=Title("Advanced - Circuit breaker"),
+                    help_text=Help(
+                        "Number of consecutive runs without any response after which the VSX is no "
+                        "longer polled. Instead a single probe of the media server report is sent with "
+                        "an increasing backoff (1 to 15 minutes) until the device answers again."
+                    ),
+                    prefill=DefaultValue(3),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=1, max_value=100),
+                    ),
+                ),
+            ),
+            "parse_workers": DictElement(
+                parameter_form=Integer(
+                    title=Title("Advanced - Parallel resource parsing"),
+                    help_text=Help(
+                        "Number of worker processes used to parse the resource report. Only enable "
+                        "this where tests/bench_resource_parsing.py shows a speedup for the report of "
+                        "the device: the workers send their results back pickled, and on the "
+                        "reference machine the serial parser was faster at every size up to 100000 "
+                        "rows."
+                    ),
+                    prefill=DefaultValue(4),
+                    custom_validate=(
+                        validators.NumberInRange(min_value=2, max_value=32),
+                    ),
+                ),
+            ),
+            "delta_sections": DictElement(
+                parameter_form=BooleanChoice(
+                    title=Title("Incremental trunk section"),
+                    label=Label("only send trunks whose stats changed"),
+                    help_text=Help(
+                        "Keep the previous trunk stats on the monitoring server and only transfer "
+                        "trunks that changed since the last run. Recommended for devices with many idle trunks."
+                    ),
+                ),
+            ),
+            "mmap_snapshot": DictElement(
+                parameter_form=BooleanChoice(
+                    title=Title("Shared trunk snapshot"),
+                    label=Label("hand the trunks to the checks as a memory mapped file"),
+                    help_text=Help(
+                        "Write the trunks to a snapshot file on the monitoring server that all check "
+                        "helpers map into memory, instead of every helper parsing its own copy of the "
+                        "trunk section. Recommended for devices with thousands of trunks. Takes "
+                        "precedence over the incremental trunk section."
+                    ),
+                ),
+            ),
+            "disable_compression": DictElement(
+                parameter_form=BooleanChoice(
+                    title=Title("Advanced - Disable compression"),
+                    label=Label("do not request gzip/deflate compressed reports"),
+                    help_text=Help(
+                        "The agent asks the VSX for compressed reports, which makes the large resource "
+                        "report much faster to transfer over slow links. Disable this for firmware that "
+                        "sends broken compressed responses."
+                    ),
+                ),
+            ),
+            "cluster_peer": DictElement(
+                parameter_form=String(
+                    title=Title("HA cluster peer"),
+                    help_text=Help(
+                        "Address of the other member of an HA pair. Both members are probed with the "
+                        "full realtime report, the only report carrying the HA state, and the resource "
+                        "and media reports are only fetched from the active one. Monitor the pair "
+                        "through a single host with this option instead of polling both members "
+                        "independently."
+                    ),
+                    custom_validate=(validators.LengthInRange(min_value=1),),
+                ),
+            ),
+            "kpi_database": DictElement(
+                parameter_form=String(
+                    title=Title("Trunk KPI database"),
+                    help_text=Help(
+                        "Path of a SQLite database on the monitoring server the agent appends the "
+                        "per-trunk call counters to on every run. The database is downsampled to "
+                        "15 minute and hourly rows and pruned automatically, and can be queried for "
+                        "the worst trunks with the kpi_store module of this plugin."
+                    ),
+                    custom_validate=(validators.LengthInRange(min_value=1),),
+                ),
+            ),
+            "exporter_url": DictElement(
+                parameter_form=String(
+                    title=Title("Read from OpenMetrics exporter"),
+                    help_text=Help(
+                        "Base URL of an exporter started with --exporter-port for this VSX, for "
+                        "example http://127.0.0.1:9464. The agent reads the sections of the "
+                        "exporter's latest poll from its /sections endpoint instead of polling the "
+                        "VSX a second time, and only polls the VSX itself while the exporter has "
+                        "no recent data."
+                    ),
+                    custom_validate=(validators.LengthInRange(min_value=1),),
+                ),
+            ),
             "debug": DictElement(
                 parameter_form=BooleanChoice(
                     title=Title("Enable Debug Output"),
@@ -24,7 +24,19 @@ class Params(BaseModel):
     sections: list | None = None
     verify_ssl: bool | None = None
     timeout: int | None = None
+    download_deadline: int | None = None
+    min_transfer_rate: int | None = None
+    max_body_size: int | None = None
+    adaptive_timeout: bool | None = None
     retries: int | None = None
+    breaker_threshold: int | None = None
+    parse_workers: int | None = None
+    delta_sections: bool | None = None
+    mmap_snapshot: bool | None = None
+    disable_compression: bool | None = None
+    cluster_peer: str | None = None
+    kpi_database: str | None = None
+    exporter_url: str | None = None
     debug: bool | None = None
 
 
@@ -46,8 +58,32 @@ def _agent_sansay_vsx_arguments(
         command_arguments += ["--verify_ssl"]
     if params.timeout is not None:
         command_arguments += ["--timeout", str(params.timeout)]
+    if params.download_deadline is not None:
+        command_arguments += ["--deadline", str(params.download_deadline)]
+    if params.min_transfer_rate is not None:
+        command_arguments += ["--min-rate", str(params.min_transfer_rate)]
+    if params.max_body_size is not None:
+        command_arguments += ["--max-body-size", str(params.max_body_size)]
+    if params.adaptive_timeout:
+        command_arguments += ["--adaptive-timeout"]
     if params.retries is not None:
         command_arguments += ["--retries", str(params.retries)]
+    if params.breaker_threshold is not None:
+        command_arguments += ["--breaker-threshold", str(params.breaker_threshold)]
+    if params.parse_workers is not None:
+        command_arguments += ["--parse-workers", str(params.parse_workers)]
+    if params.delta_sections:
+        command_arguments += ["--delta-sections"]
+    if params.mmap_snapshot:
+        command_arguments += ["--mmap-snapshot"]
+    if params.disable_compression:
+        command_arguments += ["--no-compression"]
+    if params.cluster_peer is not None:
+        command_arguments += ["--cluster-peer", params.cluster_peer]
+    if params.kpi_database is not None:
+        command_arguments += ["--kpi-db", params.kpi_database]
+    if params.exporter_url is not None:
+        command_arguments += ["--from-exporter", params.exporter_url]
     if params.debug:
         command_arguments += ["--debug"]
 
@@ -7,21 +7,250 @@ Realtime = stats/realtime
 Resource = state/resource
 """
 
+import contextlib
+import io
+import json
 import logging
+import math
+import multiprocessing
 import re
+import socket
+import sqlite3
+import sys
+import threading
+import time
 from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
 
 import requests
 from requests.auth import HTTPBasicAuth
 
-from cmk.special_agents.v0_unstable.agent_common import SectionWriter, special_agent_main
+from cmk.special_agents.v0_unstable.agent_common import special_agent_main
 from cmk.special_agents.v0_unstable.argument_parsing import Args, create_default_argument_parser
 from cmk.utils import password_store
 from pathlib import Path
 
+from cmk_addons.plugins.sansay_vsx.lib import (
+    TRUNK_DELTA_HISTORY,
+    TRUNK_DELTA_KEY,
+    TRUNK_SNAPSHOT_KEY,
+    load_state_file,
+    sansay_vsx_state_dir,
+    save_state_file,
+    write_trunk_snapshot,
+)
+from cmk_addons.plugins.sansay_vsx.special_agents.exporter import run_exporter
+from cmk_addons.plugins.sansay_vsx.special_agents.kpi_store import store_trunk_kpis
+from cmk_addons.plugins.sansay_vsx.special_agents.profiling import run_profiled
+from cmk_addons.plugins.sansay_vsx.special_agents.recording import recorder_for, replayer_for
+
 
 LOGGER = logging.getLogger("agent_sansay_vsx")
 
+TRACE_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class BoundedTraceHandler(logging.StreamHandler):
+    """
+    StreamHandler that stops writing once max_bytes of trace output is reached.
+
+    A single truncation notice is written when the budget runs out so a debug
+    session against a large VSX can never flood the disk or the terminal.
+    The budget counts encoded bytes. A stream opened for --trace-file is
+    owned by the handler and closed with it.
+    """
+
+    def __init__(self, stream, max_bytes: int, owns_stream: bool = False) -> None:
+        super().__init__(stream)
+        self.max_bytes = max_bytes
+        self.owns_stream = owns_stream
+        self.written = 0
+        self.truncated = False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.truncated:
+            return
+        try:
+            msg = self.format(record) + self.terminator
+            size = len(msg.encode(getattr(self.stream, "encoding", None) or "utf-8", errors="replace"))
+            if self.written + size > self.max_bytes:
+                self.truncated = True
+                msg = f"... trace output truncated after {self.written} bytes{self.terminator}"
+            else:
+                self.written += size
+            self.stream.write(msg)
+            self.flush()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            if self.owns_stream and self.stream and not self.stream.closed:
+                self.flush()
+                self.stream.close()
+        finally:
+            self.release()
+            super().close()
+
+
+class RowTracer:
+    """
+    Sampled DEBUG tracing for per-row loops.
+
+    Only every Nth call is handed to LOGGER, and the arguments are formatted
+    lazily by the logging machinery, so large rows are never rendered to
+    strings unless they are actually written.
+    """
+
+    def __init__(self, every: int) -> None:
+        self.every = max(int(every), 1)
+        self.seen = 0
+
+    def __call__(self, msg: str, *args) -> None:
+        if self.seen % self.every == 0:
+            LOGGER.debug(msg, *args)
+        self.seen += 1
+
+
+class ResponseTimeHistory:
+    """
+    Response times per report of one host, persisted in a state file and
+    used to derive per-report timeouts from a high percentile plus a margin.
+    """
+
+    MAX_SAMPLES = 30
+    MIN_SAMPLES = 5
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.samples = {
+            report_name: samples
+            for report_name, samples in load_state_file(path).items()
+            if isinstance(samples, list)
+        }
+
+    def record(self, report_name: str, seconds: float) -> None:
+        samples = self.samples.setdefault(report_name, [])
+        samples.append(round(seconds, 3))
+        del samples[:-self.MAX_SAMPLES]
+
+    def timeout_for(self, report_name: str, maximum: float, percentile: float, margin: float) -> float:
+        """Nearest-rank percentile plus margin, at least 1s and at most maximum"""
+        samples = sorted(self.samples.get(report_name, []))
+        if len(samples) < self.MIN_SAMPLES:
+            return float(maximum)
+        rank = min(len(samples), max(1, math.ceil(percentile / 100 * len(samples))))
+        return round(min(float(maximum), max(1.0, samples[rank - 1] + margin)), 1)
+
+    def save(self) -> None:
+        try:
+            save_state_file(self.path, self.samples)
+        except OSError as e:
+            LOGGER.warning("unable to write response time history %s: %s", self.path, e)
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker persisted between agent runs.
+
+    After `threshold` consecutive runs in which no report could be fetched
+    the breaker opens. While open, runs are skipped until the next probe is
+    due; a probe that fails doubles the backoff up to `max_backoff`.
+    """
+
+    def __init__(self, path: Path, threshold: int, backoff: float, max_backoff: float) -> None:
+        self.path = path
+        self.threshold = threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        state = load_state_file(path)
+        self.failures = int(state.get("failures", 0))
+        self.backoff = float(state.get("backoff", 0))
+        self.next_probe = float(state.get("next_probe", 0))
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.threshold
+
+    def probe_due(self, now: float) -> bool:
+        return now >= self.next_probe
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        if self.is_open:
+            if self.failures == self.threshold:
+                self.backoff = self.base_backoff
+            else:
+                self.backoff = min(self.max_backoff, self.backoff * 2)
+            self.next_probe = now + self.backoff
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.backoff = 0
+        self.next_probe = 0
+
+    def info(self, now: float) -> dict:
+        return {
+            "state": "open" if self.is_open else "closed",
+            "failures": self.failures,
+            "next_probe_in": round(max(0.0, self.next_probe - now), 1) if self.is_open else 0,
+        }
+
+    def save(self) -> None:
+        try:
+            save_state_file(
+                self.path, {"failures": self.failures, "backoff": self.backoff, "next_probe": self.next_probe}
+            )
+        except OSError as e:
+            LOGGER.warning("unable to write circuit breaker state %s: %s", self.path, e)
+
+
+def row_tracer(args) -> RowTracer | None:
+    """Return a RowTracer when DEBUG tracing is active, otherwise None."""
+    if not LOGGER.isEnabledFor(logging.DEBUG):
+        return None
+    return RowTracer(args.trace_sample)
+
+
+def setup_tracing(args) -> BoundedTraceHandler | None:
+    """
+    Route LOGGER debug output to stderr or --trace-file, bounded by
+    --trace-max-bytes. stdout is reserved for the agent sections.
+
+    Returns the handler, to be passed to teardown_tracing when the run ends.
+    """
+    if not args.debug:
+        return None
+    for handler in [h for h in LOGGER.handlers if isinstance(h, BoundedTraceHandler)]:
+        teardown_tracing(handler)
+    if args.trace_file:
+        stream = open(args.trace_file, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+    else:
+        stream = sys.stderr
+    handler = BoundedTraceHandler(stream, args.trace_max_bytes, owns_stream=bool(args.trace_file))
+    handler.setFormatter(logging.Formatter(TRACE_FORMAT))
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.DEBUG)
+    LOGGER.propagate = False
+    return handler
+
+
+def teardown_tracing(handler: BoundedTraceHandler | None) -> None:
+    """Detach the handler of setup_tracing and close its --trace-file"""
+    if handler is None:
+        return
+    LOGGER.removeHandler(handler)
+    handler.close()
+    LOGGER.setLevel(logging.NOTSET)
+    LOGGER.propagate = True
+
+
+def state_file_path(args, name: str) -> Path:
+    """Per-host state file below --state-dir"""
+    state_dir = Path(args.state_dir) if args.state_dir else sansay_vsx_state_dir()
+    return state_dir / f"{name}_{args.host}.json"
+
 
 def parse_arguments(argv: Sequence[str] | None) -> Args:
     """Parse arguments needed to construct an URL and for connection conditions"""
@@ -79,24 +308,417 @@ def parse_arguments(argv: Sequence[str] | None) -> Args:
         type=int,
         help="""Timeout in seconds for a connection attempt""",
     )
+    parser.add_argument(
+        "--adaptive-timeout",
+        action="store_true",
+        default=False,
+        help="""Derive per-report timeouts from the observed response times, --timeout is the maximum""",
+    )
+    parser.add_argument(
+        "--timeout-percentile",
+        default=95.0,
+        type=float,
+        help="""Response time percentile used by --adaptive-timeout (default: 95)""",
+    )
+    parser.add_argument(
+        "--timeout-margin",
+        default=2.0,
+        type=float,
+        help="""Seconds added to the percentile by --adaptive-timeout (default: 2)""",
+    )
     parser.add_argument(
         "--retries",
         default=2,
         type=int,
         help="""Number auf connection retries before failing""",
     )
+    parser.add_argument(
+        "--breaker-threshold",
+        default=0,
+        type=int,
+        help="""Stop polling after this many consecutive failed runs and only probe (default: 0, disabled)""",
+    )
+    parser.add_argument(
+        "--breaker-backoff",
+        default=60.0,
+        type=float,
+        help="""Seconds until the first probe once the circuit breaker is open (default: 60)""",
+    )
+    parser.add_argument(
+        "--breaker-max-backoff",
+        default=900.0,
+        type=float,
+        help="""Upper limit of the doubling probe backoff in seconds (default: 900)""",
+    )
+    parser.add_argument(
+        "--trace-file",
+        default=None,
+        help="""Write --debug trace output to this file instead of stderr""",
+    )
+    parser.add_argument(
+        "--trace-sample",
+        default=100,
+        type=int,
+        help="""Trace only every Nth row of the per-row loops (default: 100)""",
+    )
+    parser.add_argument(
+        "--trace-max-bytes",
+        default=1024 * 1024,
+        type=int,
+        help="""Stop tracing after this many bytes of output (default: 1 MiB)""",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="DIR",
+        help="""Run the agent under cProfile and write a pstats file to DIR, with a summary on stderr""",
+    )
+    parser.add_argument(
+        "--trace-malloc",
+        default=None,
+        metavar="DIR",
+        help="""Trace memory allocations and write the top allocation sites to DIR, with a summary on stderr""",
+    )
+    parser.add_argument(
+        "--trace-malloc-top",
+        default=25,
+        type=int,
+        help="""Number of allocation sites written with --trace-malloc (default: 25)""",
+    )
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument(
+        "--record",
+        default=None,
+        metavar="DIR",
+        help="""Save the body, headers and timing of every VSX response to DIR for --replay""",
+    )
+    recording.add_argument(
+        "--replay",
+        default=None,
+        metavar="DIR",
+        help="""Answer all requests from a recording made with --record instead of contacting the VSX.
+                The state files go to DIR/state unless --state-dir is given, and --kpi-db is ignored""",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        default="fast",
+        choices=("fast", "recorded"),
+        help="""With --replay, serve responses immediately or after their recorded response times
+                (default: fast)""",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        default=0,
+        type=int,
+        help="""Parse large resource dumps with this many worker processes (default: 0, serial)""",
+    )
+    parser.add_argument(
+        "--parse-parallel-threshold",
+        default=0,
+        type=int,
+        help="""Only use --parse-workers from this many resource rows on (default: 0, always). Measure
+                the crossover for a device with tests/bench_resource_parsing.py --replay""",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=None,
+        help="""Directory for per-host state files (default: $OMD_ROOT/tmp/check_mk/sansay_vsx)""",
+    )
+    parser.add_argument(
+        "--delta-sections",
+        action="store_true",
+        default=False,
+        help="""Only send trunks whose stats changed since the previous run""",
+    )
+    parser.add_argument(
+        "--delta-full-every",
+        default=30,
+        type=int,
+        help="""With --delta-sections, send the full trunk list every N runs (default: 30)""",
+    )
+    parser.add_argument(
+        "--deadline",
+        default=0,
+        type=int,
+        help="""Abort a report download that takes longer than this many seconds in total. --timeout
+                only limits every single read. The reports are fetched one after another, keep the
+                sum below the fetch timeout of Checkmk (default: 0, disabled)""",
+    )
+    parser.add_argument(
+        "--min-rate",
+        default=0,
+        type=int,
+        help="""Abort a report download that transfers fewer bytes per second than this after its
+                first 5 seconds of data (default: 0, disabled)""",
+    )
+    parser.add_argument(
+        "--max-body-size",
+        default=512,
+        type=int,
+        help="""Abort a report download whose decompressed body exceeds this many MiB
+                (default: 512, 0 disables)""",
+    )
+    parser.add_argument(
+        "--mmap-snapshot",
+        action="store_true",
+        default=False,
+        help="""Write the trunks to a memory mapped snapshot file next to the state files and only
+                send a reference to it, so concurrent check helpers share one copy. Takes precedence
+                over --delta-sections""",
+    )
+    parser.add_argument(
+        "--no-compression",
+        action="store_true",
+        default=False,
+        help="""Do not request gzip/deflate compressed reports, for firmware that mishandles them""",
+    )
+    parser.add_argument(
+        "--degraded-retry-timeout",
+        default=5.0,
+        type=float,
+        help="""Timeout for the single re-poll of a report that came back with tables missing,
+                as happens during HA switchovers (default: 5.0)""",
+    )
+    parser.add_argument(
+        "--degraded-max-age",
+        default=900,
+        type=int,
+        help="""Fill resource tables still missing after the re-poll from the last complete resource
+                report if it is at most this many seconds old (default: 900)""",
+    )
+    parser.add_argument(
+        "--cluster-peer",
+        default=None,
+        metavar="PEER",
+        help="""Address of the other member of an HA pair. Both members are probed with the realtime
+                report and the resource and media reports are only fetched from the active one""",
+    )
+    parser.add_argument(
+        "--exporter-port",
+        default=0,
+        type=int,
+        help="""Run as a long-lived OpenMetrics exporter serving /metrics on this port instead of
+                writing agent sections once. The agent sections of each poll are served on /sections
+                (default: 0, disabled)""",
+    )
+    parser.add_argument(
+        "--exporter-address",
+        default="127.0.0.1",
+        help="""Address the exporter listens on (default: 127.0.0.1)""",
+    )
+    parser.add_argument(
+        "--exporter-interval",
+        default=60,
+        type=int,
+        help="""Seconds between polls of the VSX in exporter mode (default: 60)""",
+    )
+    parser.add_argument(
+        "--from-exporter",
+        default=None,
+        metavar="URL",
+        help="""Base URL of an exporter started with --exporter-port for this VSX, e.g.
+                http://127.0.0.1:9464. The agent sections are read from its /sections endpoint, and
+                the VSX is only polled directly if the exporter has none""",
+    )
+    parser.add_argument(
+        "--kpi-db",
+        default=None,
+        metavar="PATH",
+        help="""Append the per-trunk counters of every run to this SQLite database, see kpi_store.py
+                for the retention and the query command""",
+    )
     parser.add_argument(
         "host",
         metavar="HOSTNAME",
         help="""IP address or hostname of your Sansay VSX API""",
     )
 
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    if args.replay:
+        # A replay must neither advance the counters, last good payloads and
+        # breaker of the live host nor add its old counters to the KPI database.
+        if args.state_dir is None:
+            args.state_dir = str(Path(args.replay) / "state")
+        args.kpi_db = None
+    return args
+
+
+# Pooled HTTP sessions per VSX address. Within a run the reports share one
+# TLS connection, and a long-lived process (exporter, collector) keeps the
+# connections open between polls.
+_SESSIONS: dict[str, requests.Session] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def http_session(device: str) -> requests.Session:
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(device)
+        if session is None:
+            session = _SESSIONS[device] = requests.Session()
+    return session
+
+
+class DownloadLimitExceeded(Exception):
+    """A report download was aborted by --deadline, --min-rate or --max-body-size"""
+
+    def __init__(self, limit: str, message: str) -> None:
+        super().__init__(message)
+        self.limit = limit
+
+
+class DownloadGuard:
+    """
+    The limits of one streamed report download.
+
+    The timeout of requests applies to every socket read, so a VSX that
+    trickles a few bytes at a time could hold the agent for ever. At the
+    deadline a timer shuts the connection down, which also wakes up a read
+    that is blocked on the socket.
+
+    The deadline counts from the request, the rate floor only from the
+    response headers: a VSX that takes long to start a big report is not
+    sending slowly.
+    """
+
+    RATE_GRACE = 5.0
+
+    def __init__(self, args) -> None:
+        self.deadline = args.deadline
+        self.min_rate = args.min_rate
+        self.max_body_size = args.max_body_size
+        self.start = time.monotonic()
+        self.rate_start = None
+        self.expired = threading.Event()
+        self._response = None
+        self._timer = None
+        if self.deadline:
+            self._timer = threading.Timer(self.deadline, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
 
+    def attach(self, response) -> None:
+        self._response = response
+        self.rate_start = time.monotonic()
+        if self.expired.is_set():
+            self._shutdown()
+
+    def _expire(self) -> None:
+        self.expired.set()
+        self._shutdown()
+
+    def _shutdown(self) -> None:
+        if self._response is None:
+            return
+        raw = self._response.raw
+        with contextlib.suppress(OSError):
+            if hasattr(raw, "shutdown"):  # urllib3 >= 2.3
+                raw.shutdown()
+                return
+            sock = getattr(raw.connection, "sock", None)
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+
+    def check_length(self, content_length: str) -> None:
+        """reject an announced body above --max-body-size before downloading it"""
+        if self.max_body_size and content_length.isdigit() and int(content_length) > self.max_body_size * 1024 * 1024:
+            raise DownloadLimitExceeded(
+                "max_body_size", f"announced body of {content_length} bytes larger than {self.max_body_size} MiB"
+            )
+
+    def check(self, body_bytes: int, wire_bytes: int) -> None:
+        """raise DownloadLimitExceeded if the download so far breaks one of the limits"""
+        now = time.monotonic()
+        elapsed = now - self.start
+        if self.expired.is_set() or (self.deadline and elapsed > self.deadline):
+            raise DownloadLimitExceeded(
+                "deadline", f"deadline of {self.deadline}s exceeded after {wire_bytes} bytes"
+            )
+        if self.max_body_size and body_bytes > self.max_body_size * 1024 * 1024:
+            raise DownloadLimitExceeded("max_body_size", f"body larger than {self.max_body_size} MiB")
+        if not self.min_rate or self.rate_start is None:
+            return
+        receiving = now - self.rate_start
+        if receiving > self.RATE_GRACE and wire_bytes / receiving < self.min_rate:
+            raise DownloadLimitExceeded(
+                "min_rate", f"transfer rate {wire_bytes / receiving:.0f} B/s below {self.min_rate} B/s"
+            )
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+def _record_response(args, device, report_name, start, response=None, body=b"", error=None) -> None:
+    """Add a response (or the error of a failed request) to the --record directory"""
+    if not args.record:
+        return
+    try:
+        if response is None:
+            recorder_for(args.record).record(device, report_name, time.monotonic() - start, error=error)
+        else:
+            recorder_for(args.record).record(
+                device,
+                report_name,
+                time.monotonic() - start,
+                status=response.status_code,
+                reason=response.reason,
+                headers=response.headers,
+                body=bytes(body),
+                wire_bytes=response.raw.tell(),
+            )
+    except OSError as e:
+        LOGGER.warning("[%s] -> unable to record '%s' response in %s: %s", device, report_name, args.record, e)
+
+
+def replay_sansay_json(args, report_name, device, transfer=None):
+    """Answer a fetch from the --replay recording instead of the VSX, like fetch_sansay_json"""
+    try:
+        replayer = replayer_for(args.replay)
+    except (OSError, ValueError) as e:
+        print(f"[{device}] -> ERROR: unable to read recording {args.replay}: {e}")
+        return None
+    entry = replayer.next(device, report_name)
+    if entry is None:
+        print(f"[{device}] -> ERROR: no recorded Sansay '{report_name}' report in {args.replay}")
+        return None
+    LOGGER.debug("[%s] -> replaying Sansay VSX %s stats from response %d", device, report_name, entry["sequence"])
+    if args.replay_speed == "recorded":
+        time.sleep(entry["elapsed"])
+    if "error" in entry:
+        print(f"[{device}] -> ERROR: unable to fetch Sansay '{report_name}' report: {entry['error']}")
+        return None
+    if entry["status"] != 200:
+        print(f"[{device}] -> ERROR: unable to fetch Sansay '{report_name}' report: {entry['status']} {entry['reason']}")
+        return None
+    try:
+        body = replayer.body(entry)
+    except OSError as e:
+        print(f"[{device}] -> ERROR: unable to read recorded '{report_name}' report: {e}")
+        return None
+    if transfer is not None:
+        transfer.update({
+            "encoding": entry["headers"].get("Content-Encoding", "identity"),
+            "wire_bytes": entry["wire_bytes"],
+            "bytes": len(body),
+        })
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        print(f"[{device}] -> ERROR: invalid JSON in Sansay '{report_name}' report: {e}")
+        return None
+
+
+def fetch_sansay_json(args, report_name, timeout=None, host=None, transfer=None):
+    """
+    Fetch one stats report and return the decoded JSON, None on any error.
+
+    If a transfer dict is passed, it receives the content encoding and the
+    compressed (wire_bytes) and decompressed (bytes) size of the body, and
+    the reason if the download was aborted by one of its limits.
+    """
+    if args.replay:
+        return replay_sansay_json(args, report_name, host or args.host, transfer)
 
-def fetch_sansay_json(args, report_name):
-    if args.debug:
-        print(f"{args=}")
     password = None
     if args.password:
         match args.password:
@@ -109,125 +731,468 @@ def fetch_sansay_json(args, report_name):
                 raise TypeError(other)
 
     username = args.user
-    device = args.host
+    device = host or args.host
     protocol = args.proto
     port = args.port
     ssl_verify = args.verify_ssl
-    timeout = args.timeout
+    timeout = timeout or args.timeout
     # TODO for later implementation
     # sections = [args.sections.split(",")]
     # retries = args.retries
 
-    if args.debug:
-        print(f"[{device}] -> fetching Sansay VSX {report_name} stats")
+    LOGGER.debug("[%s] -> fetching Sansay VSX %s stats", device, report_name)
 
     url = f"{protocol}://{device}:{port}/SSConfig/webresources/stats/{report_name}"
     params = {
         "format": "json"
     }
 
-    if not ssl_verify and args.debug:
-        print(f"[{device}] -> WARN: hostname/certificate verification disabled via {args.verify_ssl} parameter.")
+    if not ssl_verify:
+        LOGGER.debug("[%s] -> WARN: hostname/certificate verification disabled via --verify_ssl parameter.", device)
 
     if not username or not password:
         print(f"[{device}] -> ERROR: unable to fetch Sansay report, VSX username/password parameter missing")
         return None
 
+    # The mysqldump JSON wraps every field as {"name": ..., "content": ...} and
+    # compresses very well. urllib3 decompresses the streamed body chunk by
+    # chunk, so the compressed payload is never held in memory as a whole.
+    headers = {"Accept-Encoding": "identity" if args.no_compression else "gzip, deflate"}
+
+    guard = DownloadGuard(args)
+    body = bytearray()
+    response = None
+    start = time.monotonic()
     try:
-        response = requests.get(
+        with http_session(device).get(
             url,
             auth=HTTPBasicAuth(username, password),
             params=params,
+            headers=headers,
             verify=ssl_verify,
             timeout=timeout,
-        )
-        if ssl_verify and args.debug:
-            print(f"[{device}] -> fetching Sansay VSX {report_name} stats (complete)")
-
-        if response.status_code != 200:
-            print(f"[{device}] -> ERROR: unable to fetch Sansay '{report_name}' report: {response.status_code} {response.reason}")
-            return None
-        return response.json()
+            stream=True,
+        ) as response:
+            guard.attach(response)
+            if response.status_code != 200:
+                _record_response(args, device, report_name, start, response)
+                print(
+                    f"[{device}] -> ERROR: unable to fetch Sansay '{report_name}' report: "
+                    f"{response.status_code} {response.reason}"
+                )
+                return None
+            guard.check_length(response.headers.get("Content-Length", ""))
+            try:
+                for chunk in response.iter_content(chunk_size=65536):
+                    body.extend(chunk)
+                    guard.check(len(body), response.raw.tell())
+            except requests.RequestException:
+                # A connection shut down at the deadline is reported as such.
+                if guard.expired.is_set():
+                    guard.check(len(body), response.raw.tell())
+                raise
+            # Without a Content-Length a shut down connection looks like the end of the body.
+            if guard.expired.is_set():
+                guard.check(len(body), response.raw.tell())
+            LOGGER.debug("[%s] -> fetching Sansay VSX %s stats (complete)", device, report_name)
+            _record_response(args, device, report_name, start, response, body)
+            if transfer is not None:
+                transfer.update({
+                    "encoding": response.headers.get("Content-Encoding", "identity"),
+                    "wire_bytes": response.raw.tell(),
+                    "bytes": len(body),
+                })
+        return json.loads(body)
+    except DownloadLimitExceeded as e:
+        LOGGER.warning("[%s] -> Sansay '%s' report aborted: %s", device, report_name, e)
+        _record_response(args, device, report_name, start, error=f"aborted: {e}")
+        if transfer is not None:
+            transfer.update({
+                "encoding": response.headers.get("Content-Encoding", "identity") if response is not None else "identity",
+                "wire_bytes": response.raw.tell() if response is not None else 0,
+                "bytes": len(body),
+                "aborted": {"limit": e.limit, "reason": str(e)},
+            })
+        return None
     except requests.RequestException as e:
         print(f"[{device}] -> ERROR: unable to fetch Sansay '{report_name}' report: {e}")
+        _record_response(args, device, report_name, start, error=str(e))
         return None
+    except ValueError as e:
+        print(f"[{device}] -> ERROR: invalid JSON in Sansay '{report_name}' report: {e}")
+        return None
+    finally:
+        guard.close()
+
+
+def _timed_fetch(args, report_name, history, agent_info, host=None, label=None):
+    """
+    Fetch one report, recording its response time and the timeout used under
+    label (default: the report name). Only successful responses go into the
+    response time history.
+    """
+    label = label or report_name
+    timeout = args.timeout
+    if history is not None:
+        timeout = history.timeout_for(label, args.timeout, args.timeout_percentile, args.timeout_margin)
+        agent_info.setdefault("timeouts", {})[label] = timeout
+    start = time.monotonic()
+    transfer = {}
+    data = fetch_sansay_json(args, report_name, timeout=timeout, host=host, transfer=transfer)
+    elapsed = time.monotonic() - start
+    agent_info.setdefault("response_times", {})[label] = round(elapsed, 3)
+    if transfer:
+        agent_info.setdefault("transfer", {})[label] = transfer
+    # A timed out or refused request says nothing about how long the report
+    # takes; feeding it back would only push the next timeout towards the
+    # configured maximum.
+    if history is not None and data is not None:
+        history.record(label, elapsed)
+    return data
+
+
+# Tables every run of a mysqldump style report contains. During an HA
+# switchover the VSX can answer with 'Max recursion depth reached' strings in
+# place of some of them.
+_REPORT_TABLES = {
+    "resource": ("ingress_stat", "gw_egress_stat"),
+    "realtime": ("system_stat", "XBResourceRealTimeStatList"),
+}
+
+
+def _report_tables(data) -> list[dict]:
+    """the well formed table entries of a mysqldump style report"""
+    try:
+        tables = data["mysqldump"]["database"]["table"]
+    except (KeyError, TypeError):
+        return []
+    return [table for table in tables if isinstance(table, dict)]
+
+
+def missing_tables(report_name, data) -> list[str]:
+    """Expected tables absent from a fetched report, empty for complete or failed fetches"""
+    expected = _REPORT_TABLES.get(report_name, ())
+    if data is None:
+        return []
+    present = {table.get("name") for table in _report_tables(data)}
+    return [name for name in expected if name not in present]
+
+
+# Reports whose missing tables may be filled in from the last complete
+# copy. Realtime tables are only meaningful when current: a stale
+# system_stat would report an HA state the pair has already left.
+_LAST_GOOD_REPORTS = ("resource",)
 
+# Minimum age of the saved last complete copy before it is replaced. The
+# copy of a large resource report is as big as the report itself, and
+# --degraded-max-age is far longer than a check interval.
+_LAST_GOOD_INTERVAL = 300
 
-def poll_sansay_vsx(args):
+
+def _fetch_report(args, report_name, history, agent_info, host=None, label=None):
+    """
+    Fetch a report, handling the partial payloads of an HA switchover.
+
+    A report with expected tables missing is re-polled once with the short
+    --degraded-retry-timeout. If tables are still missing, those of the
+    resource report are taken from its last complete copy when it is
+    recent enough. The report is flagged in agent_info["degraded"] either
+    way.
+    """
+    label = label or report_name
+    path = state_file_path(args, f"last_good_{label}")
+    data = _timed_fetch(args, report_name, history, agent_info, host=host, label=label)
+    missing = missing_tables(report_name, data)
+    if not missing:
+        if data is not None and report_name in _LAST_GOOD_REPORTS:
+            _save_last_good(args, path, report_name, data)
+        return data
+
+    LOGGER.warning("[%s] -> %s report degraded, missing tables %s, re-polling", host or args.host, report_name, missing)
+    retry = fetch_sansay_json(args, report_name, timeout=min(args.degraded_retry_timeout, args.timeout), host=host)
+    if retry is not None:
+        data = retry
+        missing = missing_tables(report_name, retry)
+        if not missing:
+            if report_name in _LAST_GOOD_REPORTS:
+                _save_last_good(args, path, report_name, retry)
+            return retry
+
+    last_good = load_state_file(path) if report_name in _LAST_GOOD_REPORTS else {}
+    age = time.time() - last_good.get("time", 0)
+    fallback_age = None
+    if last_good and age <= args.degraded_max_age and all(name in last_good.get("tables", {}) for name in missing):
+        tables = _report_tables(data) + [last_good["tables"][name] for name in missing]
+        data = {"mysqldump": {"database": {"table": tables}}}
+        fallback_age = round(age)
+    agent_info.setdefault("degraded", {})[label] = {"tables": missing, "fallback_age": fallback_age}
+    return data
+
+
+def _save_last_good(args, path: Path, report_name, data) -> None:
+    """Keep the expected tables of a complete report, at most every _LAST_GOOD_INTERVAL seconds"""
+    try:
+        if time.time() - path.stat().st_mtime < _LAST_GOOD_INTERVAL:
+            return
+    except OSError:
+        pass
+    tables = {table["name"]: table for table in _report_tables(data) if table.get("name") in _REPORT_TABLES[report_name]}
+    try:
+        save_state_file(path, {"time": time.time(), "tables": tables})
+    except OSError as e:
+        LOGGER.warning("[%s] -> unable to save last complete %s report: %s", args.host, report_name, e)
+
+
+_HA_FIELDS = ("ha_current_state", "ha_pre_state", "ha_local_status", "ha_remote_status")
+
+
+def probe_cluster(args, history, agent_info):
+    """
+    Probe both members of an HA pair with the realtime report, the only
+    report that carries the HA state.
+
+    This is a full realtime fetch from each member, per-trunk realtime
+    table included, as the VSX API has no lighter status endpoint. The
+    report of the active member is the one its sections are built from, so
+    only the fetch from the standby member is extra.
+
+    Returns (active host, processed realtime data of the active host as
+    returned by process_realtime_data, cluster info). The active host is
+    the first member reporting ha_current_state "active". Without an active
+    member the first reachable one is used so the system check can still
+    report on it.
+    """
+    nodes = {}
+    realtime = {}
+    for host, label in ((args.host, "realtime"), (args.cluster_peer, "realtime_peer")):
+        data = _fetch_report(args, "realtime", history, agent_info, host=host, label=label)
+        system_stat = {}
+        if data is not None:
+            realtime[host] = process_realtime_data(args, data)
+            system_stat = realtime[host][0].get("system_stat", {})
+        nodes[host] = {"reachable": data is not None, **{field: system_stat.get(field) for field in _HA_FIELDS}}
+
+    active = [host for host, node in nodes.items() if node["ha_current_state"] == "active"]
+    active_host = (active or list(realtime) or [args.host])[0]
+    LOGGER.debug("[%s] -> cluster members %s, active member %s", args.host, nodes, active_host)
+    return active_host, realtime.get(active_host), {"active_node": active_host if active else None, "nodes": nodes}
+
+
+def poll_sansay_vsx(args, agent_info=None, on_ready=None):
     """
     Define the framework stats to return and poll the Sansay to retrieve data:
       - resource - all trunks with their ingress and egress data
       - realtime - overall VSX stats plus active trunks realtime data
       - media_server - media server statistics
+
+    With --cluster-peer both HA members are probed first and the reports are
+    fetched from the active member (see probe_cluster).
+
+    Response times and timeouts of the individual reports are collected in
+    agent_info for the sansay_vsx_agent section.
+
+    on_ready(key, stats) is called as soon as the data for a key of stats is
+    complete: "system_stat" and "trunks" after the realtime report (the
+    trunks need its realtime overlay), "media_stats" after the media report.
     """
 
     stats = {}
+    agent_info = {} if agent_info is None else agent_info
+    history = ResponseTimeHistory(state_file_path(args, "response_times")) if args.adaptive_timeout else None
+    breaker = None
+    if args.breaker_threshold > 0:
+        breaker = CircuitBreaker(
+            state_file_path(args, "breaker"), args.breaker_threshold, args.breaker_backoff, args.breaker_max_backoff
+        )
 
-    resource_data = fetch_sansay_json(args, "resource")
+    # While the breaker is open only the smallest report is requested as a
+    # probe, and only once the backoff has expired.
+    media_data = None
+    if breaker is not None and breaker.is_open:
+        now = time.time()
+        if not breaker.probe_due(now):
+            LOGGER.debug("[%s] -> circuit breaker open, skipping poll", args.host)
+            agent_info["breaker"] = breaker.info(now)
+            return stats
+        media_data = _timed_fetch(args, "media_server", history, agent_info)
+        if media_data is None:
+            breaker.record_failure(now)
+            breaker.save()
+            agent_info["breaker"] = breaker.info(now)
+            if history is not None:
+                history.save()
+            return stats
+
+    # In cluster mode the heavy reports are only requested from the active
+    # member, the standby member only answers the realtime probe.
+    host = args.host
+    cluster = None
+    realtime = None
+    if args.cluster_peer:
+        host, realtime, cluster = probe_cluster(args, history, agent_info)
+        if host != args.host:
+            media_data = None
+
+    resource_data = _fetch_report(args, "resource", history, agent_info, host=host)
     if resource_data is not None:
         stats["trunks"] = process_resource_data(args, resource_data)
 
-    realtime_data = fetch_sansay_json(args, "realtime")
-    if realtime_data is not None:
-        realtime_system_data, realtime_trunk_data = process_realtime_data(args, realtime_data)
+    if cluster is None:
+        realtime_data = _fetch_report(args, "realtime", history, agent_info, host=host)
+        if realtime_data is not None:
+            realtime = process_realtime_data(args, realtime_data)
+    if realtime is not None:
+        realtime_system_data, realtime_trunk_data = realtime
         # stats["system_stat"].update(realtime_system_data["system_stat"])
-        stats["system_stat"] = realtime_system_data["system_stat"]
+        # A degraded realtime report can lack system_stat, which is never
+        # filled in from an older report.
+        if "system_stat" in realtime_system_data:
+            stats["system_stat"] = realtime_system_data["system_stat"]
+            if cluster is not None:
+                stats["system_stat"]["cluster"] = cluster
         if "trunks" in stats:
             stats["trunks"].update(process_realtime_trunk_data(stats["trunks"], realtime_trunk_data))
+    if on_ready is not None:
+        on_ready("system_stat", stats)
+        on_ready("trunks", stats)
 
-    media_data = fetch_sansay_json(args, "media_server")
+    if media_data is None:
+        media_data = _timed_fetch(args, "media_server", history, agent_info, host=host)
     if media_data is not None:
         stats["media_stats"] = process_media_data(args, media_data)
+    if on_ready is not None:
+        on_ready("media_stats", stats)
 
+    if history is not None:
+        history.save()
+    if breaker is not None:
+        if resource_data is None and realtime is None and media_data is None:
+            breaker.record_failure(time.time())
+        else:
+            breaker.record_success()
+        breaker.save()
+        agent_info["breaker"] = breaker.info(time.time())
     return stats
 
 
+def _parse_resource_rows(table_name, rows, trace=None, device=None):
+    """
+    Convert resource table rows into a partial trunk map for one table.
+
+    The first row seen for a trunk wins. This is also the unit of work of the
+    parallel path, so it must stay a module level function.
+    """
+    partial = {}
+    for row in rows:
+        # Convert the list dictionaries with name and content values into
+        # a single dictionary with the name as key and content as value.
+        row_dict = {field["name"]: field["content"] for field in row["field"]}
+        recid = row_dict.pop("id")
+        trunk_id = row_dict.pop("trunk_id")
+        alias = row_dict.pop("alias")
+        if trace:
+            trace("[%s] -> %s row for trunk %s converted to %s", device, table_name, trunk_id, row_dict)
+
+        if trunk_id not in partial:
+            partial[trunk_id] = {"recid": recid, "alias": alias, table_name: row_dict}
+    return table_name, partial
+
+
+# Resource tables handed to forked pool workers, see _parse_resource_parallel.
+_SHARED_TABLES: list = []
+
+
+def _parse_resource_shard(table_index: int, start: int, stop: int):
+    table = _SHARED_TABLES[table_index]
+    return _parse_resource_rows(table["name"], table["row"][start:stop])
+
+
+# Set by the long-lived modes that run threads next to the agent code. The
+# live thread count is no indication: a cancelled DownloadGuard timer stays
+# alive for a moment in a plain single threaded run.
+_THREADED_PROCESS = False
+
+
+def mark_threaded_process() -> None:
+    """Have the resource parser stop forking workers in this process"""
+    global _THREADED_PROCESS  # pylint: disable=global-statement
+    _THREADED_PROCESS = True
+
+
+def _parse_resource_parallel(tables, workers: int, total_rows: int):
+    """
+    Shard the rows of all resource tables across a process pool.
+
+    In a single threaded agent run the workers are forked after the tables
+    are published in _SHARED_TABLES, so only (table, start, stop) index
+    triples are sent to them instead of pickling the rows. Forking a process
+    that runs other threads (the exporter, the collector, which call
+    mark_threaded_process) can deadlock the child on a lock held by another
+    thread, so there the workers come from a forkserver and receive their
+    rows pickled. Results come back in shard
+    order, so merging them yields exactly the trunk map the serial path
+    builds.
+    """
+    global _SHARED_TABLES  # pylint: disable=global-statement
+    chunk_size = max(1, -(-total_rows // (workers * 4)))
+    shards = [
+        (table_index, start, start + chunk_size)
+        for table_index, table in enumerate(tables)
+        for start in range(0, len(table["row"]), chunk_size)
+    ]
+    if not shards:
+        return []
+    if _THREADED_PROCESS:
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            return list(executor.map(
+                _parse_resource_rows,
+                [tables[table_index]["name"] for table_index, _, _ in shards],
+                [tables[table_index]["row"][start:stop] for table_index, start, stop in shards],
+            ))
+    _SHARED_TABLES = tables
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            return list(executor.map(_parse_resource_shard, *zip(*shards)))
+    finally:
+        _SHARED_TABLES = []
+
+
 def process_resource_data(args, data):
     device = args.host
     if data is None:
         print(f"[{device}] -> unable to parse table from json response data.\n{data}")
         return
 
-    trunks = {}
-    tables = data["mysqldump"]["database"]["table"]
-    for table in tables:
+    tables = []
+    for table in data["mysqldump"]["database"]["table"]:
         if not isinstance(table, dict):
             LOGGER.warning("Skipping non-dict resource table entry: %s", table)
             continue
-        if args.debug:
-            print(f"Processing entries in {table}.")
-
-        for row in table["row"]:
-            # Convert the list dictionaries with name and content values into
-            # a single dictionary with the name as key and content as value.
-            row_dict = {field["name"]: field["content"] for field in row["field"]}
-            recid = row_dict.pop("id")
-            trunk_id = row_dict.pop("trunk_id")
-            alias = row_dict.pop("alias")
-            if args.debug:
-                print(f"[{device}] -> Processing row data {row}")
-                print(f"[{device}] -> Conversion to {row_dict=}")
+        LOGGER.debug("[%s] -> processing %d rows of resource table '%s'", device, len(table["row"]), table["name"])
+        tables.append(table)
 
-            # If the trunk ID isn't in the stats, add it.
-            if trunk_id not in trunks.keys():
-                if args.debug:
-                    print(f"[{device}] -> {trunk_id} not found in stats table.")
-                trunks[trunk_id] = {}
-                trunks[trunk_id]["recid"] = recid
-                trunks[trunk_id]["alias"] = alias
-                if args.debug:
-                    print(f"[{device}] -> Created entry for {trunks[trunk_id]} with alias {trunks[trunk_id]['alias']}.")
+    total_rows = sum(len(table["row"]) for table in tables)
+    if args.parse_workers > 1 and total_rows >= args.parse_parallel_threshold:
+        LOGGER.debug("[%s] -> parsing %d resource rows with %d workers", device, total_rows, args.parse_workers)
+        partials = _parse_resource_parallel(tables, args.parse_workers, total_rows)
+    else:
+        trace = row_tracer(args)
+        partials = (_parse_resource_rows(table["name"], table["row"], trace, device) for table in tables)
 
+    trunks = {}
+    for table_name, partial in partials:
+        for trunk_id, entry in partial.items():
+            # If the trunk ID isn't in the stats, add it.
+            if trunk_id not in trunks:
+                trunks[trunk_id] = {"recid": entry["recid"], "alias": entry["alias"]}
             # If table name isn't in dictionary keys, add it to separate ingress and egress stats.
-            if table["name"] not in trunks[trunk_id].keys():
-                if args.debug:
-                    print(f"[{device}] -> {table} not found in stats trunks table.")
-                trunks[trunk_id][table["name"]] = row_dict
-                if args.debug:
-                    print(f"[{device}] -> Created key for {table['name']} and value of metrics: {row_dict}.")
-
-    if args.debug:
-        print(f"resource {trunks=}")
+            if table_name not in trunks[trunk_id]:
+                trunks[trunk_id][table_name] = entry[table_name]
+
+    LOGGER.debug("[%s] -> resource data parsed for %d trunks", device, len(trunks))
     return trunks
 
 
@@ -241,14 +1206,14 @@ def process_realtime_data(args, data):
     table_count = 0
     system_stat = {}
     trunk_realtime_data = {}
+    trace = row_tracer(args)
     for table in tables:
         if not isinstance(table, dict):
             LOGGER.warning("Skipping non-dict table entry: %s", table)
             continue
         table_count += 1
         table_name = table["name"]
-        if args.debug:
-            print(f"[{device}] -> processing table #{table_count} '{table_name}' stats from json response data.")
+        LOGGER.debug("[%s] -> processing table #%d '%s' stats from json response data.", device, table_count, table_name)
         if table_name == "system_stat":
             row_dict = {field["name"]: field["content"] for field in table["row"]["field"]}
             system_stat[table_name] = row_dict
@@ -259,6 +1224,8 @@ def process_realtime_data(args, data):
             if rows:
                 for row in rows:
                     realtime_row_dict = {fieldrow["name"]: fieldrow["content"] for fieldrow in row["field"]}
+                    if trace:
+                        trace("[%s] -> realtime row converted to %s", device, realtime_row_dict)
                     # Ignore realtime trunk data that has the FQDN noted as a group
                     if realtime_row_dict["fqdn"] != "Group":
                         trunk_realtime_data[realtime_row_dict["trunkId"]] = {
@@ -330,28 +1297,51 @@ def process_trunk_stats(args, stats):
                 'origination_utilization': 0,
                 'termination_sessions': 0,
                 'termination_utilization': 0,
+                'cps': 0,
+                'cps_utilization': 0,
+                'peak_sessions': 0,
+                'peak_utilization': 0,
+                'call_limit_exceeded': 0,
+                'cps_limit_exceeded': 0,
             },
         }
         calculated_stats = default_stats
 
-        # Realtime stat calculations for the trunk
-        origination_sessions = int(data["realtime_stat"].get('numOrig', 0))
-        termination_sessions = int(data["realtime_stat"].get('numTerm', 0))
-        total_limit = int(data["realtime_stat"].get('totalLimit', 0))
-        origination_utilization = termination_utilization = 0
+        # Realtime stat calculations for the trunk. realtime_stat is missing
+        # when the realtime report failed. Some firmware reports averaged
+        # values such as cps as decimal strings ("1.5").
+        realtime_stat = data.pop("realtime_stat", {})
+        origination_sessions = int(float(realtime_stat.get('numOrig', 0)))
+        termination_sessions = int(float(realtime_stat.get('numTerm', 0)))
+        total_limit = int(float(realtime_stat.get('totalLimit', 0)))
+        cps = int(float(realtime_stat.get('cps', 0)))
+        cps_limit = int(float(realtime_stat.get('cpsLimit', 0)))
+        peak_sessions = int(float(realtime_stat.get('numPeak', 0)))
+        origination_utilization = termination_utilization = peak_utilization = cps_utilization = 0
         if total_limit:
             origination_utilization = round((origination_sessions / total_limit) * 100, 1)
             termination_utilization = round((termination_sessions / total_limit) * 100, 1)
+            peak_utilization = round((peak_sessions / total_limit) * 100, 1)
+        if cps_limit:
+            cps_utilization = round((cps / cps_limit) * 100, 1)
 
         calculated_stats["realtime"] = {
             'origination_sessions': origination_sessions,
             'origination_utilization': origination_utilization,
             'termination_sessions': termination_sessions,
             'termination_utilization': termination_utilization,
+            'cps': cps,
+            'cps_utilization': cps_utilization,
+            'peak_sessions': peak_sessions,
+            'peak_utilization': peak_utilization,
+            'call_limit_exceeded': int(float(realtime_stat.get('totalCLZ', 0))),
+            'cps_limit_exceeded': int(float(realtime_stat.get('numCLZCps', 0))),
         }
-        stats["trunks"][trunk].pop("realtime_stat")
 
-        # Ingress and Egress calculations for the trunk
+        # Ingress and Egress calculations for the trunk. The raw counters the
+        # ratios are based on are kept in "counters", outside calculated_stats
+        # so that they are not turned into per trunk metrics.
+        counters = {}
         _direction_name_map = {"ingress_stat": "ingress", "gw_egress_stat": "egress"}
         for direction in ["ingress_stat", "gw_egress_stat"]:
             normalized = _direction_name_map[direction]
@@ -360,6 +1350,13 @@ def process_trunk_stats(args, stats):
             CD = float(data[direction].get('1st15mins_call_durationSec', 0))
             FC = float(data[direction].get('1st15mins_call_fail', 0))
             CAns = float(data[direction].get('1st15mins_call_answer', 0))
+            counters[normalized] = {
+                'call_attempt': int(CA),
+                'call_fail': int(FC),
+                'call_answer': int(CAns),
+                'call_duration': int(CD),
+                'pdd_ms': int(PDDms),
+            }
 
             if CA > 0:
                 calculated_stats[normalized] = {
@@ -371,6 +1368,7 @@ def process_trunk_stats(args, stats):
             stats["trunks"][trunk].pop(direction)
 
         stats["trunks"][trunk]["calculated_stats"] = calculated_stats
+        stats["trunks"][trunk]["counters"] = counters
     return stats["trunks"]
 
 
@@ -382,23 +1380,235 @@ def process_system_stats(args, stats):
     return stats["system_stat"]
 
 
-def agent_sansay_vsx_main(args: Args) -> int:
-    device = args.host
-    if args.debug:
-        print(f'DEBUG: {args.host =}')
-        print(f'DEBUG: {args.user =}')
-        print(f'DEBUG: {args.password =}')
-        print(f'DEBUG: {args.debug =}')
-        print(f"DEBUG: {type(device)}\n{device =}")
-
-    stats = poll_sansay_vsx(args)
-
-    with SectionWriter("sansay_vsx_media") as writer:
-        writer.append_json(process_media_stats(args, stats))
-    with SectionWriter("sansay_vsx_trunks") as writer:
-        writer.append_json(process_trunk_stats(args, stats))
-    with SectionWriter("sansay_vsx_system") as writer:
-        writer.append_json(process_system_stats(args, stats))
+def build_trunk_delta(args, trunks: dict) -> dict:
+    """
+    Turn the processed trunk stats into an incremental section payload.
+
+    The full view is kept in a per-host state file. Only trunks that differ
+    from the previous run are sent together with the current membership,
+    and every --delta-full-every runs (or without usable state) all trunks
+    are sent with no base so the parser can resynchronise. The state also
+    keeps the undo steps of the last TRUNK_DELTA_HISTORY runs, so that the
+    parser can rebuild a section it parses again after later runs.
+    """
+    path = state_file_path(args, "trunks")
+    previous = load_state_file(path)
+    cycle = previous.get("cycle", 0) + 1
+    generation = previous.get("generation", 0) + 1
+    full = not previous or args.delta_full_every <= 1 or cycle % args.delta_full_every == 0
+
+    previous_trunks = previous.get("trunks", {})
+    if full:
+        base = None
+        changed = trunks
+    else:
+        base = previous["generation"]
+        changed = {
+            trunk_id: data for trunk_id, data in trunks.items() if previous_trunks.get(trunk_id) != data
+        }
+
+    undo = []
+    if previous:
+        undo = [*previous.get("undo", []), {
+            "generation": generation,
+            "members": sorted(previous_trunks),
+            "previous": {
+                trunk_id: data for trunk_id, data in previous_trunks.items() if trunks.get(trunk_id) != data
+            },
+        }][-TRUNK_DELTA_HISTORY:]
+
+    try:
+        save_state_file(path, {"generation": generation, "cycle": cycle, "trunks": trunks, "undo": undo})
+    except OSError as e:
+        LOGGER.warning("[%s] -> unable to write trunk state %s, sending full section: %s", args.host, path, e)
+        return trunks
+
+    LOGGER.debug("[%s] -> trunk delta generation %d: %d of %d trunks changed",
+                 args.host, generation, len(changed), len(trunks))
+    return {
+        TRUNK_DELTA_KEY: {
+            "generation": generation,
+            "base": base,
+            "snapshot": str(path),
+            "members": sorted(trunks),
+            "changed": changed,
+        }
+    }
+
+
+def record_kpis(args, trunks) -> None:
+    """Append the trunk counters to the --kpi-db database, a failing database never fails the run"""
+    if not args.kpi_db or not trunks:
+        return
+    try:
+        rows = store_trunk_kpis(Path(args.kpi_db), args.host, trunks)
+    except (sqlite3.Error, OSError) as e:
+        LOGGER.warning("[%s] -> unable to record trunk KPIs in %s: %s", args.host, args.kpi_db, e)
+        return
+    LOGGER.debug("[%s] -> recorded %d trunk KPI rows in %s", args.host, rows, args.kpi_db)
+
+
+def build_trunk_snapshot(args, trunks: dict) -> dict:
+    """
+    Write the processed trunks to the snapshot file and return the section
+    payload referring to it. The JSON state file is written with the same
+    generation as the fallback of the parser. Without a usable snapshot the
+    full trunk section is sent.
+    """
+    path = state_file_path(args, "trunks")
+    snapshot_path = path.with_suffix(".snap")
+    previous = load_state_file(path)
+    generation = previous.get("generation", 0) + 1
+    try:
+        save_state_file(path, {"generation": generation, "cycle": previous.get("cycle", 0) + 1, "trunks": trunks})
+        written = write_trunk_snapshot(snapshot_path, generation, trunks)
+    except OSError as e:
+        LOGGER.warning("[%s] -> unable to write trunk snapshot %s, sending full section: %s", args.host, snapshot_path, e)
+        return trunks
+    if not written:
+        LOGGER.warning("[%s] -> trunks do not fit the snapshot layout, sending full section", args.host)
+        return trunks
+
+    LOGGER.debug("[%s] -> trunk snapshot generation %d with %d trunks", args.host, generation, len(trunks))
+    return {
+        TRUNK_SNAPSHOT_KEY: {
+            "generation": generation,
+            "snapshot": str(snapshot_path),
+            "json": str(path),
+        }
+    }
+
+
+def collect_stats(args, agent_info=None) -> dict:
+    """Poll the VSX and process the reports into the data of the media, trunk and system sections"""
+    stats = poll_sansay_vsx(args, agent_info)
+    trunks = process_trunk_stats(args, stats)
+    record_kpis(args, trunks)
+    return {
+        "media_stats": process_media_stats(args, stats),
+        "trunks": trunks,
+        "system_stat": process_system_stats(args, stats),
+    }
+
+
+# Section written for each key of the polled stats
+_SECTION_NAMES = {
+    "system_stat": "sansay_vsx_system",
+    "trunks": "sansay_vsx_trunks",
+    "media_stats": "sansay_vsx_media",
+}
+
+# Seconds to wait for the exporter's /sections before polling the VSX directly
+EXPORTER_TIMEOUT = 5
+
+
+def write_json_section(stream, section_name: str, data) -> None:
+    """Write one agent section the way SectionWriter.append_json does, to any text stream"""
+    stream.write(f"<<<{section_name}:sep(0)>>>\n")
+    stream.write(json.dumps(data, sort_keys=True) + "\n")
+
+
+def collect_sections(args) -> tuple[dict, str]:
+    """
+    Poll once for the exporter: the processed stats for /metrics and the
+    agent sections of the same poll for /sections. The sections always
+    carry the full trunk data, a reader of /sections may skip or repeat
+    exporter polls so --delta-sections and --mmap-snapshot do not apply.
+    """
+    agent_info = {}
+    stats = collect_stats(args, agent_info)
+    stream = io.StringIO()
+    complete = {}
+    for key, section_name in _SECTION_NAMES.items():
+        write_json_section(stream, section_name, stats[key])
+        complete[section_name] = stats[key] is not None
+    agent_info["sections"] = complete
+    write_json_section(stream, "sansay_vsx_agent", agent_info)
+    return stats, stream.getvalue()
+
+
+def read_exporter_sections(args) -> str | None:
+    """The agent sections served by --from-exporter, None if the exporter has none to give"""
+    url = args.from_exporter.rstrip("/") + "/sections"
+    try:
+        response = requests.get(url, timeout=EXPORTER_TIMEOUT)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        LOGGER.warning("[%s] -> no sections from exporter %s: %s", args.host, url, e)
+        return None
+    return response.text
+
+
+def write_section(args, key, stats, stream=None) -> bool:
+    """Process one key of the polled stats and flush its section to stream (stdout), True if the section has data"""
+    if key == "trunks":
+        data = process_trunk_stats(args, stats)
+        record_kpis(args, data)
+        if args.mmap_snapshot and data is not None:
+            data = build_trunk_snapshot(args, data)
+        elif args.delta_sections and data is not None:
+            data = build_trunk_delta(args, data)
+    elif key == "media_stats":
+        data = process_media_stats(args, stats)
+    else:
+        data = process_system_stats(args, stats)
+    stream = stream or sys.stdout
+    write_json_section(stream, _SECTION_NAMES[key], data)
+    stream.flush()
+    return data is not None
+
+
+def agent_sansay_vsx_main(args: Args, stream=None) -> int:
+    """
+    Write the agent sections to stream, stdout unless given. The collector
+    passes its own stream per job, so that jobs running side by side in one
+    process do not share sys.stdout.
+    """
+    if args.profile or args.trace_malloc:
+        return run_profiled(args, lambda args: _agent_sansay_vsx_run(args, stream))
+    return _agent_sansay_vsx_run(args, stream)
+
+
+def _agent_sansay_vsx_run(args: Args, stream=None) -> int:
+    trace_handler = setup_tracing(args)
+    try:
+        return _poll_and_write_sections(args, stream or sys.stdout)
+    finally:
+        teardown_tracing(trace_handler)
+
+
+def _poll_and_write_sections(args: Args, stream) -> int:
+    LOGGER.debug("[%s] -> polling as user %s", args.host, args.user)
+
+    if args.exporter_port:
+        mark_threaded_process()
+        return run_exporter(args, collect_sections)
+
+    if args.from_exporter:
+        sections = read_exporter_sections(args)
+        if sections:
+            stream.write(sections)
+            return 0
+
+    # Sections are flushed as soon as their reports are processed, so the
+    # sections already written survive if Checkmk kills the agent at its
+    # timeout while a later report is still downloading.
+    agent_info = {}
+    complete = {}
+
+    def on_ready(key, stats):
+        complete[_SECTION_NAMES[key]] = write_section(args, key, stats, stream)
+
+    stats = poll_sansay_vsx(args, agent_info, on_ready)
+    for key, section_name in _SECTION_NAMES.items():
+        if section_name not in complete:
+            complete[section_name] = write_section(args, key, stats, stream)
+
+    # The agent section is the trailer: it is only present when the run
+    # finished, and lists which sections carry data.
+    agent_info["sections"] = complete
+    write_json_section(stream, "sansay_vsx_agent", agent_info)
+    stream.flush()
 
     return 0
 
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+"""
+Resident collector for the Sansay VSX special agent.
+
+The collector keeps the agent process, its pooled HTTPS connections and its
+state warm between Checkmk cycles. libexec/agent_sansay_vsx asks it for the
+sections of its command line over a Unix domain socket and only runs the
+agent itself when the collector is not running or has nothing recent.
+
+Every command line the collector is asked for becomes a job that is
+refreshed every --interval seconds and dropped once nobody asked for it for
+--idle-timeout seconds. A request for a job that has not finished its
+first run, or is running right now, waits for that run instead of polling
+the VSX next to it: two runs of one command line would write the same state
+files. Due jobs run side by side on at most --workers threads, one per VSX,
+and a failing job is retried with a growing backoff instead of on every
+refresh.
+
+Start it in the site, e.g. from a site cron job or an init script:
+
+    python3 -m cmk_addons.plugins.sansay_vsx.special_agents.collector
+
+This module only imports the standard library at the top, to keep the
+client side cheap.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+
+LOGGER = logging.getLogger("agent_sansay_vsx")
+
+SOCKET_ENV = "SANSAY_VSX_COLLECTOR_SOCKET"
+CLIENT_TIMEOUT = 2.0
+# Seconds a request waits for a running job before it gets no data at all
+RUN_WAIT_TIMEOUT = 50.0
+# A failing job waits interval, 2 * interval, ... up to this many intervals
+MAX_BACKOFF_INTERVALS = 10
+
+
+def default_socket_path() -> Path:
+    """$SANSAY_VSX_COLLECTOR_SOCKET, otherwise tmp/run of the site"""
+    if os.environ.get(SOCKET_ENV):
+        return Path(os.environ[SOCKET_ENV])
+    return Path(os.environ.get("OMD_ROOT", "/tmp")) / "tmp" / "run" / "sansay_vsx_collector.sock"
+
+
+def request_sections(argv: Sequence[str], path: Optional[Path] = None, timeout: float = CLIENT_TIMEOUT) -> Optional[str]:
+    """
+    The agent output for argv from the collector, None if the collector is
+    not running, does not have recent output or does not answer in time.
+    While the job of argv is running the collector answers PENDING first and
+    the result once the run is done, which may be empty if it takes longer
+    than RUN_WAIT_TIMEOUT.
+    """
+    path = path or default_socket_path()
+    if not path.exists():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(str(path))
+            client.sendall(json.dumps({"argv": list(argv)}).encode("utf-8") + b"\n")
+            client.shutdown(socket.SHUT_WR)
+            with client.makefile("rb") as reply:
+                status = reply.readline().rstrip(b"\n")
+                if status == b"PENDING":
+                    client.settimeout(RUN_WAIT_TIMEOUT + timeout)
+                    status = reply.readline().rstrip(b"\n")
+                payload = reply.read()
+    except OSError:
+        return None
+    if status != b"OK":
+        return None
+    return payload.decode("utf-8")
+
+
+class Job:
+    """The latest agent output of one command line"""
+
+    def __init__(self, argv: tuple[str, ...], now: float) -> None:
+        self.argv = argv
+        self.output: Optional[str] = None
+        self.refreshed_at = 0.0
+        self.requested_at = now
+        self.failures = 0
+        self.retry_at = 0.0
+        self.running = False
+        self.attempted = False
+        # set whenever no run is in progress, except before the first one
+        self.finished = threading.Event()
+        # the VSX the job polls, the host argument comes last
+        self.device = argv[-1] if argv else ""
+
+    def due(self, now: float, interval: float) -> bool:
+        return not self.running and now - self.refreshed_at >= interval and now >= self.retry_at
+
+    @property
+    def pending(self) -> bool:
+        """running now, or waiting for its first run"""
+        return self.running or not self.attempted
+
+
+class Collector:
+    """Jobs by command line, refreshed in the background by refresh_due"""
+
+    def __init__(self, render: Callable[[Sequence[str]], str], interval: float, idle_timeout: float,
+                 workers: int = 4) -> None:
+        self.render = render
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.jobs: dict[tuple[str, ...], Job] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sansay_vsx_job")
+
+    def lookup(self, argv: Sequence[str], now: float) -> Optional[str]:
+        """the output for argv if it is at most two intervals old, registering new command lines"""
+        key = tuple(argv)
+        with self._lock:
+            job = self.jobs.get(key)
+            if job is None:
+                self.jobs[key] = Job(key, now)
+                return None
+            job.requested_at = now
+            if job.output is None or now - job.refreshed_at > 2 * self.interval:
+                return None
+            return job.output
+
+    def pending(self, argv: Sequence[str]) -> bool:
+        """whether the job of argv is running or has not run yet"""
+        with self._lock:
+            job = self.jobs.get(tuple(argv))
+            return job is not None and job.pending
+
+    def wait(self, argv: Sequence[str], timeout: float) -> tuple[bool, Optional[str]]:
+        """
+        wait up to timeout seconds for a pending run of the job of argv,
+        returning whether it is still pending and its output if recent
+        """
+        job = self.jobs.get(tuple(argv))
+        if job is None:
+            return False, None
+        job.finished.wait(timeout)
+        return job.pending, self.lookup(argv, time.time())
+
+    def refresh_due(self, now: float) -> list[Future]:
+        """
+        drop idle jobs and queue the agent run of every job whose output is
+        older than the interval, returning the futures of the queued runs.
+        Jobs of a VSX that already has a job running wait for the next
+        refresh: the runs of one VSX share its pooled HTTP session.
+        """
+        with self._lock:
+            for key in [key for key, job in self.jobs.items() if now - job.requested_at > self.idle_timeout]:
+                LOGGER.info("dropping idle collector job for %s", key[-1] if key else key)
+                del self.jobs[key]
+            busy = {job.device for job in self.jobs.values() if job.running}
+            due = []
+            for job in self.jobs.values():
+                if job.due(now, self.interval) and job.device not in busy:
+                    busy.add(job.device)
+                    due.append(job)
+            for job in due:
+                job.running = True
+                job.finished.clear()
+        return [self._pool.submit(self._refresh, job) for job in due]
+
+    def _refresh(self, job: Job) -> None:
+        try:
+            output = self.render(job.argv)
+        except Exception as e:  # a broken job must not stop the others
+            with self._lock:
+                job.running = False
+                job.attempted = True
+                job.finished.set()
+                job.failures += 1
+                backoff = self.interval * min(2 ** (job.failures - 1), MAX_BACKOFF_INTERVALS)
+                job.retry_at = time.time() + backoff
+            LOGGER.warning("collector job for %s failed (%d in a row), retrying in %.0fs: %s",
+                           job.argv[-1] if job.argv else job.argv, job.failures, backoff, e)
+            return
+        with self._lock:
+            job.running = False
+            job.attempted = True
+            job.finished.set()
+            job.failures = 0
+            job.retry_at = 0.0
+            job.output = output
+            job.refreshed_at = time.time()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_agent_output(argv: Sequence[str]) -> str:
+    """run the agent for argv in this process and return the sections it writes"""
+    # Imported here so that the client side of this module stays light.
+    from cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx import (
+        agent_sansay_vsx_main,
+        mark_threaded_process,
+        parse_arguments,
+    )
+
+    mark_threaded_process()
+
+    args = parse_arguments(argv)
+    # Requests are answered with the last completed run at any time, also
+    # while the next run is advancing the state files: a delta or snapshot
+    # reference in the served output could point at a generation the state
+    # already left. Like the exporter, the collector serves full sections.
+    args.delta_sections = False
+    args.mmap_snapshot = False
+    # Debug tracing reconfigures the process wide LOGGER, which all jobs share.
+    args.debug = False
+    # An explicit stream rather than redirect_stdout: sys.stdout is shared by
+    # all jobs running in the pool at the same time.
+    output = io.StringIO()
+    agent_sansay_vsx_main(args, output)
+    return output.getvalue()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            argv = json.loads(self.rfile.readline())["argv"]
+        except (ValueError, KeyError, TypeError):
+            self.wfile.write(b"ERROR\n")
+            return
+        collector = self.server.collector
+        output = collector.lookup(argv, time.time())
+        if output is None and collector.pending(argv):
+            # Running the agent in the client now would poll the VSX and
+            # write the state files of this command line next to the job.
+            self.wfile.write(b"PENDING\n")
+            self.wfile.flush()
+            pending, output = collector.wait(argv, self.server.run_wait_timeout)
+            if output is None and pending:
+                self.wfile.write(b"OK\n")
+                return
+        if output is None:
+            self.wfile.write(b"MISS\n")
+        else:
+            self.wfile.write(b"OK\n" + output.encode("utf-8"))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, collector: Collector, run_wait_timeout: float = RUN_WAIT_TIMEOUT) -> None:
+        self.collector = collector
+        self.run_wait_timeout = run_wait_timeout
+        super().__init__(str(path), _RequestHandler)
+
+
+def refresh_forever(collector: Collector, stop: threading.Event) -> None:
+    while not stop.is_set():
+        collector.refresh_due(time.time())
+        stop.wait(1.0)
+
+
+def run_collector(path: Path, interval: float, idle_timeout: float,
+                  render: Callable[[Sequence[str]], str] = render_agent_output, workers: int = 4) -> int:
+    """serve the collector socket at path until interrupted"""
+    collector = Collector(render, interval, idle_timeout, workers)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        path.unlink()
+    # The command lines carry the VSX credentials: only the site user may connect.
+    previous_umask = os.umask(0o177)
+    try:
+        server = _Server(path, collector)
+    finally:
+        os.umask(previous_umask)
+
+    stop = threading.Event()
+    refresher = threading.Thread(target=refresh_forever, args=(collector, stop), daemon=True)
+    refresher.start()
+    LOGGER.info("sansay_vsx collector listening on %s", path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        collector.close()
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        default=None,
+        help=f"""Unix socket to listen on (default: ${SOCKET_ENV} or $OMD_ROOT/tmp/run/sansay_vsx_collector.sock)""",
+    )
+    parser.add_argument(
+        "--interval",
+        default=60.0,
+        type=float,
+        help="""Seconds between refreshes of every job (default: 60)""",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        default=600.0,
+        type=float,
+        help="""Drop jobs that were not requested for this many seconds (default: 600)""",
+    )
+    parser.add_argument(
+        "--workers",
+        default=4,
+        type=int,
+        help="""Run at most this many jobs at the same time (default: 4)""",
+    )
+    parser.add_argument("--verbose", action="store_true", default=False, help="""Log job changes to stderr""")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    return run_collector(args.socket or default_socket_path(), args.interval, args.idle_timeout,
+                         workers=args.workers)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+"""
+OpenMetrics exporter mode of the Sansay VSX special agent.
+
+The exporter polls the VSX on its own schedule with the regular agent
+pipeline, keeps the latest processed stats in memory and serves them on
+/metrics, so Prometheus can scrape the VSX without a second poller hitting
+the API.
+
+The Checkmk agent sections of the same poll are served on /sections. With
+--from-exporter the special agent run by Checkmk reads them from there
+instead of polling the VSX itself, so one poll feeds both.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from collections.abc import Callable, Iterator, Mapping
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+
+LOGGER = logging.getLogger("agent_sansay_vsx")
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+SECTIONS_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+# System counters that only ever grow (until a restart or HA switchover).
+# Everything else in system_stat is exported as a gauge.
+_SYSTEM_COUNTERS = ("sum_attempt_session", "max_cps_exceed", "max_session_exceed")
+
+# Media server fields used as labels rather than values
+_MEDIA_LABELS = {"mediaSrvIndex": "media_index", "alias": "alias", "switchType": "switch_type"}
+
+
+class Snapshot:
+    """The latest processed stats and when they were collected, shared between poller and server"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.stats: Optional[Mapping[str, Any]] = None
+        self.sections = ""
+        self.collected_at = 0.0
+        self.duration = 0.0
+        self.polls = 0
+        self.failures = 0
+        self.last_poll_ok = False
+
+    def update(self, stats: Optional[Mapping[str, Any]], collected_at: float, duration: float,
+               sections: str = "") -> None:
+        with self._lock:
+            self.polls += 1
+            self.duration = duration
+            self.last_poll_ok = bool(stats) and any(stats.values())
+            if not self.last_poll_ok:
+                self.failures += 1
+                return
+            self.stats = stats
+            self.sections = sections
+            self.collected_at = collected_at
+
+    def read(self) -> tuple[Optional[Mapping[str, Any]], float, float, int, int, bool]:
+        with self._lock:
+            return self.stats, self.collected_at, self.duration, self.polls, self.failures, self.last_poll_ok
+
+    def read_sections(self) -> tuple[str, float]:
+        """the agent sections of the served snapshot and when they were collected"""
+        with self._lock:
+            return self.sections, self.collected_at
+
+
+def _snake_case(name: str) -> str:
+    return re.sub(r"[^a-z0-9_]", "_", re.sub(r"(?<=[a-z0-9])([A-Z])", r"_\1", name).lower())
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Mapping[str, Any]) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return float(value)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number == number else None
+
+
+def _format(number: float) -> str:
+    """the exact sample value, :g would round counters and timestamps to 6 digits"""
+    if number in (math.inf, -math.inf):
+        return "+Inf" if number > 0 else "-Inf"
+    if number.is_integer():
+        return str(int(number))
+    return repr(number)
+
+
+class _Families:
+    """collects samples per metric family so every family is written as one block"""
+
+    def __init__(self) -> None:
+        self.families: dict[str, tuple[str, str, list[str]]] = {}
+
+    def add(self, name: str, metric_type: str, help_text: str, labels: Mapping[str, Any], value: Any) -> None:
+        number = _number(value)
+        if number is None:
+            return
+        family = self.families.setdefault(name, (metric_type, help_text, []))
+        sample = f"{name}_total" if metric_type == "counter" else name
+        family[2].append(f"{sample}{_labels(labels)} {_format(number)}")
+
+    def render(self) -> Iterator[str]:
+        for name, (metric_type, help_text, samples) in self.families.items():
+            yield f"# TYPE {name} {metric_type}"
+            yield f"# HELP {name} {help_text}"
+            yield from samples
+
+
+def render_openmetrics(host: str, snapshot: Snapshot, now: float) -> str:
+    """the exposition of the current snapshot, including its age"""
+    stats, collected_at, duration, polls, failures, last_poll_ok = snapshot.read()
+    families = _Families()
+    host_label = {"host": host}
+
+    families.add("sansay_vsx_up", "gauge", "Whether the last poll of the VSX returned data",
+                 host_label, int(last_poll_ok))
+    families.add("sansay_vsx_poll_duration_seconds", "gauge", "Duration of the last poll", host_label, duration)
+    families.add("sansay_vsx_polls", "counter", "Polls since the exporter started", host_label, polls)
+    families.add("sansay_vsx_poll_failures", "counter", "Polls without any data", host_label, failures)
+
+    if stats:
+        families.add("sansay_vsx_snapshot_timestamp_seconds", "gauge",
+                     "Unix time the served snapshot was collected", host_label, collected_at)
+        families.add("sansay_vsx_snapshot_age_seconds", "gauge",
+                     "Age of the served snapshot", host_label, round(now - collected_at, 3))
+
+        for field, value in sorted((stats.get("system_stat") or {}).items()):
+            if field in _SYSTEM_COUNTERS:
+                families.add(f"sansay_vsx_system_{field}", "counter", f"VSX system counter {field}", host_label, value)
+            else:
+                families.add(f"sansay_vsx_system_{field}", "gauge", f"VSX system value {field}", host_label, value)
+
+        for trunk_id, trunk in (stats.get("trunks") or {}).items():
+            labels = {**host_label, "trunk_id": trunk_id, "alias": trunk.get("alias", "")}
+            for direction, values in trunk.get("calculated_stats", {}).items():
+                for metric, value in values.items():
+                    families.add(f"sansay_vsx_trunk_{direction}_{metric}", "gauge",
+                                 f"Trunk {direction} {metric.replace('_', ' ')}", labels, value)
+            for direction, values in trunk.get("counters", {}).items():
+                for counter, value in values.items():
+                    families.add(f"sansay_vsx_trunk_{direction}_{counter}_15m", "gauge",
+                                 f"Trunk {direction} {counter.replace('_', ' ')} in the last 15 minute interval",
+                                 labels, value)
+
+        for media_server in stats.get("media_stats") or []:
+            labels = {**host_label, **{label: media_server.get(field, "") for field, label in _MEDIA_LABELS.items()}}
+            families.add("sansay_vsx_media_up", "gauge", "Media server status is up",
+                         labels, int(media_server.get("status") == "up"))
+            for field, value in sorted(media_server.items()):
+                if field in _MEDIA_LABELS or field == "status":
+                    continue
+                families.add(f"sansay_vsx_media_{_snake_case(field)}", "gauge", f"Media server {field}", labels, value)
+
+    return "\n".join([*families.render(), "# EOF", ""])
+
+
+Collect = Callable[[Any], tuple[Optional[Mapping[str, Any]], str]]
+
+
+def poll_forever(args, collect: Collect, snapshot: Snapshot, stop: threading.Event) -> None:
+    """
+    poll every --exporter-interval seconds until stop is set, counted from
+    the start of each poll. collect(args) returns the processed stats and
+    the agent sections rendered from the same poll.
+    """
+    while not stop.is_set():
+        start = time.monotonic()
+        try:
+            stats, sections = collect(args)
+        except Exception as e:  # keep serving the last snapshot whatever went wrong
+            LOGGER.warning("[%s] -> exporter poll failed: %s", args.host, e)
+            stats, sections = None, ""
+        duration = time.monotonic() - start
+        snapshot.update(stats, time.time(), duration, sections)
+        stop.wait(max(0.0, args.exporter_interval - duration))
+
+
+def make_handler(host: str, snapshot: Snapshot, max_age: Optional[float] = None) -> type[BaseHTTPRequestHandler]:
+    """
+    /metrics serves the OpenMetrics exposition, /sections the agent
+    sections, or 503 while there are none at most max_age seconds old.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0]
+            if path == "/metrics":
+                self._send(render_openmetrics(host, snapshot, time.time()), CONTENT_TYPE)
+            elif path == "/sections":
+                sections, collected_at = snapshot.read_sections()
+                if not sections or (max_age is not None and time.time() - collected_at > max_age):
+                    self.send_error(503, "no recent agent sections")
+                    return
+                self._send(sections, SECTIONS_CONTENT_TYPE)
+            else:
+                self.send_error(404)
+
+        def _send(self, text: str, content_type: str) -> None:
+            body = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args) -> None:
+            LOGGER.debug("[%s] -> exporter %s", host, fmt % args)
+
+    return MetricsHandler
+
+
+def run_exporter(args, collect: Collect) -> int:
+    """serve /metrics and /sections on --exporter-address:--exporter-port until interrupted"""
+    snapshot = Snapshot()
+    stop = threading.Event()
+    poller = threading.Thread(target=poll_forever, args=(args, collect, snapshot, stop), daemon=True)
+    server = ThreadingHTTPServer(
+        (args.exporter_address, args.exporter_port),
+        make_handler(args.host, snapshot, max_age=2 * args.exporter_interval),
+    )
+    LOGGER.info("[%s] -> serving OpenMetrics on %s:%d", args.host, args.exporter_address, args.exporter_port)
+    poller.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+    return 0
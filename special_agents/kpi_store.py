@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+"""
+Local SQLite store of the per-trunk KPIs of the Sansay VSX special agent.
+
+With --kpi-db the agent appends the 15 minute counters of every trunk to a
+SQLite database on each run, one transaction per run. The rows are kept in
+three tiers:
+
+    raw   every poll, kept for 2 days
+    15m   the last poll of every 15 minute window, kept for 35 days
+    1h    the sum of the 15 minute windows of every hour, kept for 400 days
+
+The ratios are computed from the summed counters at query time, so that
+they are weighted by call attempts across windows and trunks. The raw tier
+repeats the same window on every poll and is not queried.
+
+Ask for the worst trunks with e.g.:
+
+    python3 -m cmk_addons.plugins.sansay_vsx.special_agents.kpi_store \\
+        --db ~/var/sansay_vsx/kpi.sqlite --kpi asr --since 7d --limit 50
+
+This module only uses the standard library.
+"""
+
+import argparse
+import logging
+import re
+import sqlite3
+import sys
+import time
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Any, Optional
+
+
+LOGGER = logging.getLogger("agent_sansay_vsx")
+
+COUNTERS = ("call_attempt", "call_answer", "call_fail", "call_duration", "pdd_ms")
+
+# tier -> retention in seconds
+RETENTION = {"raw": 2 * 86400, "15m": 35 * 86400, "1h": 400 * 86400}
+
+# (tier, source tier, bucket seconds, how the source rows of a bucket are combined)
+_ROLLUPS = (("15m", "raw", 900, "last"), ("1h", "15m", 3600, "sum"))
+
+# kpi -> (SQL expression over a group of rows, order that puts the worst first)
+KPIS = {
+    "asr": ("100.0 * SUM(call_answer) / SUM(call_attempt)", "ASC"),
+    "fcr": ("100.0 * SUM(call_fail) / SUM(call_attempt)", "DESC"),
+    "acd": ("1.0 * SUM(call_duration) / SUM(call_attempt)", "ASC"),
+    "pdd": ("SUM(pdd_ms) / 1000.0 / SUM(call_attempt)", "DESC"),
+}
+
+_COLUMNS = ", ".join(COUNTERS)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trunk (
+    host TEXT NOT NULL,
+    trunk_id TEXT NOT NULL,
+    alias TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (host, trunk_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup (
+    host TEXT NOT NULL,
+    tier TEXT NOT NULL,
+    done_until INTEGER NOT NULL,
+    PRIMARY KEY (host, tier)
+) WITHOUT ROWID;
+"""
+
+_TIER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kpi_{tier} (
+    host TEXT NOT NULL,
+    trunk_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    call_attempt INTEGER NOT NULL,
+    call_answer INTEGER NOT NULL,
+    call_fail INTEGER NOT NULL,
+    call_duration INTEGER NOT NULL,
+    pdd_ms INTEGER NOT NULL,
+    PRIMARY KEY (host, trunk_id, ts, direction)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kpi_{tier}_ts ON kpi_{tier} (ts, host);
+"""
+
+
+def open_store(path: Path) -> sqlite3.Connection:
+    """open (and create) the database at path"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Several agents (one per VSX) may write at the same time.
+    conn = sqlite3.connect(str(path), timeout=30.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA + "".join(_TIER_SCHEMA.format(tier=tier) for tier in RETENTION))
+    return conn
+
+
+def record_trunks(conn: sqlite3.Connection, host: str, trunks: Mapping[str, Any], now: int) -> int:
+    """append the counters of every trunk as raw rows, returns the number of rows"""
+    rows = [
+        (host, str(trunk_id), now, direction, *(int(counters.get(name, 0)) for name in COUNTERS))
+        for trunk_id, trunk in trunks.items()
+        for direction, counters in trunk.get("counters", {}).items()
+    ]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO kpi_raw (host, trunk_id, ts, direction, {_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO trunk (host, trunk_id, alias) VALUES (?, ?, ?)",
+        [(host, str(trunk_id), trunk.get("alias", "")) for trunk_id, trunk in trunks.items()],
+    )
+    return len(rows)
+
+
+def downsample(conn: sqlite3.Connection, host: str, now: int) -> None:
+    """roll the completed buckets of host up into the 15m and 1h tiers"""
+    for tier, source, seconds, combine in _ROLLUPS:
+        until = now // seconds * seconds
+        row = conn.execute("SELECT done_until FROM rollup WHERE host = ? AND tier = ?", (host, tier)).fetchone()
+        since = row[0] if row else 0
+        if since >= until:
+            continue
+        if combine == "last":
+            # SQLite takes the bare columns from the row that has MAX(ts).
+            select = (
+                f"SELECT host, trunk_id, bucket, direction, {_COLUMNS} FROM ("
+                f"SELECT host, trunk_id, direction, ts / {seconds} * {seconds} AS bucket, {_COLUMNS}, MAX(ts)"
+                f" FROM kpi_{source} WHERE host = ? AND ts >= ? AND ts < ?"
+                " GROUP BY trunk_id, direction, bucket)"
+            )
+        else:
+            select = (
+                f"SELECT host, trunk_id, ts / {seconds} * {seconds} AS bucket, direction,"
+                f" {', '.join(f'SUM({name})' for name in COUNTERS)}"
+                f" FROM kpi_{source} WHERE host = ? AND ts >= ? AND ts < ?"
+                " GROUP BY trunk_id, direction, bucket"
+            )
+        conn.execute(
+            f"INSERT OR REPLACE INTO kpi_{tier} (host, trunk_id, ts, direction, {_COLUMNS}) {select}",
+            (host, since, until),
+        )
+        conn.execute("INSERT OR REPLACE INTO rollup (host, tier, done_until) VALUES (?, ?, ?)", (host, tier, until))
+
+
+def prune(conn: sqlite3.Connection, now: int) -> None:
+    """drop the rows that are older than the retention of their tier"""
+    for tier, retention in RETENTION.items():
+        conn.execute(f"DELETE FROM kpi_{tier} WHERE ts < ?", (now - retention,))
+
+
+def store_trunk_kpis(path: Path, host: str, trunks: Mapping[str, Any], now: Optional[float] = None) -> int:
+    """record, downsample and prune in one transaction, returns the number of raw rows written"""
+    now = int(time.time() if now is None else now)
+    conn = open_store(path)
+    try:
+        with conn:
+            count = record_trunks(conn, host, trunks, now)
+            downsample(conn, host, now)
+            prune(conn, now)
+    finally:
+        conn.close()
+    return count
+
+
+def top_trunks(conn: sqlite3.Connection, kpi: str, since: int, until: int, limit: int = 50,
+               tier: str = "15m", host: Optional[str] = None, direction: Optional[str] = None,
+               min_attempts: int = 1) -> list[tuple]:
+    """
+    The worst limit trunks by kpi between since and until as
+    (host, trunk_id, alias, direction, value, attempts) tuples.
+    """
+    expression, order = KPIS[kpi]
+    conditions = ["k.ts >= ?", "k.ts < ?"]
+    parameters: list[Any] = [since, until]
+    if host is not None:
+        conditions.append("k.host = ?")
+        parameters.append(host)
+    if direction is not None:
+        conditions.append("k.direction = ?")
+        parameters.append(direction)
+    query = (
+        f"SELECT k.host, k.trunk_id, COALESCE(t.alias, ''), k.direction, {expression} AS value, SUM(call_attempt)"
+        f" FROM kpi_{tier} AS k LEFT JOIN trunk AS t ON t.host = k.host AND t.trunk_id = k.trunk_id"
+        f" WHERE {' AND '.join(conditions)}"
+        " GROUP BY k.host, k.trunk_id, k.direction"
+        " HAVING SUM(call_attempt) >= ?"
+        f" ORDER BY value {order}, SUM(call_attempt) DESC LIMIT ?"
+    )
+    return conn.execute(query, [*parameters, max(min_attempts, 1), limit]).fetchall()
+
+
+def parse_duration(text: str) -> int:
+    """seconds of a duration like 90m, 12h, 7d or 2w"""
+    match = re.fullmatch(r"(\d+)([mhdw])", text.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid duration {text!r}, use e.g. 90m, 12h, 7d or 2w")
+    return int(match.group(1)) * {"m": 60, "h": 3600, "d": 86400, "w": 604800}[match.group(2)]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, required=True, help="""Database written by the agent with --kpi-db""")
+    parser.add_argument("--kpi", choices=sorted(KPIS), default="asr", help="""KPI to rank the trunks by (default: asr)""")
+    parser.add_argument("--since", type=parse_duration, default=7 * 86400,
+                        help="""Look back this far, e.g. 12h or 7d (default: 7d)""")
+    parser.add_argument("--limit", type=int, default=50, help="""Number of trunks to show (default: 50)""")
+    parser.add_argument("--host", default=None, help="""Only trunks of this VSX""")
+    parser.add_argument("--direction", choices=("ingress", "egress"), default=None, help="""Only this direction""")
+    parser.add_argument("--min-attempts", type=int, default=10,
+                        help="""Ignore trunks with fewer call attempts in the period (default: 10)""")
+    parser.add_argument("--tier", choices=("auto", "15m", "1h"), default="auto",
+                        help="""Tier to query, auto uses 1h for periods over two days (default: auto)""")
+    args = parser.parse_args(argv)
+
+    if not args.db.exists():
+        print(f"No KPI database at {args.db}", file=sys.stderr)
+        return 1
+    tier = args.tier if args.tier != "auto" else ("1h" if args.since > 2 * 86400 else "15m")
+    now = int(time.time())
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True, timeout=30.0)
+    try:
+        rows = top_trunks(conn, args.kpi, now - args.since, now, args.limit, tier,
+                          args.host, args.direction, args.min_attempts)
+    finally:
+        conn.close()
+
+    print("\t".join(("host", "trunk_id", "alias", "direction", args.kpi, "attempts")))
+    for host, trunk_id, alias, direction, value, attempts in rows:
+        print(f"{host}\t{trunk_id}\t{alias}\t{direction}\t{value:.1f}\t{attempts}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
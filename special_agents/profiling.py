@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+Profiling hooks of the Sansay VSX special agent.
+
+--profile DIR runs the agent under cProfile and writes a pstats file,
+--trace-malloc DIR traces its allocations with tracemalloc and writes the
+top allocation sites. Both print a one-line summary to stderr, so the
+sections on stdout stay intact and the agent can be profiled against a
+production device from the site:
+
+    ~/local/lib/python3/cmk_addons/plugins/sansay_vsx/libexec/agent_sansay_vsx \\
+        --user monitor --password ... --profile ~/tmp/sansay_vsx 10.0.0.1 >/dev/null
+    python3 -m pstats ~/tmp/sansay_vsx/profile_10.0.0.1_20261019-101500.pstats
+"""
+
+import cProfile
+import pstats
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+
+def _report_path(directory: str, kind: str, host: str, stamp: str, suffix: str) -> Path:
+    path = Path(directory) / f"{kind}_{host}_{stamp}.{suffix}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_malloc_report(path: Path, snapshot: tracemalloc.Snapshot, current: int, peak: int, top: int) -> None:
+    """the top allocation sites of snapshot, by size, with the traced totals"""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    lines = [f"current {current / 1048576:.1f} MiB, peak {peak / 1048576:.1f} MiB", ""]
+    lines.extend(str(statistic) for statistic in snapshot.statistics("lineno")[:top])
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def run_profiled(args, run: Callable[[Any], int]) -> int:
+    """run(args) under cProfile and/or tracemalloc as requested by --profile and --trace-malloc"""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    profiler = cProfile.Profile() if args.profile else None
+    if args.trace_malloc:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        if profiler is not None:
+            try:
+                path = _report_path(args.profile, "profile", args.host, stamp, "pstats")
+                profiler.dump_stats(path)
+                calls = pstats.Stats(profiler).total_calls
+                print(f"[{args.host}] -> profile: {wall:.2f}s wall, {cpu:.2f}s CPU, {calls} calls, written to {path}",
+                      file=sys.stderr)
+            except OSError as e:
+                print(f"[{args.host}] -> ERROR: unable to write profile: {e}", file=sys.stderr)
+
+        if args.trace_malloc:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            try:
+                path = _report_path(args.trace_malloc, "malloc", args.host, stamp, "txt")
+                write_malloc_report(path, snapshot, current, peak, args.trace_malloc_top)
+                print(f"[{args.host}] -> trace-malloc: peak {peak / 1048576:.1f} MiB, "
+                      f"{current / 1048576:.1f} MiB still allocated, written to {path}", file=sys.stderr)
+            except OSError as e:
+                print(f"[{args.host}] -> ERROR: unable to write allocation report: {e}", file=sys.stderr)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Record and replay of the raw VSX API responses of the special agent.
+
+With --record DIR every response of fetch_sansay_json is saved to DIR: the
+(decompressed) body in its own file and the status, headers, timing and
+transfer size as one line of DIR/responses.jsonl. Failed requests are
+recorded with their error.
+
+With --replay DIR the agent answers its requests from such a recording
+instead of contacting the VSX, in the recorded order per host and report.
+--replay-speed recorded also reproduces the recorded response times. This
+allows benchmarking, profiling and regression tests against the payload of
+a real device without touching it again:
+
+    agent_sansay_vsx --user monitor --password ... --record ~/tmp/vsx1 10.0.0.1
+    agent_sansay_vsx --user monitor --replay ~/tmp/vsx1 --profile ~/tmp/profiles 10.0.0.1
+
+This module only uses the standard library.
+"""
+
+import json
+import re
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Optional
+
+
+INDEX_NAME = "responses.jsonl"
+
+
+class Recorder:
+    """appends responses to a recording directory"""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index = self.directory / INDEX_NAME
+        self._sequence = len(index.read_text(encoding="utf-8").splitlines()) if index.exists() else 0
+
+    def record(self, host: str, report: str, elapsed: float, status: Optional[int] = None, reason: str = "",
+               headers: Optional[Mapping[str, str]] = None, body: bytes = b"", wire_bytes: int = 0,
+               error: Optional[str] = None) -> None:
+        with self._lock:
+            self._sequence += 1
+            entry: dict[str, Any] = {
+                "sequence": self._sequence,
+                "time": round(time.time(), 3),
+                "host": host,
+                "report": report,
+                "elapsed": round(elapsed, 6),
+            }
+            if error is not None:
+                entry["error"] = error
+            else:
+                body_name = f"{self._sequence:05d}_{re.sub(r'[^A-Za-z0-9_.-]', '_', host)}_{report}.body"
+                (self.directory / body_name).write_bytes(body)
+                entry.update({
+                    "status": status,
+                    "reason": reason,
+                    "headers": dict(headers or {}),
+                    "wire_bytes": wire_bytes,
+                    "body": body_name,
+                })
+            with open(self.directory / INDEX_NAME, "a", encoding="utf-8") as index:
+                index.write(json.dumps(entry) + "\n")
+
+
+class Replayer:
+    """
+    Serves the responses of a recording in order. Responses are looked up
+    by host and report, or by report alone if the host was not recorded.
+    The last response of a report is served again once all were used.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, str], list[dict]] = {}
+        self._by_report: dict[str, list[dict]] = {}
+        self._position: dict[tuple[str, str], int] = {}
+        with open(directory / INDEX_NAME, encoding="utf-8") as index:
+            for line in index:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault((entry["host"], entry["report"]), []).append(entry)
+                    self._by_report.setdefault(entry["report"], []).append(entry)
+
+    def _lookup(self, host: str, report: str) -> tuple[tuple[str, str], list[dict]]:
+        if (host, report) in self._entries:
+            return (host, report), self._entries[(host, report)]
+        return ("*", report), self._by_report.get(report, [])
+
+    def next(self, host: str, report: str) -> Optional[dict]:
+        """the next response to serve for report of host, None if the report was never recorded"""
+        key, entries = self._lookup(host, report)
+        if not entries:
+            return None
+        with self._lock:
+            position = self._position.get(key, 0)
+            self._position[key] = position + 1
+        return entries[min(position, len(entries) - 1)]
+
+    def first_successful(self, host: str, report: str) -> Optional[dict]:
+        """the first response of report with status 200"""
+        return next((entry for entry in self._lookup(host, report)[1] if entry.get("status") == 200), None)
+
+    def body(self, entry: Mapping[str, Any]) -> bytes:
+        return (self.directory / entry["body"]).read_bytes()
+
+
+_RECORDERS: dict[str, Recorder] = {}
+_REPLAYERS: dict[str, Replayer] = {}
+_LOCK = threading.Lock()
+
+
+def recorder_for(directory: str) -> Recorder:
+    """the recorder of a directory, shared by all fetches of the process"""
+    with _LOCK:
+        if directory not in _RECORDERS:
+            _RECORDERS[directory] = Recorder(Path(directory))
+        return _RECORDERS[directory]
+
+
+def replayer_for(directory: str) -> Replayer:
+    """the replayer of a directory, shared by all fetches of the process"""
+    with _LOCK:
+        if directory not in _REPLAYERS:
+            _REPLAYERS[directory] = Replayer(Path(directory))
+        return _REPLAYERS[directory]
+
+
+def load_recorded_report(directory: str, report: str, host: str = "") -> Optional[Any]:
+    """the decoded body of the first successful recorded response of report, for benchmarks and tests"""
+    replayer = Replayer(Path(directory))
+    entry = replayer.first_successful(host, report)
+    return None if entry is None else json.loads(replayer.body(entry))
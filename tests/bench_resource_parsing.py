@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark serial vs. process pool parsing of the resource report.
+
+Builds synthetic mysqldump payloads of increasing size, runs
+process_resource_data followed by process_trunk_stats on both paths and
+reports the row count where the pool starts to pay off. With --replay the
+resource report of a recording made with the agent's --record option is
+benchmarked instead. Run from the Checkmk site:
+
+    python3 -m tests.bench_resource_parsing [--workers 4] [--repeat 3] [--replay DIR]
+"""
+
+import argparse
+import copy
+import time
+from unittest.mock import MagicMock
+
+from cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx import (
+    process_realtime_trunk_data,
+    process_resource_data,
+    process_trunk_stats,
+)
+from cmk_addons.plugins.sansay_vsx.special_agents.recording import load_recorded_report
+
+SIZES = (1000, 5000, 10000, 25000, 50000, 100000)
+COUNTERS = (
+    "1st15mins_pdd_ms",
+    "1st15mins_call_attempt",
+    "1st15mins_call_durationSec",
+    "1st15mins_call_fail",
+    "1st15mins_call_answer",
+    "2nd15mins_call_attempt",
+    "2nd15mins_call_fail",
+    "2nd15mins_call_answer",
+)
+
+
+def make_resource_payload(rows_per_table: int) -> dict:
+    def row(i: int) -> dict:
+        fields = [
+            {"name": "id", "content": str(i)},
+            {"name": "trunk_id", "content": str(i)},
+            {"name": "alias", "content": f"Trunk {i}"},
+        ]
+        fields += [{"name": name, "content": str((i * 7 + n) % 1000)} for n, name in enumerate(COUNTERS)]
+        return {"field": fields}
+
+    rows = [row(i) for i in range(rows_per_table)]
+    return {
+        "mysqldump": {
+            "database": {
+                "table": [
+                    {"name": "ingress_stat", "row": rows},
+                    {"name": "gw_egress_stat", "row": rows},
+                ]
+            }
+        }
+    }
+
+
+def run_pipeline(args, payload: dict) -> tuple[float, dict]:
+    start = time.perf_counter()
+    trunks = process_resource_data(args, payload)
+    stats = {"trunks": process_realtime_trunk_data(trunks, {})}
+    result = process_trunk_stats(args, stats)
+    return time.perf_counter() - start, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--replay", default=None, metavar="DIR", help="recording made with the agent's --record")
+    options = parser.parse_args()
+
+    serial_args = MagicMock(host="bench", debug=False, parse_workers=0)
+    parallel_args = MagicMock(host="bench", debug=False, parse_workers=options.workers, parse_parallel_threshold=0)
+
+    if options.replay:
+        payload = load_recorded_report(options.replay, "resource")
+        if payload is None:
+            print(f"No successful resource report recorded in {options.replay}")
+            return
+        rows = sum(len(table["row"]) for table in payload["mysqldump"]["database"]["table"] if isinstance(table, dict))
+        serial = min(run_pipeline(serial_args, copy.deepcopy(payload))[0] for _ in range(options.repeat))
+        parallel = min(run_pipeline(parallel_args, copy.deepcopy(payload))[0] for _ in range(options.repeat))
+        print(f"{rows} recorded rows: serial {serial:.3f}s, parallel {parallel:.3f}s ({serial / parallel:.2f}x)")
+        return
+
+    crossover = None
+    print(f"{'rows':>8} {'serial s':>10} {'parallel s':>11} {'speedup':>8}")
+    for size in SIZES:
+        payload = make_resource_payload(size // 2)
+        serial = min(run_pipeline(serial_args, copy.deepcopy(payload))[0] for _ in range(options.repeat))
+        parallel = min(run_pipeline(parallel_args, copy.deepcopy(payload))[0] for _ in range(options.repeat))
+        speedup = serial / parallel
+        if crossover is None and speedup > 1.0:
+            crossover = size
+        print(f"{size:>8} {serial:>10.3f} {parallel:>11.3f} {speedup:>7.2f}x")
+
+    if crossover is None:
+        print(f"No crossover up to {SIZES[-1]} rows with {options.workers} workers, keep the serial path.")
+    else:
+        print(f"Crossover at about {crossover} rows: use --parse-parallel-threshold {crossover}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,55 @@ Covers both happy paths and the specific failure modes observed in crash reports
   - KeyError('trunks') when resource endpoint returns None (crash 2026-03-25)
   - Non-dict table entries ('Max recursion depth reached') from HA failover events
   - Duplicate calculated_stats keys (ingress/ingress_stat, egress/gw_egress_stat)
+  - Re-polling and last good fallback for the partial payloads of an HA failover
+  - gzip negotiation and transfer byte counts against a local HTTP server
+  - download deadline, byte-rate floor and body size limits
+  - sections flushed as soon as their reports are processed, with a trailer
+  - memory mapped trunk snapshots round-tripping through the section parser
+  - agent sections rendered for the exporter and read back with --from-exporter
 """
 
+import copy
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
+import requests
+from contextlib import redirect_stdout
 from unittest.mock import MagicMock, patch
 
+from cmk_addons.plugins.sansay_vsx.lib import (
+    TRUNK_DELTA_HISTORY,
+    TRUNK_DELTA_KEY,
+    TRUNK_SNAPSHOT_KEY,
+    parse_sansay_vsx_trunks,
+    rebuild_trunk_view,
+)
 from cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx import (
+    BoundedTraceHandler,
+    DownloadGuard,
+    LOGGER,
+    ResponseTimeHistory,
+    RowTracer,
+    agent_sansay_vsx_main,
+    build_trunk_delta,
+    collect_sections,
+    build_trunk_snapshot,
+    fetch_sansay_json,
+    missing_tables,
+    parse_arguments,
     process_realtime_data,
     process_realtime_trunk_data,
     process_resource_data,
     process_trunk_stats,
     poll_sansay_vsx,
+    state_file_path,
 )
 
 
@@ -24,10 +62,41 @@ from cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx import (
 # Helpers
 # ---------------------------------------------------------------------------
 
+@pytest.fixture(autouse=True)
+def _state_dir(tmp_path):
+    """keep the state files of args without --state-dir out of the real state directory"""
+    with patch(
+        "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.sansay_vsx_state_dir",
+        return_value=tmp_path / "state",
+    ):
+        yield
+
+
 def make_args(**overrides):
     args = MagicMock()
     args.debug = False
     args.host = "10.0.0.1"
+    args.trace_sample = 1
+    args.parse_workers = 0
+    args.adaptive_timeout = False
+    args.breaker_threshold = 0
+    args.cluster_peer = None
+    args.state_dir = None
+    args.timeout = 10
+    args.degraded_retry_timeout = 5.0
+    args.degraded_max_age = 900
+    args.no_compression = False
+    args.kpi_db = None
+    args.from_exporter = None
+    args.mmap_snapshot = False
+    args.deadline = 0
+    args.min_rate = 0
+    args.max_body_size = 0
+    args.profile = None
+    args.trace_malloc = None
+    args.record = None
+    args.replay = None
+    args.replay_speed = "fast"
     for k, v in overrides.items():
         setattr(args, k, v)
     return args
@@ -167,6 +236,57 @@ class TestProcessResourceData:
         result = process_resource_data(make_args(), malformed)
         assert "200" in result
 
+    @staticmethod
+    def _large_resource_data():
+        rows = [_trunk_row(str(i % 700), f"Trunk {i % 700}", i, attempts=i) for i in range(2000)]
+        return {
+            "mysqldump": {
+                "database": {
+                    "table": [
+                        {"name": "ingress_stat", "row": rows},
+                        "Max recursion depth reached",
+                        {"name": "gw_egress_stat", "row": list(reversed(rows))},
+                    ]
+                }
+            }
+        }
+
+    def test_parallel_path_matches_serial(self):
+        data = self._large_resource_data()
+        serial = process_resource_data(make_args(), data)
+        parallel = process_resource_data(make_args(parse_workers=2, parse_parallel_threshold=100), data)
+        assert parallel == serial
+        assert list(parallel) == list(serial)
+        assert [list(t) for t in parallel.values()] == [list(t) for t in serial.values()]
+
+    def _contexts(self, data):
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.multiprocessing.get_context",
+                   wraps=multiprocessing.get_context) as get_context:
+            parallel = process_resource_data(make_args(parse_workers=2, parse_parallel_threshold=100), data)
+        return parallel, [call.args[0] for call in get_context.call_args_list]
+
+    def test_parallel_path_does_not_fork_a_threaded_process(self):
+        data = self._large_resource_data()
+        serial = process_resource_data(make_args(), data)
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx._THREADED_PROCESS", True):
+            parallel, contexts = self._contexts(data)
+        assert parallel == serial
+        assert "fork" not in contexts
+
+    def test_stray_thread_does_not_disable_fork(self):
+        # e.g. a cancelled DownloadGuard timer that has not exited yet
+        data = self._large_resource_data()
+        stop = threading.Event()
+        other = threading.Thread(target=stop.wait, daemon=True)
+        other.start()
+        try:
+            with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx._THREADED_PROCESS", False):
+                parallel, contexts = self._contexts(data)
+        finally:
+            stop.set()
+        assert parallel == process_resource_data(make_args(), data)
+        assert contexts == ["fork"]
+
     def test_all_string_tables_returns_empty_trunks(self):
         """When all table entries are error strings, no trunks parsed."""
         malformed = {
@@ -383,6 +503,34 @@ class TestProcessTrunkStats:
         # 3/100 * 100 = 3.0%
         assert realtime["origination_utilization"] == pytest.approx(3.0)
 
+    def test_raw_counters_kept_outside_calculated_stats(self):
+        stats = self._stats_with_tables("ingress_stat", "gw_egress_stat")
+        result = process_trunk_stats(make_args(), stats)
+        assert result["100"]["counters"] == {
+            "ingress": {"call_attempt": 10, "call_fail": 1, "call_answer": 9, "call_duration": 500, "pdd_ms": 3000},
+            "egress": {"call_attempt": 8, "call_fail": 0, "call_answer": 8, "call_duration": 400, "pdd_ms": 2000},
+        }
+
+    def test_cps_and_peak_utilization_calculated(self):
+        stats = self._stats_with_tables("ingress_stat", "gw_egress_stat")
+        stats["trunks"]["100"]["realtime_stat"].update({"totalCLZ": "4", "numCLZCps": "2"})
+        realtime = process_trunk_stats(make_args(), stats)["100"]["calculated_stats"]["realtime"]
+        # cps 1 of cpsLimit 10, numPeak 8 of totalLimit 100
+        assert realtime["cps"] == 1
+        assert realtime["cps_utilization"] == pytest.approx(10.0)
+        assert realtime["peak_sessions"] == 8
+        assert realtime["peak_utilization"] == pytest.approx(8.0)
+        assert realtime["call_limit_exceeded"] == 4
+        assert realtime["cps_limit_exceeded"] == 2
+
+    def test_decimal_realtime_values(self):
+        stats = self._stats_with_tables("ingress_stat", "gw_egress_stat")
+        stats["trunks"]["100"]["realtime_stat"].update({"cps": "1.5", "numOrig": "3.0", "totalCLZ": "4.0"})
+        realtime = process_trunk_stats(make_args(), stats)["100"]["calculated_stats"]["realtime"]
+        assert realtime["cps"] == 1
+        assert realtime["origination_sessions"] == 3
+        assert realtime["call_limit_exceeded"] == 4
+
     def test_returns_none_when_no_trunks_key(self):
         result = process_trunk_stats(make_args(), {})
         assert result is None
@@ -425,3 +573,682 @@ class TestPollSansayVsx:
             mock_fetch.return_value = None
             result = poll_sansay_vsx(args)
         assert result == {}
+
+
+# ---------------------------------------------------------------------------
+# Debug tracing
+# ---------------------------------------------------------------------------
+
+class TestTracing:
+    def test_row_tracer_samples_every_nth_call(self, caplog):
+        tracer = RowTracer(every=3)
+        with caplog.at_level(logging.DEBUG, logger=LOGGER.name):
+            for i in range(7):
+                tracer("row %d", i)
+        assert [r.getMessage() for r in caplog.records] == ["row 0", "row 3", "row 6"]
+
+    def test_bounded_handler_truncates_once(self):
+        stream = io.StringIO()
+        handler = BoundedTraceHandler(stream, max_bytes=20)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        for _ in range(5):
+            handler.emit(logging.makeLogRecord({"msg": "0123456789"}))
+        lines = stream.getvalue().splitlines()
+        assert lines[0] == "0123456789"
+        assert lines[-1].startswith("... trace output truncated")
+        assert len(lines) == 2
+
+    def test_bounded_handler_counts_encoded_bytes(self):
+        stream = io.StringIO()
+        handler = BoundedTraceHandler(stream, max_bytes=20)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        for _ in range(2):
+            handler.emit(logging.makeLogRecord({"msg": "\u00e9" * 5}))
+        assert handler.written == 11
+        assert stream.getvalue().splitlines()[-1].startswith("... trace output truncated after 11 bytes")
+
+    def test_trace_file_closed_after_run(self, tmp_path):
+        path = tmp_path / "trace.log"
+        args = make_args(debug=True, trace_file=str(path), trace_max_bytes=1048576, delta_sections=False,
+                         exporter_port=0)
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json",
+                   return_value=None), redirect_stdout(io.StringIO()):
+            agent_sansay_vsx_main(args)
+        assert not [h for h in LOGGER.handlers if isinstance(h, BoundedTraceHandler)]
+        assert "polling as user" in path.read_text(encoding="utf-8")
+
+    def test_debug_rows_never_reach_stdout(self, capsys, caplog):
+        """Regression: --debug used to print every row into the section stream."""
+        with caplog.at_level(logging.DEBUG, logger=LOGGER.name):
+            process_resource_data(make_args(debug=True), RESOURCE_DATA)
+            process_realtime_data(make_args(debug=True), REALTIME_DATA)
+        assert capsys.readouterr().out == ""
+        assert any("converted to" in r.getMessage() for r in caplog.records)
+
+    def test_no_row_tracing_when_debug_disabled(self, caplog):
+        with caplog.at_level(logging.INFO, logger=LOGGER.name):
+            process_resource_data(make_args(), RESOURCE_DATA)
+        assert not [r for r in caplog.records if r.levelno == logging.DEBUG]
+
+
+# ---------------------------------------------------------------------------
+# Incremental trunk sections
+# ---------------------------------------------------------------------------
+
+class TestBuildTrunkDelta:
+    TRUNKS = {
+        "100": {"alias": "A", "calculated_stats": {"realtime": {"origination_sessions": 1}}},
+        "200": {"alias": "B", "calculated_stats": {"realtime": {"origination_sessions": 0}}},
+    }
+
+    def _args(self, tmp_path, **overrides):
+        return make_args(**{"state_dir": str(tmp_path), "delta_full_every": 30, **overrides})
+
+    def test_first_run_is_full(self, tmp_path):
+        delta = build_trunk_delta(self._args(tmp_path), self.TRUNKS)[TRUNK_DELTA_KEY]
+        assert delta["base"] is None
+        assert delta["changed"] == self.TRUNKS
+        assert delta["members"] == ["100", "200"]
+
+    def test_second_run_only_sends_changed_trunks(self, tmp_path):
+        args = self._args(tmp_path)
+        build_trunk_delta(args, self.TRUNKS)
+        trunks = {**self.TRUNKS, "100": {"alias": "A", "calculated_stats": {"realtime": {"origination_sessions": 5}}}}
+        delta = build_trunk_delta(args, trunks)[TRUNK_DELTA_KEY]
+        assert delta["base"] == 1
+        assert delta["generation"] == 2
+        assert list(delta["changed"]) == ["100"]
+
+    def test_periodic_full_resync(self, tmp_path):
+        args = self._args(tmp_path, delta_full_every=2)
+        build_trunk_delta(args, self.TRUNKS)
+        delta = build_trunk_delta(args, self.TRUNKS)[TRUNK_DELTA_KEY]
+        assert delta["base"] is None
+        assert delta["changed"] == self.TRUNKS
+
+    def test_round_trip_through_parser(self, tmp_path):
+        args = self._args(tmp_path)
+        assert rebuild_trunk_view(build_trunk_delta(args, self.TRUNKS)[TRUNK_DELTA_KEY]) == self.TRUNKS
+        trunks = {"200": self.TRUNKS["200"], "300": {"alias": "C"}}
+        assert rebuild_trunk_view(build_trunk_delta(args, trunks)[TRUNK_DELTA_KEY]) == trunks
+
+    def _generations(self, count):
+        """trunk views of count runs, trunk 100 counting up, 200 dropped and 300 added on the way"""
+        views = []
+        for n in range(count):
+            trunks = {"100": {"alias": "A", "calculated_stats": {"realtime": {"origination_sessions": n}}}}
+            trunks["200" if n < 3 else "300"] = {"alias": "B"}
+            views.append(trunks)
+        return views
+
+    def test_older_delta_parsed_after_state_advanced(self, tmp_path):
+        args = self._args(tmp_path)
+        views = self._generations(6)
+        deltas = [build_trunk_delta(args, trunks)[TRUNK_DELTA_KEY] for trunks in views]
+        # another check helper parsing cached agent output of earlier runs
+        for delta, trunks in zip(deltas[1:], views[1:]):
+            assert delta["base"] is not None
+            assert rebuild_trunk_view(delta) == trunks
+
+    def test_delta_older_than_history_is_empty(self, tmp_path):
+        args = self._args(tmp_path)
+        views = self._generations(TRUNK_DELTA_HISTORY + 3)
+        deltas = [build_trunk_delta(args, trunks)[TRUNK_DELTA_KEY] for trunks in views]
+        assert rebuild_trunk_view(deltas[1]) == {}
+        assert rebuild_trunk_view(deltas[3]) == views[3]
+
+
+class TestBuildTrunkSnapshot:
+    def _trunks(self):
+        args = make_args()
+        return process_trunk_stats(args, {"trunks": process_resource_data(args, copy.deepcopy(RESOURCE_DATA))})
+
+    def test_reference_round_trips_through_parser(self, tmp_path):
+        trunks = self._trunks()
+        payload = build_trunk_snapshot(make_args(state_dir=str(tmp_path)), trunks)
+        reference = payload[TRUNK_SNAPSHOT_KEY]
+        assert reference["generation"] == 1
+        assert reference["snapshot"].endswith("trunks_10.0.0.1.snap")
+        assert dict(parse_sansay_vsx_trunks([[json.dumps(payload)]])) == trunks
+
+    def test_generations_increase(self, tmp_path):
+        args = make_args(state_dir=str(tmp_path))
+        build_trunk_snapshot(args, self._trunks())
+        assert build_trunk_snapshot(args, self._trunks())[TRUNK_SNAPSHOT_KEY]["generation"] == 2
+
+    def test_unexpected_layout_sends_full_section(self, tmp_path):
+        trunks = {"100": {"alias": "A", "calculated_stats": {"realtime": {"origination_sessions": 1}}}}
+        assert build_trunk_snapshot(make_args(state_dir=str(tmp_path)), trunks) == trunks
+
+
+# ---------------------------------------------------------------------------
+# Adaptive timeouts
+# ---------------------------------------------------------------------------
+
+class TestAdaptiveTimeout:
+    def test_configured_timeout_until_enough_samples(self, tmp_path):
+        history = ResponseTimeHistory(tmp_path / "rt.json")
+        for _ in range(ResponseTimeHistory.MIN_SAMPLES - 1):
+            history.record("resource", 1.0)
+        assert history.timeout_for("resource", 10, 95, 2.0) == 10.0
+
+    def test_percentile_plus_margin(self, tmp_path):
+        history = ResponseTimeHistory(tmp_path / "rt.json")
+        for seconds in [1.0, 1.2, 1.1, 0.9, 3.0, 1.0, 1.3, 1.0, 1.1, 1.2]:
+            history.record("realtime", seconds)
+        # nearest-rank p90 of 10 samples is the 9th smallest value, 1.3
+        assert history.timeout_for("realtime", 10, 90, 2.0) == pytest.approx(3.3)
+
+    def test_capped_by_configured_maximum(self, tmp_path):
+        history = ResponseTimeHistory(tmp_path / "rt.json")
+        for _ in range(10):
+            history.record("resource", 30.0)
+        assert history.timeout_for("resource", 10, 95, 2.0) == 10.0
+
+    def test_history_persisted_and_bounded(self, tmp_path):
+        path = tmp_path / "rt.json"
+        history = ResponseTimeHistory(path)
+        for i in range(ResponseTimeHistory.MAX_SAMPLES + 5):
+            history.record("resource", float(i))
+        history.save()
+        samples = ResponseTimeHistory(path).samples["resource"]
+        assert len(samples) == ResponseTimeHistory.MAX_SAMPLES
+        assert samples[-1] == float(ResponseTimeHistory.MAX_SAMPLES + 4)
+
+    def test_poll_reports_chosen_timeouts(self, tmp_path):
+        args = make_args(adaptive_timeout=True, state_dir=str(tmp_path), timeout=10,
+                         timeout_percentile=95.0, timeout_margin=2.0)
+        agent_info = {}
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json"
+        ) as mock_fetch:
+            mock_fetch.return_value = None
+            poll_sansay_vsx(args, agent_info)
+        assert agent_info["timeouts"] == {"resource": 10.0, "realtime": 10.0, "media_server": 10.0}
+        assert set(agent_info["response_times"]) == {"resource", "realtime", "media_server"}
+        assert mock_fetch.call_args.kwargs["timeout"] == 10.0
+
+    def test_failed_fetches_not_recorded(self, tmp_path):
+        args = make_args(adaptive_timeout=True, state_dir=str(tmp_path), timeout=10,
+                         timeout_percentile=95.0, timeout_margin=2.0)
+        responses = {"resource": None, "realtime": REALTIME_DATA, "media_server": None}
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json",
+                   side_effect=lambda args, report, **kwargs: responses[report]):
+            poll_sansay_vsx(args, {})
+        assert set(ResponseTimeHistory(state_file_path(args, "response_times")).samples) == {"realtime"}
+
+
+# ---------------------------------------------------------------------------
+# Circuit breaker
+# ---------------------------------------------------------------------------
+
+class TestCircuitBreaker:
+    FETCH = "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json"
+
+    def _args(self, tmp_path):
+        return make_args(state_dir=str(tmp_path), breaker_threshold=2,
+                         breaker_backoff=60.0, breaker_max_backoff=900.0)
+
+    def _poll(self, args, side_effect):
+        agent_info = {}
+        with patch(self.FETCH) as mock_fetch:
+            mock_fetch.side_effect = side_effect
+            stats = poll_sansay_vsx(args, agent_info)
+        return stats, agent_info, [c.args[1] for c in mock_fetch.call_args_list]
+
+    def _open(self, args):
+        for _ in range(args.breaker_threshold):
+            self._poll(args, [None, None, None])
+
+    def test_opens_after_threshold_failed_runs(self, tmp_path):
+        args = self._args(tmp_path)
+        _, info, calls = self._poll(args, [None, None, None])
+        assert info["breaker"]["state"] == "closed"
+        assert len(calls) == 3
+        _, info, _ = self._poll(args, [None, None, None])
+        assert info["breaker"]["state"] == "open"
+        assert info["breaker"]["next_probe_in"] == pytest.approx(60.0, abs=1)
+
+    def test_open_breaker_skips_fetching(self, tmp_path):
+        args = self._args(tmp_path)
+        self._open(args)
+        stats, info, calls = self._poll(args, [])
+        assert calls == []
+        assert stats == {}
+        assert info["breaker"]["state"] == "open"
+
+    def test_failed_probe_doubles_backoff(self, tmp_path):
+        args = self._args(tmp_path)
+        self._open(args)
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.time.time",
+                   return_value=10 ** 10):
+            _, info, calls = self._poll(args, [None])
+        assert calls == ["media_server"]
+        assert info["breaker"]["failures"] == 3
+        assert info["breaker"]["next_probe_in"] == pytest.approx(120.0)
+
+    def test_successful_probe_closes_and_polls(self, tmp_path):
+        args = self._args(tmp_path)
+        self._open(args)
+        media = {"XBMediaServerRealTimeStatList": {"XBMediaServerRealTimeStat": []}}
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.time.time",
+                   return_value=10 ** 10):
+            stats, info, calls = self._poll(args, [media, RESOURCE_DATA, REALTIME_DATA])
+        assert calls == ["media_server", "resource", "realtime"]
+        assert info["breaker"] == {"state": "closed", "failures": 0, "next_probe_in": 0}
+        assert "trunks" in stats and "media_stats" in stats
+
+
+# ---------------------------------------------------------------------------
+# HA cluster mode
+# ---------------------------------------------------------------------------
+
+def _realtime_with_ha_state(state):
+    data = copy.deepcopy(REALTIME_DATA)
+    system_fields = data["mysqldump"]["database"]["table"][0]["row"]["field"]
+    for field in system_fields:
+        if field["name"] == "ha_current_state":
+            field["content"] = state
+    return data
+
+
+class TestClusterMode:
+    FETCH = "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json"
+
+    def _poll(self, responses):
+        """responses maps (host, report) to the fetched data"""
+        args = make_args(cluster_peer="10.0.0.2")
+        agent_info = {}
+        with patch(self.FETCH) as mock_fetch:
+            mock_fetch.side_effect = lambda args, report, timeout=None, host=None, transfer=None: responses.get((host, report))
+            stats = poll_sansay_vsx(args, agent_info)
+        calls = [(c.kwargs["host"], c.args[1]) for c in mock_fetch.call_args_list]
+        return stats, agent_info, calls
+
+    def test_heavy_reports_only_from_active_peer(self):
+        stats, agent_info, calls = self._poll({
+            ("10.0.0.1", "realtime"): _realtime_with_ha_state("standby"),
+            ("10.0.0.2", "realtime"): _realtime_with_ha_state("active"),
+            ("10.0.0.2", "resource"): RESOURCE_DATA,
+        })
+        assert calls == [
+            ("10.0.0.1", "realtime"),
+            ("10.0.0.2", "realtime"),
+            ("10.0.0.2", "resource"),
+            ("10.0.0.2", "media_server"),
+        ]
+        assert "100" in stats["trunks"]
+        cluster = stats["system_stat"]["cluster"]
+        assert cluster["active_node"] == "10.0.0.2"
+        assert cluster["nodes"]["10.0.0.1"]["ha_current_state"] == "standby"
+        assert set(agent_info["response_times"]) == {"realtime", "realtime_peer", "resource", "media_server"}
+
+    def test_no_active_member_falls_back_to_reachable_one(self):
+        stats, _, calls = self._poll({("10.0.0.2", "realtime"): _realtime_with_ha_state("standby")})
+        assert ("10.0.0.2", "resource") in calls
+        cluster = stats["system_stat"]["cluster"]
+        assert cluster["active_node"] is None
+        assert cluster["nodes"]["10.0.0.1"]["reachable"] is False
+
+    def test_realtime_of_active_member_processed_once(self):
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.process_realtime_data",
+                   wraps=process_realtime_data) as process:
+            stats, _, _ = self._poll({
+                ("10.0.0.1", "realtime"): _realtime_with_ha_state("active"),
+                ("10.0.0.2", "realtime"): _realtime_with_ha_state("standby"),
+                ("10.0.0.1", "resource"): RESOURCE_DATA,
+            })
+        assert process.call_count == 2
+        assert stats["system_stat"]["ha_current_state"] == "active"
+
+    def test_single_node_mode_does_not_probe_peer(self):
+        args = make_args()
+        with patch(self.FETCH) as mock_fetch:
+            mock_fetch.return_value = None
+            poll_sansay_vsx(args)
+        assert [c.kwargs.get("host") for c in mock_fetch.call_args_list] == ["10.0.0.1"] * 3
+
+
+# ---------------------------------------------------------------------------
+# Degraded payloads during HA failover
+# ---------------------------------------------------------------------------
+
+def _degraded(data, *dropped):
+    """data with the named tables replaced by the error string the VSX sends"""
+    data = copy.deepcopy(data)
+    tables = data["mysqldump"]["database"]["table"]
+    data["mysqldump"]["database"]["table"] = [
+        "Max recursion depth reached" if isinstance(t, dict) and t["name"] in dropped else t for t in tables
+    ]
+    return data
+
+
+class TestDegradedPayloads:
+    FETCH = "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json"
+
+    def _poll(self, args, responses):
+        """responses maps report names to lists of successive replies"""
+        agent_info = {}
+        replies = {report: iter(values) for report, values in responses.items()}
+        with patch(self.FETCH) as mock_fetch:
+            mock_fetch.side_effect = (
+                lambda args, report, timeout=None, host=None, transfer=None: next(replies.get(report, iter(())), None)
+            )
+            stats = poll_sansay_vsx(args, agent_info)
+        return stats, agent_info, [c.args[1] for c in mock_fetch.call_args_list]
+
+    def test_missing_tables(self):
+        assert missing_tables("resource", RESOURCE_DATA) == []
+        assert missing_tables("resource", _degraded(RESOURCE_DATA, "gw_egress_stat")) == ["gw_egress_stat"]
+        assert missing_tables("resource", None) == []
+        assert missing_tables("media_server", {"anything": 1}) == []
+
+    def test_degraded_report_is_re_polled_once(self):
+        args = make_args()
+        stats, agent_info, calls = self._poll(args, {
+            "resource": [_degraded(RESOURCE_DATA, "ingress_stat"), RESOURCE_DATA],
+            "realtime": [REALTIME_DATA],
+        })
+        assert calls == ["resource", "resource", "realtime", "media_server"]
+        assert "ingress_stat" in stats["trunks"]["100"]
+        assert "degraded" not in agent_info
+
+    def test_falls_back_to_last_good_tables(self):
+        args = make_args()
+        self._poll(args, {"resource": [RESOURCE_DATA], "realtime": [REALTIME_DATA]})
+        degraded = _degraded(RESOURCE_DATA, "ingress_stat")
+        stats, agent_info, _ = self._poll(args, {"resource": [degraded, degraded], "realtime": [REALTIME_DATA]})
+        assert "ingress_stat" in stats["trunks"]["100"]
+        assert agent_info["degraded"]["resource"]["tables"] == ["ingress_stat"]
+        assert agent_info["degraded"]["resource"]["fallback_age"] == 0
+
+    def test_no_fallback_when_last_good_is_too_old(self):
+        args = make_args(degraded_max_age=0)
+        self._poll(args, {"resource": [RESOURCE_DATA], "realtime": [REALTIME_DATA]})
+        degraded = _degraded(RESOURCE_DATA, "ingress_stat")
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.time.time",
+            side_effect=lambda: 10.0 ** 10,
+        ):
+            stats, agent_info, _ = self._poll(args, {"resource": [degraded, degraded], "realtime": [REALTIME_DATA]})
+        assert "ingress_stat" not in stats["trunks"]["100"]
+        assert agent_info["degraded"]["resource"] == {"tables": ["ingress_stat"], "fallback_age": None}
+
+    def test_realtime_never_falls_back(self):
+        args = make_args()
+        self._poll(args, {"resource": [RESOURCE_DATA], "realtime": [REALTIME_DATA]})
+        assert not state_file_path(args, "last_good_realtime").exists()
+        degraded = _degraded(REALTIME_DATA, "system_stat")
+        stats, agent_info, _ = self._poll(args, {"resource": [RESOURCE_DATA], "realtime": [degraded, degraded]})
+        assert agent_info["degraded"]["realtime"] == {"tables": ["system_stat"], "fallback_age": None}
+        assert "system_stat" not in stats
+        assert "trunks" in stats
+
+    def test_last_good_saved_at_most_every_interval(self):
+        args = make_args()
+        self._poll(args, {"resource": [RESOURCE_DATA], "realtime": [REALTIME_DATA]})
+        path = state_file_path(args, "last_good_resource")
+        saved = json.loads(path.read_text(encoding="utf-8"))["time"]
+        self._poll(args, {"resource": [RESOURCE_DATA], "realtime": [REALTIME_DATA]})
+        assert json.loads(path.read_text(encoding="utf-8"))["time"] == saved
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.time.time",
+            return_value=saved + 301,
+        ):
+            self._poll(args, {"resource": [RESOURCE_DATA], "realtime": [REALTIME_DATA]})
+        assert json.loads(path.read_text(encoding="utf-8"))["time"] == saved + 301
+
+
+# ---------------------------------------------------------------------------
+# Compressed downloads
+# ---------------------------------------------------------------------------
+
+class _ReportHandler(BaseHTTPRequestHandler):
+    body = json.dumps(RESOURCE_DATA).encode("utf-8")
+
+    def do_GET(self):
+        body = self.body
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzipped:
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+@pytest.fixture
+def report_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ReportHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+class TestCompression:
+    def _args(self, port, **overrides):
+        return make_args(host="127.0.0.1", user="monitor", password="secret", proto="http", port=port,
+                         verify_ssl=False, **overrides)
+
+    def test_gzip_is_negotiated_and_decoded(self, report_server):
+        transfer = {}
+        data = fetch_sansay_json(self._args(report_server), "resource", transfer=transfer)
+        assert data == RESOURCE_DATA
+        assert transfer["encoding"] == "gzip"
+        assert transfer["bytes"] == len(_ReportHandler.body)
+        assert transfer["wire_bytes"] < transfer["bytes"]
+
+    def test_compression_can_be_disabled(self, report_server):
+        transfer = {}
+        data = fetch_sansay_json(self._args(report_server, no_compression=True), "resource", transfer=transfer)
+        assert data == RESOURCE_DATA
+        assert transfer["encoding"] == "identity"
+        assert transfer["wire_bytes"] == transfer["bytes"]
+
+
+class _LimitHandler(BaseHTTPRequestHandler):
+    """
+    trickle: 1 byte every 100ms of an announced 1000, big: 2 MiB, big_unannounced: 2 MiB without length,
+    slow_start: an empty JSON object after 1.5s without headers
+    """
+    mode = "trickle"
+
+    def do_GET(self):
+        if self.mode == "slow_start":
+            time.sleep(1.5)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        try:
+            if self.mode == "trickle":
+                self.send_header("Content-Length", "1000")
+                self.end_headers()
+                for _ in range(100):
+                    self.wfile.write(b" ")
+                    self.wfile.flush()
+                    time.sleep(0.1)
+                return
+            body = b"{}" if self.mode == "slow_start" else b" " * (2 * 1024 * 1024)
+            if self.mode in ("big", "slow_start"):
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+@pytest.fixture
+def limit_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _LimitHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+class TestDownloadLimits:
+    def _fetch(self, port, mode, **overrides):
+        args = make_args(host="127.0.0.1", user="monitor", password="secret", proto="http", port=port,
+                         verify_ssl=False, **overrides)
+        transfer = {}
+        with patch.object(_LimitHandler, "mode", mode):
+            data = fetch_sansay_json(args, "resource", transfer=transfer)
+        return data, transfer
+
+    def test_deadline_and_rate_floor_disabled_by_default(self):
+        args = parse_arguments(["--user", "monitor", "--password", "secret", "10.0.0.1"])
+        assert (args.deadline, args.min_rate) == (0, 0)
+
+    def test_deadline_interrupts_a_trickling_download(self, limit_server, caplog):
+        start = time.monotonic()
+        with caplog.at_level(logging.WARNING, logger=LOGGER.name), redirect_stdout(io.StringIO()) as output:
+            data, transfer = self._fetch(limit_server, "trickle", deadline=1)
+        assert data is None
+        assert time.monotonic() - start < 5
+        assert transfer["aborted"]["limit"] == "deadline"
+        assert "report aborted: deadline of 1s exceeded" in caplog.text
+        assert output.getvalue() == ""
+
+    def test_rate_floor(self, limit_server, caplog):
+        with patch.object(DownloadGuard, "RATE_GRACE", 0.0), caplog.at_level(logging.WARNING, logger=LOGGER.name):
+            data, transfer = self._fetch(limit_server, "big_unannounced", min_rate=10 ** 15)
+        assert data is None
+        assert transfer["aborted"]["limit"] == "min_rate"
+        assert "below" in caplog.text
+
+    def test_rate_floor_starts_with_the_response(self, limit_server):
+        # 2 bytes 1.5s after the request would be far below the floor if the wait counted
+        with patch.object(DownloadGuard, "RATE_GRACE", 0.5):
+            data, transfer = self._fetch(limit_server, "slow_start", min_rate=100)
+        assert data == {}
+        assert "aborted" not in transfer
+
+    def test_announced_body_too_large(self, limit_server):
+        data, transfer = self._fetch(limit_server, "big", max_body_size=1)
+        assert data is None
+        assert transfer["aborted"]["limit"] == "max_body_size"
+        assert transfer["bytes"] == 0
+
+    def test_streamed_body_too_large(self, limit_server):
+        data, transfer = self._fetch(limit_server, "big_unannounced", max_body_size=1)
+        assert data is None
+        assert transfer["aborted"]["reason"] == "body larger than 1 MiB"
+        assert transfer["bytes"] <= 1024 * 1024 + 65536
+
+
+# ---------------------------------------------------------------------------
+# Incremental section output
+# ---------------------------------------------------------------------------
+
+class TestIncrementalSections:
+    FETCH = "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json"
+
+    def _run(self, responses, interrupt_on=None):
+        """run the agent main, returning the output written before interrupt_on was fetched (if given)"""
+        args = make_args(delta_sections=False, exporter_port=0)
+        output = io.StringIO()
+        seen = {}
+
+        def fetch(args, report, timeout=None, host=None, transfer=None):
+            if report == interrupt_on:
+                seen["output"] = output.getvalue()
+                raise KeyboardInterrupt
+            return responses.get(report)
+
+        with patch(self.FETCH, side_effect=fetch), redirect_stdout(output):
+            try:
+                agent_sansay_vsx_main(args)
+            except KeyboardInterrupt:
+                pass
+        return seen.get("output", output.getvalue())
+
+    def _section(self, output, name):
+        lines = output.splitlines()
+        return json.loads(lines[lines.index(f"<<<{name}:sep(0)>>>") + 1])
+
+    def test_trunks_and_system_written_before_media_download(self):
+        output = self._run({"resource": RESOURCE_DATA, "realtime": REALTIME_DATA}, interrupt_on="media_server")
+        assert "100" in self._section(output, "sansay_vsx_trunks")
+        assert self._section(output, "sansay_vsx_system")["cpu_idle_percent"] == 95
+        assert "<<<sansay_vsx_media:sep(0)>>>" not in output
+        assert "<<<sansay_vsx_agent:sep(0)>>>" not in output
+
+    def test_trailer_lists_complete_sections(self):
+        output = self._run({"resource": RESOURCE_DATA, "realtime": REALTIME_DATA})
+        assert self._section(output, "sansay_vsx_agent")["sections"] == {
+            "sansay_vsx_system": True,
+            "sansay_vsx_trunks": True,
+            "sansay_vsx_media": False,
+        }
+
+    def test_trunks_without_realtime_report(self):
+        output = self._run({"resource": RESOURCE_DATA})
+        realtime = self._section(output, "sansay_vsx_trunks")["100"]["calculated_stats"]["realtime"]
+        assert realtime["origination_sessions"] == 0
+
+
+# ---------------------------------------------------------------------------
+# Sections served by the exporter
+# ---------------------------------------------------------------------------
+
+class TestExporterSections:
+    FETCH = TestIncrementalSections.FETCH
+    GET = "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.requests.get"
+
+    def _fetch(self, responses, fetched):
+        def fetch(args, report, timeout=None, host=None, transfer=None):
+            fetched.append(report)
+            return responses.get(report)
+        return fetch
+
+    def _section(self, output, name):
+        lines = output.splitlines()
+        return json.loads(lines[lines.index(f"<<<{name}:sep(0)>>>") + 1])
+
+    def test_collect_sections_renders_full_sections_and_trailer(self):
+        args = make_args(delta_sections=True, mmap_snapshot=True)
+        with patch(self.FETCH, side_effect=self._fetch({"resource": RESOURCE_DATA, "realtime": REALTIME_DATA}, [])):
+            stats, sections = collect_sections(args)
+        trunks = self._section(sections, "sansay_vsx_trunks")
+        assert trunks == json.loads(json.dumps(stats["trunks"]))
+        assert "100" in trunks
+        assert self._section(sections, "sansay_vsx_agent")["sections"] == {
+            "sansay_vsx_system": True,
+            "sansay_vsx_trunks": True,
+            "sansay_vsx_media": False,
+        }
+
+    def test_from_exporter_writes_served_sections_without_polling(self):
+        args = make_args(exporter_port=0, from_exporter="http://127.0.0.1:9464/")
+        served = "<<<sansay_vsx_agent:sep(0)>>>\n{}\n"
+        fetched = []
+        output = io.StringIO()
+        with patch(self.GET, return_value=MagicMock(text=served)) as get, \
+                patch(self.FETCH, side_effect=self._fetch({}, fetched)), redirect_stdout(output):
+            assert agent_sansay_vsx_main(args) == 0
+        get.assert_called_once()
+        assert get.call_args.args[0] == "http://127.0.0.1:9464/sections"
+        assert output.getvalue() == served
+        assert fetched == []
+
+    def test_from_exporter_falls_back_to_polling(self):
+        args = make_args(exporter_port=0, delta_sections=False, from_exporter="http://127.0.0.1:9464")
+        fetched = []
+        output = io.StringIO()
+        with patch(self.GET, side_effect=requests.exceptions.ConnectionError("refused")), \
+                patch(self.FETCH, side_effect=self._fetch({"resource": RESOURCE_DATA}, fetched)), \
+                redirect_stdout(output):
+            assert agent_sansay_vsx_main(args) == 0
+        assert "resource" in fetched
+        assert "100" in self._section(output.getvalue(), "sansay_vsx_trunks")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for the sansay_vsx_agent check plugin.
+
+Covers:
+  - discovery only when the agent sent run information
+  - response times as summary and metrics
+  - adaptive timeouts shown when present
+  - open circuit breaker is CRIT
+  - degraded reports, with and without last complete data
+  - transferred bytes with and without compression
+  - sections without data from the trailer
+  - downloads aborted by the deadline, rate or size limits
+"""
+
+import pytest
+
+from cmk.agent_based.v2 import Metric, Result, State
+
+from cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_agent_status import (
+    check_sansay_vsx_agent,
+    discovery_sansay_vsx_agent,
+)
+
+
+SECTION = {
+    "response_times": {"resource": 6.204, "realtime": 0.388, "media_server": 0.412},
+    "timeouts": {"resource": 10.0, "realtime": 3.0, "media_server": 3.0},
+}
+
+
+class TestDiscoverySansayVsxAgent:
+    def test_discovers_service(self):
+        assert len(list(discovery_sansay_vsx_agent(SECTION))) == 1
+
+    def test_no_service_for_empty_section(self):
+        assert list(discovery_sansay_vsx_agent({})) == []
+
+
+class TestCheckSansayVsxAgent:
+    def test_response_time_metrics(self):
+        results = list(check_sansay_vsx_agent(SECTION))
+        metrics = {r.name: r.value for r in results if isinstance(r, Metric)}
+        assert metrics["agent_response_time_resource"] == pytest.approx(6.204)
+        assert len(metrics) == 3
+
+    def test_timeouts_in_summary(self):
+        results = [r for r in check_sansay_vsx_agent(SECTION) if isinstance(r, Result)]
+        assert all(r.state == State.OK for r in results)
+        assert any("Adaptive timeouts" in r.summary and "resource 10.0s" in r.summary for r in results)
+
+    def test_no_timeouts_without_adaptive_mode(self):
+        section = {"response_times": SECTION["response_times"]}
+        results = [r for r in check_sansay_vsx_agent(section) if isinstance(r, Result)]
+        assert not any("Adaptive" in r.summary for r in results)
+
+    def test_open_breaker_is_crit(self):
+        section = {"breaker": {"state": "open", "failures": 4, "next_probe_in": 120.0}}
+        results = [r for r in check_sansay_vsx_agent(section) if isinstance(r, Result)]
+        assert results[0].state == State.CRIT
+        assert "4 failed runs" in results[0].summary
+
+    def test_closed_breaker_is_silent(self):
+        section = {**SECTION, "breaker": {"state": "closed", "failures": 1, "next_probe_in": 0}}
+        results = [r for r in check_sansay_vsx_agent(section) if isinstance(r, Result)]
+        assert all(r.state == State.OK for r in results)
+
+    def test_degraded_with_fallback_is_ok(self):
+        section = {**SECTION, "degraded": {"resource": {"tables": ["ingress_stat"], "fallback_age": 60}}}
+        results = [r for r in check_sansay_vsx_agent(section) if isinstance(r, Result)]
+        assert results[0].state == State.OK
+        assert results[0].summary == "Degraded resource report, using last complete data for: ingress_stat"
+
+    def test_degraded_without_fallback_is_warn(self):
+        section = {"degraded": {"realtime": {"tables": ["system_stat"], "fallback_age": None}}}
+        results = [r for r in check_sansay_vsx_agent(section) if isinstance(r, Result)]
+        assert results[0].state == State.WARN
+
+    def test_transfer_sizes(self):
+        section = {"transfer": {
+            "resource": {"encoding": "gzip", "wire_bytes": 1024 * 1024, "bytes": 10 * 1024 * 1024},
+            "realtime": {"encoding": "identity", "wire_bytes": 512, "bytes": 512},
+        }}
+        results = list(check_sansay_vsx_agent(section))
+        summaries = [r.summary for r in results if isinstance(r, Result)]
+        assert "Transferred: 1.0 MiB (10.0 MiB uncompressed)" in summaries
+        metrics = {r.name: r.value for r in results if isinstance(r, Metric)}
+        assert metrics == {"agent_transfer_bytes_resource": 1024 * 1024, "agent_transfer_bytes_realtime": 512}
+
+    def test_sections_without_data(self):
+        section = {**SECTION, "sections": {"sansay_vsx_system": True, "sansay_vsx_media": False}}
+        results = [r for r in check_sansay_vsx_agent(section) if isinstance(r, Result)]
+        assert results[0].state == State.WARN
+        assert results[0].summary == "Sections without data: sansay_vsx_media"
+
+    def test_aborted_download_is_warn(self):
+        section = {**SECTION, "transfer": {"resource": {
+            "encoding": "identity", "wire_bytes": 100, "bytes": 100,
+            "aborted": {"limit": "deadline", "reason": "deadline of 60s exceeded after 100 bytes"},
+        }}}
+        results = [r for r in check_sansay_vsx_agent(section) if isinstance(r, Result) and r.state == State.WARN]
+        assert [r.summary for r in results] == [
+            "Download of resource report aborted: deadline of 60s exceeded after 100 bytes"
+        ]
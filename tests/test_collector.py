@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Tests for the resident collector and its thin client.
+
+Covers:
+  - first request of a command line is a miss and registers a job
+  - refreshed output is served, stale output is not
+  - idle jobs are dropped, failing jobs keep their last output and back off
+  - due jobs run side by side on a bounded pool, one per VSX
+  - client falls back (None) without a running collector
+  - request/response over a real Unix socket, waiting for a pending first run
+    instead of polling next to it
+  - agent output is captured in process without touching sys.stdout, without
+    delta or snapshot sections and without debug tracing
+"""
+
+import io
+import threading
+from concurrent.futures import wait
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+import pytest
+
+from cmk_addons.plugins.sansay_vsx.special_agents.collector import (
+    MAX_BACKOFF_INTERVALS,
+    Collector,
+    _Server,
+    refresh_forever,
+    render_agent_output,
+    request_sections,
+)
+
+
+ARGV = ["--user", "monitor", "--password", "secret", "10.0.0.1"]
+
+
+def _collector(render=None, workers=4):
+    return Collector(render or (lambda argv: f"<<<sansay_vsx_system:sep(0)>>>\n{argv[-1]}\n"), 60.0, 600.0,
+                     workers)
+
+
+def _refresh(collector, now):
+    """run the jobs due at now and wait for them"""
+    wait(collector.refresh_due(now))
+
+
+# ---------------------------------------------------------------------------
+# Job handling
+# ---------------------------------------------------------------------------
+
+class TestCollector:
+    def test_first_request_is_a_miss(self):
+        collector = _collector()
+        assert collector.lookup(ARGV, 1000.0) is None
+        assert tuple(ARGV) in collector.jobs
+
+    def test_refreshed_output_is_served(self):
+        collector = _collector()
+        collector.lookup(ARGV, 1000.0)
+        _refresh(collector, 1000.0)
+        assert collector.lookup(ARGV, collector.jobs[tuple(ARGV)].refreshed_at + 1).endswith("10.0.0.1\n")
+
+    def test_stale_output_is_not_served(self):
+        collector = _collector()
+        collector.lookup(ARGV, 1000.0)
+        _refresh(collector, 1000.0)
+        assert collector.lookup(ARGV, collector.jobs[tuple(ARGV)].refreshed_at + 121) is None
+
+    def test_idle_jobs_are_dropped(self):
+        collector = _collector()
+        collector.lookup(ARGV, 1000.0)
+        collector.refresh_due(1000.0 + 601)
+        assert collector.jobs == {}
+
+    def test_failing_job_keeps_last_output(self):
+        outputs = iter(["first\n"])
+
+        def render(argv):
+            return next(outputs)
+
+        collector = _collector(render)
+        collector.lookup(ARGV, 1000.0)
+        _refresh(collector, 1000.0)
+        job = collector.jobs[tuple(ARGV)]
+        job.refreshed_at = 0.0
+        _refresh(collector, 1000.0)  # StopIteration in render
+        assert job.output == "first\n"
+
+    def test_failing_job_backs_off(self):
+        def render(argv):
+            raise RuntimeError("VSX unreachable")
+
+        collector = _collector(render)
+        collector.lookup(ARGV, 1000.0)
+        job = collector.jobs[tuple(ARGV)]
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.collector.time.time", return_value=1000.0):
+            for failures in range(1, 7):
+                _refresh(collector, max(1000.0, job.retry_at))
+                assert job.failures == failures
+                assert job.retry_at == 1000.0 + 60.0 * min(2 ** (failures - 1), MAX_BACKOFF_INTERVALS)
+                assert collector.refresh_due(job.retry_at - 1) == []
+
+    def test_backoff_resets_after_success(self):
+        outputs = iter([RuntimeError("VSX unreachable"), "ok\n"])
+
+        def render(argv):
+            output = next(outputs)
+            if isinstance(output, Exception):
+                raise output
+            return output
+
+        collector = _collector(render)
+        collector.lookup(ARGV, 1000.0)
+        job = collector.jobs[tuple(ARGV)]
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.collector.time.time", return_value=1000.0):
+            _refresh(collector, 1000.0)
+            _refresh(collector, job.retry_at)
+        assert job.output == "ok\n"
+        assert (job.failures, job.retry_at) == (0, 0.0)
+
+    def test_due_jobs_run_side_by_side_on_bounded_pool(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+        release = threading.Event()
+
+        def render(argv):
+            with lock:
+                running.append(argv)
+                peak.append(len(running))
+            release.wait(5)
+            with lock:
+                running.remove(argv)
+            return "ok\n"
+
+        collector = _collector(render, workers=2)
+        for host in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+            collector.lookup([host], 1000.0)
+        futures = collector.refresh_due(1000.0)
+        # a job still running is not queued a second time
+        assert collector.refresh_due(1000.0 + 61) == []
+        release.set()
+        wait(futures)
+        assert max(peak) == 2
+        assert all(job.output == "ok\n" for job in collector.jobs.values())
+
+    def test_one_running_job_per_device(self):
+        release = threading.Event()
+        collector = _collector(lambda argv: release.wait(5) and "ok\n")
+        collector.lookup(["--delta-sections", "10.0.0.1"], 1000.0)
+        collector.lookup(["--mmap-snapshot", "10.0.0.1"], 1000.0)
+        first = collector.refresh_due(1000.0)
+        assert len(first) == 1
+        assert collector.refresh_due(1000.0) == []
+        release.set()
+        wait(first)
+        wait(collector.refresh_due(1000.0))
+        assert all(job.output == "ok\n" for job in collector.jobs.values())
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class TestClient:
+    def test_no_collector_running(self, tmp_path):
+        assert request_sections(ARGV, path=tmp_path / "missing.sock") is None
+
+    def _serve(self, tmp_path, collector, run_wait_timeout=5.0):
+        """serve collector on a socket with its jobs refreshed in the background, yielding the socket path"""
+        path = tmp_path / "collector.sock"
+        server = _Server(path, collector, run_wait_timeout)
+        stop = threading.Event()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        threading.Thread(target=refresh_forever, args=(collector, stop), daemon=True).start()
+        return path, server, stop
+
+    def _stop(self, server, stop):
+        stop.set()
+        server.shutdown()
+        server.server_close()
+
+    def test_first_request_waits_for_first_run(self, tmp_path):
+        path, server, stop = self._serve(tmp_path, _collector())
+        try:
+            assert request_sections(ARGV, path=path) == "<<<sansay_vsx_system:sep(0)>>>\n10.0.0.1\n"
+            assert request_sections(ARGV, path=path) == "<<<sansay_vsx_system:sep(0)>>>\n10.0.0.1\n"
+        finally:
+            self._stop(server, stop)
+
+    def test_failed_first_run_is_a_miss(self, tmp_path):
+        def render(argv):
+            raise RuntimeError("VSX unreachable")
+
+        path, server, stop = self._serve(tmp_path, _collector(render))
+        try:
+            assert request_sections(ARGV, path=path) is None
+        finally:
+            self._stop(server, stop)
+
+    def test_slow_run_returns_no_data(self, tmp_path):
+        release = threading.Event()
+        path, server, stop = self._serve(tmp_path, _collector(lambda argv: release.wait(5) and "ok\n"), 0.2)
+        try:
+            # empty, not None: the client must not poll the VSX next to the running job
+            assert request_sections(ARGV, path=path) == ""
+        finally:
+            release.set()
+            self._stop(server, stop)
+
+
+class TestRenderAgentOutput:
+    @pytest.fixture(autouse=True)
+    def _threaded_flag(self):
+        """render_agent_output marks the process as threaded, keep that out of the other tests"""
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx._THREADED_PROCESS", False):
+            yield
+
+    def test_marks_process_threaded(self):
+        from cmk_addons.plugins.sansay_vsx.special_agents import agent_sansay_vsx
+
+        with patch.object(agent_sansay_vsx, "agent_sansay_vsx_main", return_value=0):
+            render_agent_output(ARGV)
+        assert agent_sansay_vsx._THREADED_PROCESS is True
+
+    def test_captures_sections(self, tmp_path):
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json",
+            return_value=None,
+        ):
+            stdout = io.StringIO()
+            with redirect_stdout(stdout):
+                output = render_agent_output(["--user", "monitor", "--password", "secret",
+                                              "--state-dir", str(tmp_path), "10.0.0.1"])
+        assert "<<<" not in stdout.getvalue()
+        assert "<<<sansay_vsx_system:sep(0)>>>" in output
+        assert "<<<sansay_vsx_agent:sep(0)>>>" in output
+
+    def test_incremental_sections_and_tracing_disabled(self):
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.agent_sansay_vsx_main",
+            return_value=0,
+        ) as agent_main:
+            render_agent_output(["--user", "monitor", "--password", "secret", "--debug",
+                                 "--delta-sections", "--mmap-snapshot", "10.0.0.1"])
+        args = agent_main.call_args.args[0]
+        assert (args.delta_sections, args.mmap_snapshot, args.debug) == (False, False, False)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Tests for the OpenMetrics exporter mode of the special agent.
+
+Covers:
+  - exposition of system, trunk and media stats with labels
+  - large counters and epoch timestamps served with every digit
+  - snapshot age and poll bookkeeping
+  - the last good snapshot is kept when a poll fails
+  - /metrics over HTTP
+  - /sections serving the agent sections of the last good poll, 503 when stale
+"""
+
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+import pytest
+
+from cmk_addons.plugins.sansay_vsx.special_agents.exporter import (
+    CONTENT_TYPE,
+    SECTIONS_CONTENT_TYPE,
+    Snapshot,
+    make_handler,
+    poll_forever,
+    render_openmetrics,
+)
+
+
+STATS = {
+    "system_stat": {"cpu_idle_percent": 95, "sum_attempt_session": 27412, "ha_current_state": "active"},
+    "trunks": {
+        "100": {
+            "alias": 'Carrier "In"',
+            "calculated_stats": {"ingress": {"answer_seize_ratio": 90.0}},
+            "counters": {"ingress": {"call_attempt": 10}},
+        },
+    },
+    "media_stats": [
+        {"mediaSrvIndex": 1, "alias": "MST3", "switchType": "Internal", "numActiveSessions": 4, "status": "up"},
+    ],
+}
+
+
+SECTIONS = '<<<sansay_vsx_agent:sep(0)>>>\n{"sections": {}}\n'
+
+
+def _snapshot(stats=STATS, collected_at=1000.0, sections=SECTIONS):
+    snapshot = Snapshot()
+    snapshot.update(stats, collected_at, 0.5, sections)
+    return snapshot
+
+
+def _serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ---------------------------------------------------------------------------
+# Exposition
+# ---------------------------------------------------------------------------
+
+class TestRenderOpenMetrics:
+    def _lines(self, snapshot=None, now=1030.0):
+        return render_openmetrics("10.0.0.1", snapshot or _snapshot(), now).splitlines()
+
+    def test_ends_with_eof(self):
+        assert self._lines()[-1] == "# EOF"
+
+    def test_snapshot_age(self):
+        assert 'sansay_vsx_snapshot_age_seconds{host="10.0.0.1"} 30' in self._lines()
+
+    def test_system_gauges_and_counters(self):
+        lines = self._lines()
+        assert "# TYPE sansay_vsx_system_cpu_idle_percent gauge" in lines
+        assert "# TYPE sansay_vsx_system_sum_attempt_session counter" in lines
+        assert 'sansay_vsx_system_sum_attempt_session_total{host="10.0.0.1"} 27412' in lines
+        # non numeric values are not exported
+        assert not any("ha_current_state" in line for line in lines)
+
+    def test_large_values_keep_every_digit(self):
+        stats = {"system_stat": {"sum_attempt_session": 27412345, "cpu_idle_percent": 95.125}}
+        lines = self._lines(_snapshot(stats, collected_at=1792381234.567), now=1792381264.567)
+        assert 'sansay_vsx_system_sum_attempt_session_total{host="10.0.0.1"} 27412345' in lines
+        assert 'sansay_vsx_snapshot_timestamp_seconds{host="10.0.0.1"} 1792381234.567' in lines
+        assert 'sansay_vsx_system_cpu_idle_percent{host="10.0.0.1"} 95.125' in lines
+        assert 'sansay_vsx_snapshot_age_seconds{host="10.0.0.1"} 30' in lines
+
+    def test_trunk_labels_are_escaped(self):
+        assert (
+            'sansay_vsx_trunk_ingress_answer_seize_ratio{host="10.0.0.1",trunk_id="100",alias="Carrier \\"In\\""} 90'
+            in self._lines()
+        )
+
+    def test_trunk_counters(self):
+        assert any(line.startswith("sansay_vsx_trunk_ingress_call_attempt_15m{") and line.endswith(" 10")
+                   for line in self._lines())
+
+    def test_media_servers(self):
+        lines = self._lines()
+        labels = '{host="10.0.0.1",media_index="1",alias="MST3",switch_type="Internal"}'
+        assert f"sansay_vsx_media_up{labels} 1" in lines
+        assert f"sansay_vsx_media_num_active_sessions{labels} 4" in lines
+
+    def test_each_family_has_one_type_line(self):
+        type_lines = [line for line in self._lines() if line.startswith("# TYPE")]
+        assert len(type_lines) == len(set(type_lines))
+
+    def test_failed_poll_keeps_last_snapshot(self):
+        snapshot = _snapshot()
+        snapshot.update({"media_stats": None, "trunks": None, "system_stat": None}, 1060.0, 3.0)
+        lines = self._lines(snapshot, now=1090.0)
+        assert 'sansay_vsx_up{host="10.0.0.1"} 0' in lines
+        assert 'sansay_vsx_poll_failures_total{host="10.0.0.1"} 1' in lines
+        assert 'sansay_vsx_snapshot_age_seconds{host="10.0.0.1"} 90' in lines
+
+    def test_no_snapshot_yet(self):
+        lines = self._lines(Snapshot())
+        assert 'sansay_vsx_up{host="10.0.0.1"} 0' in lines
+        assert not any(line.startswith("sansay_vsx_snapshot_age_seconds") for line in lines)
+
+
+# ---------------------------------------------------------------------------
+# Polling and serving
+# ---------------------------------------------------------------------------
+
+class TestExporterLoop:
+    def test_poll_survives_exceptions(self):
+        stop = threading.Event()
+        args = MagicMock(host="10.0.0.1", exporter_interval=0)
+        calls = []
+
+        def collect(_args):
+            calls.append(1)
+            if len(calls) == 2:
+                stop.set()
+            raise RuntimeError("boom")
+
+        snapshot = Snapshot()
+        poll_forever(args, collect, snapshot, stop)
+        assert snapshot.polls == 2
+        assert snapshot.failures == 2
+
+    def test_poll_keeps_sections_of_last_good_poll(self):
+        stop = threading.Event()
+        args = MagicMock(host="10.0.0.1", exporter_interval=0)
+        results = [(STATS, SECTIONS), ({}, "<<<sansay_vsx_agent:sep(0)>>>\n{}\n")]
+
+        def collect(_args):
+            if len(results) == 1:
+                stop.set()
+            return results.pop(0)
+
+        snapshot = Snapshot()
+        poll_forever(args, collect, snapshot, stop)
+        assert snapshot.failures == 1
+        assert snapshot.read_sections()[0] == SECTIONS
+
+    def test_metrics_endpoint(self):
+        server, url = _serve(make_handler("10.0.0.1", _snapshot()))
+        try:
+            with urllib.request.urlopen(f"{url}/metrics", timeout=5) as response:
+                assert response.headers["Content-Type"] == CONTENT_TYPE
+                assert response.read().decode().endswith("# EOF\n")
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{url}/other", timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_sections_endpoint(self):
+        server, url = _serve(make_handler("10.0.0.1", _snapshot(collected_at=time.time()), max_age=120))
+        try:
+            with urllib.request.urlopen(f"{url}/sections", timeout=5) as response:
+                assert response.headers["Content-Type"] == SECTIONS_CONTENT_TYPE
+                assert response.read().decode() == SECTIONS
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @pytest.mark.parametrize("snapshot", [Snapshot(), _snapshot(collected_at=1000.0)])
+    def test_sections_unavailable_when_missing_or_stale(self, snapshot):
+        server, url = _serve(make_handler("10.0.0.1", snapshot, max_age=120))
+        try:
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(f"{url}/sections", timeout=5)
+            assert error.value.code == 503
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite trunk KPI store.
+
+Covers:
+  - raw rows and trunk aliases written in one run
+  - downsampling to 15 minute (last poll) and hourly (sum) rows
+  - retention pruning per tier
+  - top-N queries weighted by call attempts
+  - the query command line
+  - the agent hook never failing the run
+"""
+
+import sqlite3
+
+from cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx import record_kpis
+from cmk_addons.plugins.sansay_vsx.special_agents.kpi_store import (
+    RETENTION,
+    downsample,
+    main,
+    open_store,
+    prune,
+    record_trunks,
+    store_trunk_kpis,
+    top_trunks,
+)
+from tests.test_agent import make_args
+
+
+HOUR = 1_700_000_000 // 3600 * 3600
+
+
+def _trunk(alias, attempts, answers, fails=0, duration=0, pdd_ms=0):
+    counters = {
+        "call_attempt": attempts,
+        "call_answer": answers,
+        "call_fail": fails,
+        "call_duration": duration,
+        "pdd_ms": pdd_ms,
+    }
+    return {"alias": alias, "counters": {"ingress": dict(counters), "egress": dict(counters)}}
+
+
+def _rows(conn, tier):
+    return conn.execute(
+        f"SELECT trunk_id, ts, direction, call_attempt, call_answer FROM kpi_{tier} ORDER BY trunk_id, ts, direction"
+    ).fetchall()
+
+
+# ---------------------------------------------------------------------------
+# Recording and downsampling
+# ---------------------------------------------------------------------------
+
+class TestStore:
+    def test_raw_rows_and_aliases(self, tmp_path):
+        path = tmp_path / "kpi" / "kpi.sqlite"
+        assert store_trunk_kpis(path, "vsx1", {"100": _trunk("Carrier A", 10, 9)}, HOUR + 60) == 2
+        conn = sqlite3.connect(path)
+        assert _rows(conn, "raw") == [("100", HOUR + 60, "egress", 10, 9), ("100", HOUR + 60, "ingress", 10, 9)]
+        assert conn.execute("SELECT host, trunk_id, alias FROM trunk").fetchall() == [("vsx1", "100", "Carrier A")]
+
+    def test_15m_keeps_last_poll_of_window(self, tmp_path):
+        conn = open_store(tmp_path / "kpi.sqlite")
+        record_trunks(conn, "vsx1", {"100": _trunk("A", 10, 9)}, HOUR + 60)
+        record_trunks(conn, "vsx1", {"100": _trunk("A", 20, 15)}, HOUR + 840)
+        downsample(conn, "vsx1", HOUR + 900)
+        assert _rows(conn, "15m") == [("100", HOUR, "egress", 20, 15), ("100", HOUR, "ingress", 20, 15)]
+
+    def test_open_window_is_not_rolled_up(self, tmp_path):
+        conn = open_store(tmp_path / "kpi.sqlite")
+        record_trunks(conn, "vsx1", {"100": _trunk("A", 10, 9)}, HOUR + 60)
+        downsample(conn, "vsx1", HOUR + 120)
+        assert _rows(conn, "15m") == []
+
+    def test_1h_sums_the_windows(self, tmp_path):
+        conn = open_store(tmp_path / "kpi.sqlite")
+        for window in range(4):
+            record_trunks(conn, "vsx1", {"100": _trunk("A", 10, 5 + window)}, HOUR + window * 900 + 60)
+            downsample(conn, "vsx1", HOUR + window * 900 + 120)
+        downsample(conn, "vsx1", HOUR + 3600)
+        assert _rows(conn, "1h") == [("100", HOUR, "egress", 40, 26), ("100", HOUR, "ingress", 40, 26)]
+
+    def test_prune_by_tier(self, tmp_path):
+        conn = open_store(tmp_path / "kpi.sqlite")
+        now = HOUR + 10 * 86400
+        record_trunks(conn, "vsx1", {"100": _trunk("A", 10, 9)}, HOUR)
+        downsample(conn, "vsx1", HOUR + 3600)
+        prune(conn, now)
+        assert now - HOUR > RETENTION["raw"]
+        assert _rows(conn, "raw") == []
+        assert len(_rows(conn, "15m")) == 2
+        assert len(_rows(conn, "1h")) == 2
+
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+
+def _filled_store(path):
+    conn = open_store(path)
+    trunks = {
+        "100": _trunk("Good", 100, 90, fails=5, duration=6000, pdd_ms=200000),
+        "200": _trunk("Bad", 50, 10, fails=40, duration=500, pdd_ms=400000),
+        "300": _trunk("Idle", 2, 0),
+    }
+    with conn:
+        record_trunks(conn, "vsx1", trunks, HOUR + 60)
+        downsample(conn, "vsx1", HOUR + 900)
+    return conn
+
+
+class TestTopTrunks:
+    def test_worst_asr_first(self, tmp_path):
+        conn = _filled_store(tmp_path / "kpi.sqlite")
+        rows = top_trunks(conn, "asr", HOUR, HOUR + 900, direction="ingress", min_attempts=10)
+        assert [(row[1], row[2], row[4]) for row in rows] == [("200", "Bad", 20.0), ("100", "Good", 90.0)]
+
+    def test_worst_fcr_first(self, tmp_path):
+        conn = _filled_store(tmp_path / "kpi.sqlite")
+        rows = top_trunks(conn, "fcr", HOUR, HOUR + 900, direction="egress", min_attempts=10, limit=1)
+        assert [(row[1], row[4], row[5]) for row in rows] == [("200", 80.0, 50)]
+
+    def test_weighted_across_windows(self, tmp_path):
+        conn = open_store(tmp_path / "kpi.sqlite")
+        record_trunks(conn, "vsx1", {"100": _trunk("A", 10, 10)}, HOUR + 60)
+        record_trunks(conn, "vsx1", {"100": _trunk("A", 90, 0)}, HOUR + 960)
+        downsample(conn, "vsx1", HOUR + 1800)
+        rows = top_trunks(conn, "asr", HOUR, HOUR + 1800, direction="ingress")
+        assert rows[0][4] == 10.0
+
+    def test_host_filter(self, tmp_path):
+        conn = _filled_store(tmp_path / "kpi.sqlite")
+        assert top_trunks(conn, "asr", HOUR, HOUR + 900, host="vsx2") == []
+
+
+class TestQueryCommand:
+    def test_prints_ranking(self, tmp_path, capsys, monkeypatch):
+        path = tmp_path / "kpi.sqlite"
+        _filled_store(path).close()
+        monkeypatch.setattr("time.time", lambda: HOUR + 1000)
+        assert main(["--db", str(path), "--since", "1h", "--direction", "ingress", "--tier", "15m"]) == 0
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == "host\ttrunk_id\talias\tdirection\tasr\tattempts"
+        assert lines[1:] == ["vsx1\t200\tBad\tingress\t20.0\t50", "vsx1\t100\tGood\tingress\t90.0\t100"]
+
+    def test_missing_database(self, tmp_path):
+        assert main(["--db", str(tmp_path / "missing.sqlite")]) == 1
+
+
+# ---------------------------------------------------------------------------
+# Agent hook
+# ---------------------------------------------------------------------------
+
+class TestRecordKpis:
+    def test_writes_database(self, tmp_path):
+        path = tmp_path / "kpi.sqlite"
+        record_kpis(make_args(kpi_db=str(path)), {"100": _trunk("A", 10, 9)})
+        assert len(_rows(sqlite3.connect(path), "raw")) == 2
+
+    def test_disabled_by_default(self, tmp_path):
+        record_kpis(make_args(), {"100": _trunk("A", 10, 9)})
+        assert list(tmp_path.iterdir()) == []
+
+    def test_broken_database_is_logged(self, tmp_path, caplog):
+        path = tmp_path / "kpi.sqlite"
+        path.write_text("not a database")
+        record_kpis(make_args(kpi_db=str(path)), {"100": _trunk("A", 10, 9)})
+        assert "unable to record trunk KPIs" in caplog.text
@@ -1,10 +1,21 @@
 #!/usr/bin/env python3
-"""Tests for the shared parse_sansay_vsx parser in lib.py."""
+"""Tests for the shared parsers, levels and trunk snapshots in lib.py."""
 
 import json
 import pytest
 
-from cmk_addons.plugins.sansay_vsx.lib import parse_sansay_vsx
+from cmk_addons.plugins.sansay_vsx.lib import (
+    TRUNK_DELTA_KEY,
+    TRUNK_SNAPSHOT_KEY,
+    TrunkSnapshot,
+    check_levels_state,
+    compile_levels,
+    parse_sansay_vsx,
+    parse_sansay_vsx_trunks,
+    save_state_file,
+    trunk_view_at,
+    write_trunk_snapshot,
+)
 
 
 def test_parse_valid_dict():
@@ -37,3 +48,147 @@ def test_parse_preserves_numeric_types():
     result = parse_sansay_vsx(string_table)
     assert result["cpu_idle_percent"] == 98
     assert result["float_val"] == pytest.approx(3.14)
+
+
+def _delta(generation, base, members, changed, snapshot):
+    return [[json.dumps({TRUNK_DELTA_KEY: {
+        "generation": generation,
+        "base": base,
+        "snapshot": str(snapshot),
+        "members": members,
+        "changed": changed,
+    }})]]
+
+
+def test_parse_trunks_plain_section_unchanged():
+    data = {"100": {"alias": "Carrier In"}}
+    assert parse_sansay_vsx_trunks([[json.dumps(data)]]) == data
+
+
+def test_parse_trunks_delta_applies_on_cached_view(tmp_path):
+    snapshot = tmp_path / "trunks_a.json"
+    full = {"100": {"alias": "A", "v": 1}, "200": {"alias": "B", "v": 1}}
+    assert parse_sansay_vsx_trunks(_delta(1, None, ["100", "200"], full, snapshot)) == full
+
+    changed = {"200": {"alias": "B", "v": 2}}
+    result = parse_sansay_vsx_trunks(_delta(2, 1, ["100", "200"], changed, snapshot))
+    assert result == {"100": {"alias": "A", "v": 1}, "200": {"alias": "B", "v": 2}}
+    # Parsing the same section again (another check helper call) is idempotent.
+    assert parse_sansay_vsx_trunks(_delta(2, 1, ["100", "200"], changed, snapshot)) == result
+
+
+def test_parse_trunks_delta_drops_removed_members(tmp_path):
+    snapshot = tmp_path / "trunks_b.json"
+    full = {"100": {"v": 1}, "200": {"v": 1}}
+    parse_sansay_vsx_trunks(_delta(1, None, ["100", "200"], full, snapshot))
+    assert parse_sansay_vsx_trunks(_delta(2, 1, ["100"], {}, snapshot)) == {"100": {"v": 1}}
+
+
+def test_parse_trunks_delta_falls_back_to_snapshot_file(tmp_path):
+    snapshot = tmp_path / "trunks_c.json"
+    trunks = {"100": {"v": 7}, "200": {"v": 3}}
+    save_state_file(snapshot, {"generation": 9, "cycle": 9, "trunks": trunks})
+    assert parse_sansay_vsx_trunks(_delta(9, 8, ["100", "200"], {"100": {"v": 7}}, snapshot)) == trunks
+
+
+def test_parse_trunks_delta_without_base_is_empty_not_partial(tmp_path):
+    snapshot = tmp_path / "trunks_d.json"
+    assert parse_sansay_vsx_trunks(_delta(5, 4, ["100", "200"], {"100": {"v": 7}}, snapshot)) == {}
+    full = {"100": {"v": 8}, "200": {"v": 1}}
+    assert parse_sansay_vsx_trunks(_delta(6, None, ["100", "200"], full, snapshot)) == full
+
+
+def test_parse_trunks_older_delta_from_state_undo(tmp_path):
+    snapshot = tmp_path / "trunks_e.json"
+    save_state_file(snapshot, {
+        "generation": 3,
+        "cycle": 3,
+        "trunks": {"100": {"v": 3}, "300": {"v": 1}},
+        "undo": [
+            {"generation": 2, "members": ["100", "200"], "previous": {"100": {"v": 1}}},
+            {"generation": 3, "members": ["100", "200"], "previous": {"100": {"v": 2}, "200": {"v": 1}}},
+        ],
+    })
+    assert parse_sansay_vsx_trunks(_delta(2, 1, ["100", "200"], {"100": {"v": 2}}, snapshot)) == {
+        "100": {"v": 2}, "200": {"v": 1},
+    }
+    assert parse_sansay_vsx_trunks(_delta(1, 0, ["100", "200"], {}, snapshot)) == {"100": {"v": 1}, "200": {"v": 1}}
+    # without an undo step the state does not go back any further
+    assert trunk_view_at({"generation": 3, "trunks": {}, "undo": []}, 2) is None
+
+
+def _snapshot_trunk(alias, attempts):
+    ratios = {"avg_postdial_delay": 1.5, "avg_call_duration": 60.0, "failed_call_ratio": 10.0, "answer_seize_ratio": 90.0}
+    counters = {"call_attempt": attempts, "call_fail": 1, "call_answer": 9, "call_duration": 600, "pdd_ms": 15000}
+    realtime = {
+        "origination_sessions": 3, "origination_utilization": 3.0, "termination_sessions": 5,
+        "termination_utilization": 5.0, "cps": 1, "cps_utilization": 10.0, "peak_sessions": 8,
+        "peak_utilization": 8.0, "call_limit_exceeded": 0, "cps_limit_exceeded": 0,
+    }
+    return {
+        "alias": alias,
+        "recid": "7",
+        "calculated_stats": {"ingress": dict(ratios), "egress": dict(ratios), "realtime": realtime},
+        "counters": {"ingress": dict(counters), "egress": dict(counters)},
+    }
+
+
+SNAPSHOT_TRUNKS = {"2000": _snapshot_trunk("Customer Out", 4), "100": _snapshot_trunk("Carrier \u00e9", 10)}
+
+
+def _snapshot_section(generation, snapshot, json_path=""):
+    return [[json.dumps({TRUNK_SNAPSHOT_KEY: {
+        "generation": generation,
+        "snapshot": str(snapshot),
+        "json": str(json_path),
+    }})]]
+
+
+def test_snapshot_lookup(tmp_path):
+    path = tmp_path / "trunks_a.snap"
+    assert write_trunk_snapshot(path, 3, SNAPSHOT_TRUNKS)
+    snapshot = TrunkSnapshot(path)
+    assert snapshot.generation == 3
+    assert len(snapshot) == 2
+    assert sorted(snapshot) == ["100", "2000"]
+    assert snapshot["100"] == SNAPSHOT_TRUNKS["100"]
+    assert snapshot["2000"]["counters"]["ingress"]["call_attempt"] == 4
+    assert "300" not in snapshot
+    with pytest.raises(KeyError):
+        snapshot["10"]  # pylint: disable=pointless-statement
+
+
+def test_snapshot_rejects_other_layouts(tmp_path):
+    path = tmp_path / "trunks_b.snap"
+    assert not write_trunk_snapshot(path, 1, {"100": {"alias": "A", "recid": 1}})
+    assert not path.exists()
+
+
+def test_parse_trunks_snapshot_section(tmp_path):
+    path = tmp_path / "trunks_c.snap"
+    write_trunk_snapshot(path, 5, SNAPSHOT_TRUNKS)
+    assert dict(parse_sansay_vsx_trunks(_snapshot_section(5, path))) == SNAPSHOT_TRUNKS
+
+
+def test_parse_trunks_snapshot_generation_mismatch_uses_json(tmp_path):
+    path = tmp_path / "trunks_d.snap"
+    json_path = tmp_path / "trunks_d.json"
+    write_trunk_snapshot(path, 6, SNAPSHOT_TRUNKS)
+    save_state_file(json_path, {"generation": 5, "trunks": {"100": {"v": 1}}})
+    assert parse_sansay_vsx_trunks(_snapshot_section(5, path, json_path)) == {"100": {"v": 1}}
+    assert parse_sansay_vsx_trunks(_snapshot_section(4, path, json_path)) == {}
+
+
+def test_compile_levels_no_levels_is_none():
+    assert compile_levels(("no_levels", None)) is None
+    assert compile_levels(None) is None
+
+
+@pytest.mark.parametrize("value, expected", [(4.9, 0), (5.0, 1), (14.9, 1), (15.0, 2)])
+def test_upper_levels(value, expected):
+    assert check_levels_state(value, ("fixed", (5.0, 15.0))) == expected
+
+
+@pytest.mark.parametrize("value, expected", [(70.1, 0), (70.0, 1), (50.1, 1), (50.0, 2)])
+def test_lower_levels(value, expected):
+    assert compile_levels(("fixed", (70.0, 50.0)), "lower").state(value) == expected
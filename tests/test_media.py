@@ -4,6 +4,7 @@ Tests for the sansay_vsx_media check plugin.
 
 Covers:
   - discovery yields one service per media server alias
+  - discovery include/exclude by switchType
   - empty section yields UNKNOWN
   - media server not found in section yields UNKNOWN
   - duplicate alias yields UNKNOWN
@@ -64,17 +65,27 @@ SECTION = [
 
 class TestDiscoverySansayVsxMedia:
     def test_discovers_all_media_servers(self):
-        services = list(discovery_sansay_vsx_media(SECTION))
+        services = list(discovery_sansay_vsx_media(params={}, section=SECTION))
         assert len(services) == 3
 
     def test_service_items_are_aliases(self):
-        items = {s.item for s in discovery_sansay_vsx_media(SECTION)}
+        items = {s.item for s in discovery_sansay_vsx_media(params={}, section=SECTION)}
         assert "Internal Media Switching" in items
         assert "MST3 HA Pair" in items
         assert "MLT transcoder" in items
 
     def test_empty_section_yields_no_services(self):
-        assert list(discovery_sansay_vsx_media([])) == []
+        assert list(discovery_sansay_vsx_media(params={}, section=[])) == []
+
+    def test_include_switch_type(self):
+        params = {"include_switch_type": "^External"}
+        items = [s.item for s in discovery_sansay_vsx_media(params=params, section=SECTION)]
+        assert items == ["MST3 HA Pair"]
+
+    def test_exclude_switch_type(self):
+        params = {"exclude_switch_type": "Internal"}
+        items = {s.item for s in discovery_sansay_vsx_media(params=params, section=SECTION)}
+        assert items == {"MST3 HA Pair", "MLT transcoder"}
 
 
 # ---------------------------------------------------------------------------
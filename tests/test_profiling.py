@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for the --profile and --trace-malloc hooks of the special agent.
+
+Covers:
+  - pstats file and allocation report written to the chosen directories
+  - one-line summaries on stderr, the agent's stdout left untouched
+  - the return value and exceptions of the agent pass through
+  - an unwritable directory does not fail the run
+"""
+
+import io
+import pstats
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+
+import pytest
+
+from cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx import agent_sansay_vsx_main
+from cmk_addons.plugins.sansay_vsx.special_agents.profiling import run_profiled
+from tests.test_agent import REALTIME_DATA, RESOURCE_DATA, make_args
+
+
+def _work(args):
+    print("<<<sansay_vsx_system:sep(0)>>>")
+    print(len([bytearray(1024) for _ in range(100)]))
+    return 0
+
+
+def _run(args, run=_work):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        result = run_profiled(args, run)
+    return result, stdout.getvalue(), stderr.getvalue()
+
+
+class TestRunProfiled:
+    def test_profile_written(self, tmp_path):
+        result, stdout, stderr = _run(make_args(profile=str(tmp_path / "profiles"), trace_malloc=None))
+        assert result == 0
+        assert stdout == "<<<sansay_vsx_system:sep(0)>>>\n100\n"
+        [path] = (tmp_path / "profiles").glob("profile_10.0.0.1_*.pstats")
+        assert pstats.Stats(str(path)).total_calls > 0
+        assert stderr.startswith("[10.0.0.1] -> profile: ")
+        assert stderr.strip().endswith(str(path))
+
+    def test_allocation_report_written(self, tmp_path):
+        result, stdout, stderr = _run(make_args(profile=None, trace_malloc=str(tmp_path), trace_malloc_top=5))
+        assert result == 0
+        assert stdout == "<<<sansay_vsx_system:sep(0)>>>\n100\n"
+        [path] = tmp_path.glob("malloc_10.0.0.1_*.txt")
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert lines[0].startswith("current ")
+        assert 0 < len(lines[2:]) <= 5
+        assert "trace-malloc: peak" in stderr
+
+    def test_both_summaries(self, tmp_path):
+        _, _, stderr = _run(make_args(profile=str(tmp_path), trace_malloc=str(tmp_path), trace_malloc_top=5))
+        assert len(stderr.splitlines()) == 2
+
+    def test_exception_passes_through(self, tmp_path):
+        def fail(args):
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError), redirect_stderr(io.StringIO()):
+            run_profiled(make_args(profile=str(tmp_path), trace_malloc=None), fail)
+        assert list(tmp_path.glob("profile_*.pstats"))
+
+    def test_unwritable_directory(self, tmp_path):
+        blocker = tmp_path / "file"
+        blocker.write_text("")
+        result, _, stderr = _run(make_args(profile=str(blocker / "sub"), trace_malloc=None))
+        assert result == 0
+        assert "ERROR: unable to write profile" in stderr
+
+
+class TestAgentMainProfiled:
+    def test_sections_unchanged(self, tmp_path):
+        def fetch(args, report, timeout=None, host=None, transfer=None):
+            return {"resource": RESOURCE_DATA, "realtime": REALTIME_DATA}.get(report)
+
+        outputs = []
+        for profile in (None, str(tmp_path)):
+            args = make_args(delta_sections=False, exporter_port=0, state_dir=str(tmp_path / "state"),
+                             profile=profile, trace_malloc=None)
+            stdout = io.StringIO()
+            with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.fetch_sansay_json",
+                       side_effect=fetch), redirect_stdout(stdout), redirect_stderr(io.StringIO()):
+                assert agent_sansay_vsx_main(args) == 0
+            # The trailer carries response times, which differ between the runs.
+            outputs.append(stdout.getvalue().split("<<<sansay_vsx_agent:sep(0)>>>")[0])
+        assert "<<<sansay_vsx_trunks:sep(0)>>>" in outputs[0]
+        assert outputs[0] == outputs[1]
+        assert list(tmp_path.glob("profile_*.pstats"))
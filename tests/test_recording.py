@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Tests for recording and replaying the VSX API responses.
+
+Covers:
+  - responses recorded with body, headers, timing and transfer size
+  - failed requests recorded with their error
+  - replay in recorded order, reusing the last response, without any HTTP
+  - replay at recorded speed
+  - recorded payloads loaded for benchmarks and tests
+  - --replay keeps away from the live state directory and the KPI database
+"""
+
+import io
+import json
+import threading
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+
+from cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx import fetch_sansay_json, parse_arguments
+from cmk_addons.plugins.sansay_vsx.special_agents.recording import (
+    INDEX_NAME,
+    Recorder,
+    Replayer,
+    load_recorded_report,
+)
+from tests.test_agent import RESOURCE_DATA, _ReportHandler, make_args
+
+
+@pytest.fixture
+def vsx_port():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ReportHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def _args(port, **overrides):
+    return make_args(host="127.0.0.1", user="monitor", password="secret", proto="http", port=port,
+                     verify_ssl=False, **overrides)
+
+
+def _index(directory):
+    return [json.loads(line) for line in (directory / INDEX_NAME).read_text(encoding="utf-8").splitlines()]
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+class TestRecord:
+    def test_response_recorded(self, vsx_port, tmp_path):
+        directory = tmp_path / "recording"
+        assert fetch_sansay_json(_args(vsx_port, record=str(directory)), "resource") == RESOURCE_DATA
+        [entry] = _index(directory)
+        assert entry["host"] == "127.0.0.1"
+        assert entry["report"] == "resource"
+        assert entry["status"] == 200
+        assert entry["headers"]["Content-Encoding"] == "gzip"
+        assert 0 < entry["wire_bytes"] < len(_ReportHandler.body)
+        assert entry["elapsed"] >= 0
+        assert (directory / entry["body"]).read_bytes() == _ReportHandler.body
+
+    def test_error_recorded(self, tmp_path):
+        with redirect_stdout(io.StringIO()):
+            fetch_sansay_json(_args(1, record=str(tmp_path)), "realtime")
+        [entry] = _index(tmp_path)
+        assert "error" in entry
+        assert "body" not in entry
+
+    def test_sequence_continues_across_recorders(self, tmp_path):
+        Recorder(tmp_path).record("vsx", "realtime", 0.1, status=200, body=b"{}")
+        Recorder(tmp_path).record("vsx", "realtime", 0.1, status=200, body=b"{}")
+        assert [entry["sequence"] for entry in _index(tmp_path)] == [1, 2]
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+def _recording(directory):
+    recorder = Recorder(directory)
+    recorder.record("10.0.0.9", "realtime", 0.5, status=200, headers={"Content-Encoding": "gzip"},
+                    body=b'{"n": 1}', wire_bytes=5)
+    recorder.record("10.0.0.9", "realtime", 0.5, status=200, body=b'{"n": 2}', wire_bytes=8)
+    recorder.record("10.0.0.9", "media_server", 0.2, status=503, reason="Service Unavailable")
+    recorder.record("10.0.0.9", "resource", 2.0, error="Read timed out.")
+    return directory
+
+
+class TestReplay:
+    def test_responses_in_order_then_last_again(self, tmp_path):
+        args = _args(1, replay=str(_recording(tmp_path)))
+        transfer = {}
+        assert fetch_sansay_json(args, "realtime", transfer=transfer) == {"n": 1}
+        assert transfer == {"encoding": "gzip", "wire_bytes": 5, "bytes": 8}
+        assert fetch_sansay_json(args, "realtime") == {"n": 2}
+        assert fetch_sansay_json(args, "realtime") == {"n": 2}
+
+    def test_recorded_failures(self, tmp_path):
+        args = _args(1, replay=str(_recording(tmp_path)))
+        with redirect_stdout(io.StringIO()) as output:
+            assert fetch_sansay_json(args, "media_server") is None
+            assert fetch_sansay_json(args, "resource") is None
+        assert "503 Service Unavailable" in output.getvalue()
+        assert "Read timed out." in output.getvalue()
+
+    def test_unrecorded_report(self, tmp_path):
+        recorder = Recorder(tmp_path)
+        recorder.record("10.0.0.9", "realtime", 0.5, status=200, body=b"{}")
+        with redirect_stdout(io.StringIO()) as output:
+            assert fetch_sansay_json(_args(1, replay=str(tmp_path)), "resource") is None
+        assert "no recorded Sansay 'resource' report" in output.getvalue()
+
+    def test_recorded_speed(self, tmp_path):
+        args = _args(1, replay=str(_recording(tmp_path)), replay_speed="recorded")
+        with patch("cmk_addons.plugins.sansay_vsx.special_agents.agent_sansay_vsx.time.sleep") as sleep:
+            fetch_sansay_json(args, "realtime")
+        sleep.assert_called_once_with(0.5)
+
+    def test_other_host_replays_by_report(self, tmp_path):
+        replayer = Replayer(_recording(tmp_path))
+        assert replayer.next("10.0.0.1", "realtime")["sequence"] == 1
+
+    def test_round_trip(self, vsx_port, tmp_path):
+        fetch_sansay_json(_args(vsx_port, record=str(tmp_path)), "resource")
+        assert fetch_sansay_json(_args(1, replay=str(tmp_path)), "resource") == RESOURCE_DATA
+        assert load_recorded_report(str(tmp_path), "resource") == RESOURCE_DATA
+
+
+# ---------------------------------------------------------------------------
+# Replay arguments
+# ---------------------------------------------------------------------------
+
+class TestReplayArguments:
+    def _parse(self, *options):
+        return parse_arguments(["--user", "monitor", "--password", "secret", *options, "10.0.0.1"])
+
+    def test_state_dir_inside_recording(self, tmp_path):
+        args = self._parse("--replay", str(tmp_path), "--kpi-db", str(tmp_path / "kpi.sqlite"))
+        assert args.state_dir == str(tmp_path / "state")
+        assert args.kpi_db is None
+
+    def test_explicit_state_dir_kept(self, tmp_path):
+        args = self._parse("--replay", str(tmp_path), "--state-dir", str(tmp_path / "mine"))
+        assert args.state_dir == str(tmp_path / "mine")
+
+    def test_live_run_unchanged(self, tmp_path):
+        args = self._parse("--kpi-db", str(tmp_path / "kpi.sqlite"))
+        assert args.state_dir is None
+        assert args.kpi_db == str(tmp_path / "kpi.sqlite")
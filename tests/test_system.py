@@ -8,6 +8,10 @@ Covers:
   - CPU utilization calculation and threshold alerting
   - session utilization calculation and threshold alerting
   - session drop detection via value_store
+  - counter rates with HA switchover and counter reset handling
+  - CPS utilization from the current CPS
+  - seasonal hour-of-week forecast of session utilization
+  - HA state changes, failover and cluster member state
 """
 
 import pytest
@@ -178,3 +182,239 @@ class TestCheckSessionDrop:
         _check(SECTION_NORMAL, value_store=vs)
         assert "sansay_vsx.session_utilization" in vs
         assert vs["sansay_vsx.session_utilization"] == pytest.approx(10.0)
+
+
+# ---------------------------------------------------------------------------
+# Check — counter rates
+# ---------------------------------------------------------------------------
+
+SECTION_COUNTERS = {
+    **SECTION_NORMAL,
+    "sum_attempt_session": 27412,
+    "max_cps_exceed": 10,
+    "max_session_exceed": 0,
+    "max_cps_allowed": 100,
+    "current_cps": 20,
+    "switch_over_flag": 3,
+}
+
+RATE_PARAMS = {
+    **DEFAULT_PARAMS,
+    "cps_utilization_levels": ("fixed", (80.0, 90.0)),
+    "cps_exceed_rate_levels": ("fixed", (0.01, 0.1)),
+}
+
+
+class TestCheckCounterRates:
+    def _check_at(self, section, now, vs):
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_system.time.time",
+            return_value=now,
+        ):
+            return _check(section, params=RATE_PARAMS, value_store=vs)
+
+    def test_no_rates_on_first_run(self):
+        results = self._check_at(SECTION_COUNTERS, 1000.0, {})
+        metrics = {r.name for r in results if isinstance(r, Metric)}
+        assert "attempt_rate" not in metrics
+        # the current CPS needs no baseline
+        assert "cps_utilization" in metrics
+
+    def test_rates_and_cps_utilization(self):
+        vs = {}
+        self._check_at(SECTION_COUNTERS, 1000.0, vs)
+        section = {**SECTION_COUNTERS, "sum_attempt_session": 27412 + 3000, "max_cps_exceed": 16, "current_cps": 85}
+        results = self._check_at(section, 1060.0, vs)
+        metrics = {r.name: r.value for r in results if isinstance(r, Metric)}
+        assert metrics["attempt_rate"] == pytest.approx(50.0)
+        # against the current CPS, not the attempt rate averaged over the interval
+        assert metrics["cps_utilization"] == pytest.approx(85.0)
+        assert metrics["cps_exceed_rate"] == pytest.approx(0.1)
+        assert metrics["session_exceed_rate"] == 0
+        states = {r.summary.split(":")[0]: r.state for r in results if isinstance(r, Result)}
+        assert states["Call attempts"] == State.OK
+        assert states["Current CPS"] == State.WARN
+        assert states["CPS limit exceeded"] == State.CRIT
+
+    def test_counter_reset_is_rebaselined(self):
+        vs = {}
+        self._check_at(SECTION_COUNTERS, 1000.0, vs)
+        section = {**SECTION_COUNTERS, "sum_attempt_session": 5}
+        results = self._check_at(section, 1060.0, vs)
+        assert "attempt_rate" not in {r.name for r in results if isinstance(r, Metric)}
+        results = self._check_at({**section, "sum_attempt_session": 65}, 1120.0, vs)
+        metrics = {r.name: r.value for r in results if isinstance(r, Metric)}
+        assert metrics["attempt_rate"] == pytest.approx(1.0)
+
+    def test_ha_switchover_drops_baselines(self):
+        vs = {}
+        self._check_at(SECTION_COUNTERS, 1000.0, vs)
+        # The counter grew, but a switchover happened: no rate across the switchover.
+        section = {**SECTION_COUNTERS, "sum_attempt_session": 99999, "switch_over_flag": 4}
+        results = self._check_at(section, 1060.0, vs)
+        assert "attempt_rate" not in {r.name for r in results if isinstance(r, Metric)}
+
+
+# ---------------------------------------------------------------------------
+# Check — seasonal session forecast
+# ---------------------------------------------------------------------------
+
+FORECAST_PARAMS = {
+    **DEFAULT_PARAMS,
+    "session_forecast_levels": ("fixed", (3.0, 5.0)),
+    "session_forecast_alpha": 0.2,
+    "session_forecast_min_samples": 4,
+}
+
+WEEK = 7 * 24 * 3600
+
+
+class TestCheckSessionForecast:
+    def _check_at(self, active_sessions, now, vs, params=FORECAST_PARAMS):
+        section = {**SECTION_NORMAL, "sum_active_session": active_sessions}
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_system.time.time",
+            return_value=now,
+        ):
+            return _check(section, params=params, value_store=vs)
+
+    def _learn(self, vs, values, now=1_000_000.0):
+        for week, value in enumerate(values):
+            self._check_at(value, now + week * WEEK, vs)
+        return now + len(values) * WEEK
+
+    def test_disabled_by_default(self):
+        vs = {}
+        results = self._check_at(100, 1_000_000.0, vs, params=DEFAULT_PARAMS)
+        assert "session_utilization_expected" not in {r.name for r in results if isinstance(r, Metric)}
+        assert "sansay_vsx.session_forecast" not in vs
+
+    def test_learning_phase_is_ok(self):
+        vs = {}
+        results = self._check_at(100, 1_000_000.0, vs)
+        notices = [r for r in results if isinstance(r, Result) and "learning" in r.details]
+        assert notices[0].state == State.OK
+        assert notices[0].summary == ""
+        assert "learning (0/4" in notices[0].details
+        assert "session_utilization_expected" not in {r.name for r in results if isinstance(r, Metric)}
+
+    def test_normal_value_for_the_hour_is_ok(self):
+        vs = {}
+        now = self._learn(vs, [100, 110, 90, 100, 105])
+        results = self._check_at(102, now, vs)
+        forecast = [r for r in results if isinstance(r, Result) and r.summary.startswith("Expected")]
+        assert forecast[0].state == State.OK
+        metrics = {r.name: r.value for r in results if isinstance(r, Metric)}
+        assert 9.0 < metrics["session_utilization_expected"] < 11.0
+
+    def test_anomaly_for_the_hour_is_crit(self):
+        vs = {}
+        now = self._learn(vs, [100, 110, 90, 100, 105])
+        # 60% utilization is well within fixed levels but far off the usual 10%.
+        results = self._check_at(600, now, vs)
+        forecast = [r for r in results if isinstance(r, Result) and r.summary.startswith("Expected")]
+        assert forecast[0].state == State.CRIT
+        session = [r for r in results if isinstance(r, Result) and "Session" in r.summary]
+        assert session[0].state == State.OK
+
+    def test_hours_of_the_week_are_separate(self):
+        vs = {}
+        now = self._learn(vs, [100, 100, 100, 100, 100])
+        # One hour later the bucket has no history yet.
+        results = self._check_at(600, now + 3600, vs)
+        assert "session_utilization_expected" not in {r.name for r in results if isinstance(r, Metric)}
+        self._check_at(600, now + 7200, vs)
+        assert len(vs["sansay_vsx.session_forecast"]) == 2
+
+    def test_checks_within_an_hour_are_one_sample(self):
+        vs = {}
+        now = 1_000_000.0 // 3600 * 3600
+        # 60 one-minute checks of one hour: 5% for half of it, 15% for the other half
+        for minute in range(60):
+            self._check_at(50 if minute < 30 else 150, now + minute * 60, vs)
+        self._check_at(100, now + 3600, vs)
+        [(mean, variance, samples)] = vs["sansay_vsx.session_forecast"].values()
+        assert samples == 1
+        assert mean == pytest.approx(10.0)
+
+    def test_current_hour_not_in_baseline(self):
+        vs = {}
+        now = self._learn(vs, [100, 100, 100, 100])
+        # The fourth week is folded in at the start of the fifth: 4 samples.
+        results = self._check_at(100, now, vs)
+        assert any(isinstance(r, Result) and r.summary.startswith("Expected") for r in results)
+        results = self._check_at(900, now + 60, vs)
+        forecast = [r for r in results if isinstance(r, Result) and r.summary.startswith("Expected")]
+        assert forecast[0].summary.startswith("Expected for this hour of the week: 10.0%")
+
+
+# ---------------------------------------------------------------------------
+# Check — HA state and cluster mode
+# ---------------------------------------------------------------------------
+
+def _cluster(active_node, states, unreachable=()):
+    return {
+        "active_node": active_node,
+        "nodes": {
+            node: {"reachable": node not in unreachable, "ha_current_state": state}
+            for node, state in states.items()
+        },
+    }
+
+
+SECTION_CLUSTER = {
+    **SECTION_NORMAL,
+    "cluster_peak_session": 230,
+    "cluster": _cluster("10.0.0.1", {"10.0.0.1": "active", "10.0.0.2": "standby"}),
+}
+
+
+class TestCheckHa:
+    def _summaries(self, results):
+        return {r.summary: r.state for r in results if isinstance(r, Result)}
+
+    def test_single_node_state_change(self):
+        vs = {}
+        _check(SECTION_NORMAL, value_store=vs)
+        results = _check({**SECTION_NORMAL, "ha_current_state": "standby"}, value_store=vs)
+        assert self._summaries(results)["HA state changed from active to standby"] == State.WARN
+        # reported once only
+        results = _check({**SECTION_NORMAL, "ha_current_state": "standby"}, value_store=vs)
+        assert not any("HA state changed" in summary for summary in self._summaries(results))
+
+    def test_state_change_state_is_configurable(self):
+        vs = {}
+        params = {**DEFAULT_PARAMS, "ha_state_change_state": 2}
+        _check(SECTION_NORMAL, params=params, value_store=vs)
+        results = _check({**SECTION_NORMAL, "ha_current_state": "standby"}, params=params, value_store=vs)
+        assert self._summaries(results)["HA state changed from active to standby"] == State.CRIT
+
+    def test_cluster_ok(self):
+        results = _check(SECTION_CLUSTER)
+        assert self._summaries(results)["HA active member: 10.0.0.1"] == State.OK
+        metrics = {r.name: r.value for r in results if isinstance(r, Metric)}
+        assert metrics["cluster_active_sessions"] == 100
+        assert metrics["cluster_peak_sessions"] == 230
+
+    def test_failover_between_members(self):
+        vs = {}
+        _check(SECTION_CLUSTER, value_store=vs)
+        failed_over = {
+            **SECTION_CLUSTER,
+            "cluster": _cluster("10.0.0.2", {"10.0.0.1": "standby", "10.0.0.2": "active"}),
+        }
+        results = _check(failed_over, value_store=vs)
+        assert self._summaries(results)["Failover: active member changed from 10.0.0.1 to 10.0.0.2"] == State.WARN
+
+    def test_no_active_member_and_unreachable_peer(self):
+        section = {
+            **SECTION_CLUSTER,
+            "cluster": _cluster(None, {"10.0.0.1": "standby", "10.0.0.2": None}, unreachable=("10.0.0.2",)),
+        }
+        summaries = self._summaries(_check(section))
+        assert summaries["No active HA member"] == State.CRIT
+        assert summaries["HA member 10.0.0.2 unreachable"] == State.WARN
+
+    def test_all_members_active(self):
+        section = {**SECTION_CLUSTER, "cluster": _cluster("10.0.0.1", {"10.0.0.1": "active", "10.0.0.2": "active"})}
+        assert self._summaries(_check(section))["All HA members report active: 10.0.0.1, 10.0.0.2"] == State.CRIT
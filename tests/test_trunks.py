@@ -4,21 +4,43 @@ Tests for the sansay_vsx_trunks check plugin.
 
 Covers:
   - discovery yields one service per trunk
+  - discovery modes (per trunk, aggregated, both) and per trunk filters
   - check returns UNKNOWN when trunk is absent from section (crash 2026-02-19)
   - check returns OK with correct metrics for a healthy trunk
   - threshold alerting for egress/ingress/realtime directions
+  - per-second rates of the session and CPS limit rejection counters
+  - compiled level tables cached per params object, evicted least recently used first,
+    and cheaper to look up than to compile
+  - aggregated trunks summary check
+  - hourly and daily ratios rebuilt from the 15 minute counters
+  - ratio levels guarded by a minimum number of call attempts
+  - metric groups, legacy duplicate groups and idle trunks without metrics
 """
 
+import copy
+import timeit
+
 import pytest  # noqa: F401 — used by pytest.approx in threshold tests
+from unittest.mock import patch
 
 from cmk.agent_based.v2 import Metric, Result, State
 
 from cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks import (
+    _aggregate_windows,
+    _record_counter_window,
+    _EVALUATORS,
+    _EVALUATOR_CACHE_SIZE,
+    _compile_trunk_evaluators,
+    _trunk_evaluators,
     check_sansay_vsx_trunks,
+    check_sansay_vsx_trunks_summary,
     discovery_sansay_vsx_trunks,
+    discovery_sansay_vsx_trunks_summary,
 )
 
 
+DISCOVERY_PARAMS = {"mode": "per_trunk", "per_trunk_filter": ("all", None)}
+
 DEFAULT_PARAMS = {
     "egress": {
         "failed_call_ratio_levels": ("no_levels", None),
@@ -63,8 +85,15 @@ SECTION = {
                 "origination_utilization": 3.0,
                 "termination_sessions": 5,
                 "termination_utilization": 5.0,
+                "cps": 9,
+                "cps_utilization": 90.0,
+                "peak_sessions": 8,
+                "peak_utilization": 8.0,
+                "call_limit_exceeded": 0,
+                "cps_limit_exceeded": 3,
             },
         },
+        "counters": {"ingress": {"call_attempt": 10}, "egress": {"call_attempt": 8}},
     },
     "200": {
         "alias": "Customer Out",
@@ -89,6 +118,7 @@ SECTION = {
                 "termination_utilization": 0.0,
             },
         },
+        "counters": {"ingress": {"call_attempt": 0}, "egress": {"call_attempt": 0}},
     },
 }
 
@@ -99,16 +129,56 @@ SECTION = {
 
 class TestDiscoverySansayVsxTrunks:
     def test_discovers_all_trunks(self):
-        services = list(discovery_sansay_vsx_trunks(SECTION))
+        services = list(discovery_sansay_vsx_trunks(params=DISCOVERY_PARAMS, section=SECTION))
         assert len(services) == 2
 
     def test_service_item_is_id_plus_alias(self):
-        services = {s.item for s in discovery_sansay_vsx_trunks(SECTION)}
+        services = {s.item for s in discovery_sansay_vsx_trunks(params=DISCOVERY_PARAMS, section=SECTION)}
         assert "100 Carrier In" in services
         assert "200 Customer Out" in services
 
     def test_empty_section_yields_no_services(self):
-        assert list(discovery_sansay_vsx_trunks({})) == []
+        assert list(discovery_sansay_vsx_trunks(params=DISCOVERY_PARAMS, section={})) == []
+
+    def test_aggregated_mode_has_no_per_trunk_services(self):
+        params = {**DISCOVERY_PARAMS, "mode": "aggregated"}
+        assert list(discovery_sansay_vsx_trunks(params=params, section=SECTION)) == []
+        assert len(list(discovery_sansay_vsx_trunks_summary(params=params, section=SECTION))) == 1
+
+    def test_per_trunk_mode_has_no_summary(self):
+        assert list(discovery_sansay_vsx_trunks_summary(params=DISCOVERY_PARAMS, section=SECTION)) == []
+
+    def test_both_mode(self):
+        params = {**DISCOVERY_PARAMS, "mode": "both"}
+        assert len(list(discovery_sansay_vsx_trunks(params=params, section=SECTION))) == 2
+        assert len(list(discovery_sansay_vsx_trunks_summary(params=params, section=SECTION))) == 1
+
+    def test_regex_filter(self):
+        params = {**DISCOVERY_PARAMS, "per_trunk_filter": ("regex", "Carrier")}
+        services = list(discovery_sansay_vsx_trunks(params=params, section=SECTION))
+        assert [s.item for s in services] == ["100 Carrier In"]
+
+    def test_id_range_filters(self):
+        params = {**DISCOVERY_PARAMS, "include_id_ranges": [{"min_id": 100, "max_id": 500}]}
+        assert len(list(discovery_sansay_vsx_trunks(params=params, section=SECTION))) == 2
+        params["exclude_id_ranges"] = [{"min_id": 150, "max_id": 250}]
+        services = list(discovery_sansay_vsx_trunks(params=params, section=SECTION))
+        assert [s.item for s in services] == ["100 Carrier In"]
+
+    def test_alias_filters(self):
+        params = {**DISCOVERY_PARAMS, "include_alias": "^C", "exclude_alias": "Out$"}
+        services = list(discovery_sansay_vsx_trunks(params=params, section=SECTION))
+        assert [s.item for s in services] == ["100 Carrier In"]
+
+    def test_only_active_trunks(self):
+        params = {**DISCOVERY_PARAMS, "only_active": True}
+        services = list(discovery_sansay_vsx_trunks(params=params, section=SECTION))
+        assert [s.item for s in services] == ["100 Carrier In"]
+
+    def test_top_n_by_sessions(self):
+        params = {**DISCOVERY_PARAMS, "per_trunk_filter": ("top_n", 1)}
+        services = list(discovery_sansay_vsx_trunks(params=params, section=SECTION))
+        assert [s.item for s in services] == ["100 Carrier In"]
 
 
 # ---------------------------------------------------------------------------
@@ -207,3 +277,322 @@ class TestCheckThresholds:
         ))
         states = [r.state for r in results if isinstance(r, Result)]
         assert State.WARN in states
+
+    def test_cps_utilization_crit(self):
+        # realtime cps_utilization is 90.0; crit at 90.0
+        params = self._params_with_levels("realtime", "cps_utilization", 80.0, 90.0)
+        results = list(check_sansay_vsx_trunks(
+            item="100 Carrier In", params=params, section=SECTION
+        ))
+        assert any(isinstance(r, Result) and r.state == State.CRIT and "Realtime CPS Utilization: 90.0" == r.summary
+                   for r in results)
+
+    def test_alert_summary_uses_precomputed_label(self):
+        params = self._params_with_levels("ingress", "failed_call_ratio", 5.0, 20.0)
+        results = list(check_sansay_vsx_trunks(
+            item="100 Carrier In", params=params, section=SECTION
+        ))
+        assert any(isinstance(r, Result) and r.summary == "Ingress Failed Call Ratio: 10.0" for r in results)
+
+
+# ---------------------------------------------------------------------------
+# Check — rates of the limit rejection counters
+# ---------------------------------------------------------------------------
+
+class TestLimitRates:
+    # trunk 100 reports 3 calls rejected by the CPS limit so far
+    def _check(self, vs, now, rejected, params=DEFAULT_PARAMS):
+        trunk = copy.deepcopy(SECTION["100"])
+        trunk["calculated_stats"]["realtime"]["cps_limit_exceeded"] = rejected
+        with patch("cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks.get_value_store", return_value=vs), \
+                patch("cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks.time.time", return_value=now):
+            return list(check_sansay_vsx_trunks(item="100 Carrier In", params=params, section={"100": trunk}))
+
+    def test_no_rate_without_baseline(self):
+        results = self._check({}, 1000.0, 3)
+        assert "realtime_cps_limit_exceeded" not in {r.name for r in results if isinstance(r, Metric)}
+
+    def test_counter_turned_into_rate(self):
+        vs = {}
+        self._check(vs, 1000.0, 3)
+        metrics = {r.name: r.value for r in self._check(vs, 1060.0, 9) if isinstance(r, Metric)}
+        assert metrics["realtime_cps_limit_exceeded"] == pytest.approx(0.1)
+        assert metrics["realtime_call_limit_exceeded"] == 0.0
+
+    def test_counter_reset_skipped(self):
+        vs = {}
+        self._check(vs, 1000.0, 30)
+        results = self._check(vs, 1060.0, 2)
+        assert "realtime_cps_limit_exceeded" not in {r.name for r in results if isinstance(r, Metric)}
+
+    def test_levels_on_rate(self):
+        params = copy.deepcopy(DEFAULT_PARAMS)
+        params["realtime"]["cps_limit_exceeded_levels"] = ("fixed", (0.05, 1.0))
+        vs = {}
+        self._check(vs, 1000.0, 3, params)
+        results = self._check(vs, 1060.0, 9, params)
+        assert any(isinstance(r, Result) and r.state == State.WARN and r.summary == "Realtime CPS Limit Exceeded: 0.1"
+                   for r in results)
+
+
+# ---------------------------------------------------------------------------
+# Compiled level evaluators
+# ---------------------------------------------------------------------------
+
+class TestTrunkEvaluators:
+    def test_no_levels_are_not_compiled(self):
+        assert _trunk_evaluators(DEFAULT_PARAMS) == {}
+
+    def test_cached_by_identity(self):
+        params = {**DEFAULT_PARAMS, "egress": {"failed_call_ratio_levels": ("fixed", (1.0, 2.0))}}
+        assert _trunk_evaluators(params) is _trunk_evaluators(params)
+        assert set(_trunk_evaluators(params)["egress"]) == {"failed_call_ratio"}
+
+    def test_other_params_object_compiles_its_own_table(self):
+        def make():
+            return {**DEFAULT_PARAMS, "realtime": {"origination_utilization_levels": ("fixed", (80.0, 90.0))}}
+        first, second = make(), make()
+        assert _trunk_evaluators(first) is not _trunk_evaluators(second)
+        assert set(_trunk_evaluators(second)["realtime"]) == {"origination_utilization"}
+
+    def test_least_recently_used_table_evicted(self):
+        def make(warn):
+            return {**DEFAULT_PARAMS, "ingress": {"failed_call_ratio_levels": ("fixed", (float(warn), 99.0))}}
+        kept_params = make(0)
+        kept = _trunk_evaluators(kept_params)
+        others = [make(warn) for warn in range(1, _EVALUATOR_CACHE_SIZE + 1)]
+        for params in others:
+            assert _trunk_evaluators(kept_params) is kept
+            _trunk_evaluators(params)
+        assert _trunk_evaluators(kept_params) is kept
+        assert len(_EVALUATORS) == _EVALUATOR_CACHE_SIZE
+
+    def test_cached_lookup_cheaper_than_compiling(self):
+        params = copy.deepcopy(DEFAULT_PARAMS)
+        params["egress"]["failed_call_ratio_levels"] = ("fixed", (1.0, 2.0))
+        params["realtime"]["origination_utilization_levels"] = ("fixed", (80.0, 90.0))
+        _trunk_evaluators(params)
+        cached = min(timeit.repeat(lambda: _trunk_evaluators(params), number=2000, repeat=3))
+        compiled = min(timeit.repeat(lambda: _compile_trunk_evaluators(params), number=2000, repeat=3))
+        assert cached < compiled
+
+
+# ---------------------------------------------------------------------------
+# Aggregated trunks summary
+# ---------------------------------------------------------------------------
+
+class TestCheckTrunksSummary:
+    def _params(self, **overrides):
+        params = {k: {**v} for k, v in DEFAULT_PARAMS.items()}
+        params["problem_trunks_levels"] = ("fixed", (1, 10))
+        params["worst_offenders"] = 5
+        params.update(overrides)
+        return params
+
+    def test_counts_and_fleet_metrics(self):
+        results = list(check_sansay_vsx_trunks_summary(params=self._params(), section=SECTION))
+        assert results[0].state == State.OK
+        assert results[0].summary == "2 trunks: 2 OK, 0 WARN, 0 CRIT"
+        metrics = {r.name: r.value for r in results if isinstance(r, Metric)}
+        assert metrics["total_origination_sessions"] == 3
+        assert metrics["total_termination_sessions"] == 5
+        # Only the active trunk's ingress and egress contribute to the ASR distribution.
+        assert metrics["trunks_asr_p10"] == pytest.approx(90.0)
+        assert metrics["trunks_asr_p90"] == pytest.approx(100.0)
+
+    def test_offenders_listed_and_counted(self):
+        params = self._params()
+        params["ingress"]["failed_call_ratio_levels"] = ("fixed", (5.0, 8.0))
+        results = list(check_sansay_vsx_trunks_summary(params=params, section=SECTION))
+        assert results[0].summary == "2 trunks: 1 OK, 0 WARN, 1 CRIT"
+        assert results[0].state == State.WARN
+        assert any("100 Carrier In (CRIT): Ingress Failed Call Ratio: 10.0" in r.details
+                   for r in results if isinstance(r, Result))
+
+    def test_unknown_on_empty_section(self):
+        results = list(check_sansay_vsx_trunks_summary(params=self._params(), section={}))
+        assert results[0].state == State.UNKNOWN
+
+
+# ---------------------------------------------------------------------------
+# Check — hourly and daily ratios from the 15 minute counters
+# ---------------------------------------------------------------------------
+
+def _counters(attempts, fails, answers, duration):
+    return {"call_attempt": attempts, "call_fail": fails, "call_answer": answers,
+            "call_duration": duration, "pdd_ms": 0}
+
+
+class TestCounterHistory:
+    def test_same_window_seen_every_minute_is_stored_once(self):
+        vs = {}
+        for minute in range(10):
+            history = _record_counter_window("ingress", _counters(10, 1, 9, 900), 1000.0 + minute * 60, vs)
+        assert len(history) == 1
+
+    def test_changed_counters_start_a_new_window(self):
+        vs = {}
+        _record_counter_window("ingress", _counters(10, 1, 9, 900), 1000.0, vs)
+        history = _record_counter_window("ingress", _counters(2, 0, 2, 100), 1060.0, vs)
+        assert len(history) == 2
+
+    def test_identical_traffic_after_a_full_interval_is_a_new_window(self):
+        vs = {}
+        _record_counter_window("ingress", _counters(10, 1, 9, 900), 1000.0, vs)
+        history = _record_counter_window("ingress", _counters(10, 1, 9, 900), 1000.0 + 900, vs)
+        assert len(history) == 2
+
+    def test_windows_older_than_a_day_are_dropped(self):
+        vs = {}
+        _record_counter_window("ingress", _counters(10, 1, 9, 900), 1000.0, vs)
+        history = _record_counter_window("ingress", _counters(2, 0, 2, 100), 1000.0 + 86400, vs)
+        assert [window[1] for window in history] == [2]
+
+    def test_ratios_are_weighted_by_attempts(self):
+        # 1 attempt that failed and 99 attempts that were answered: the mean of
+        # the per window ratios would be 50%, the weighted ratio is 99%.
+        history = [(100.0, 1, 1, 0, 0, 0), (1000.0, 99, 0, 99, 9900, 0)]
+        aggregate = _aggregate_windows(history, 0.0)
+        assert aggregate["answer_seize_ratio"] == 99.0
+        assert aggregate["failed_call_ratio"] == 1.0
+        assert aggregate["avg_call_duration"] == 99.0
+        assert aggregate["attempts"] == 100
+
+    def test_no_attempts_gives_no_aggregate(self):
+        assert _aggregate_windows([(100.0, 0, 0, 0, 0, 0)], 0.0) is None
+
+    def test_check_emits_hourly_and_daily_metrics(self):
+        section = {"100": {**SECTION["100"], "counters": {"ingress": _counters(10, 1, 9, 900)}}}
+        vs = {}
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks.get_value_store",
+            return_value=vs,
+        ):
+            results = list(check_sansay_vsx_trunks(
+                item="100 Carrier In", params={**DEFAULT_PARAMS, "metric_groups": ["history"]}, section=section
+            ))
+        metrics = {r.name: r.value for r in results if isinstance(r, Metric)}
+        assert metrics["ingress_answer_seize_ratio_1h"] == 90.0
+        assert metrics["ingress_failed_call_ratio_24h"] == 10.0
+        assert any(isinstance(r, Result) and r.summary == "" and "Ingress last 1h" in r.details for r in results)
+
+    def test_history_metrics_opt_in(self):
+        section = {"100": {**SECTION["100"], "counters": {"ingress": _counters(10, 1, 9, 900)}}}
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks.get_value_store",
+            return_value={},
+        ):
+            results = list(check_sansay_vsx_trunks(item="100 Carrier In", params=DEFAULT_PARAMS, section=section))
+        assert not [r for r in results if isinstance(r, Metric) and r.name.endswith(("_1h", "_24h"))]
+        assert any(isinstance(r, Result) and "Ingress last 1h" in r.details for r in results)
+
+
+# ---------------------------------------------------------------------------
+# Check — minimum call attempts
+# ---------------------------------------------------------------------------
+
+class TestMinimumSample:
+    # trunk 100 has ingress failed_call_ratio 10.0 from 10 attempts
+    def _params(self, min_attempts):
+        params = {k: {**v} for k, v in DEFAULT_PARAMS.items()}
+        params["ingress"]["failed_call_ratio_levels"] = ("fixed", (5.0, 8.0))
+        params["ingress"]["min_call_attempts"] = min_attempts
+        return params
+
+    def _check(self, params, counters, vs=None):
+        section = {"100": {**SECTION["100"], "counters": {"ingress": counters}}}
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks.get_value_store",
+            return_value=vs if vs is not None else {},
+        ):
+            return list(check_sansay_vsx_trunks(item="100 Carrier In", params=params, section=section))
+
+    def test_levels_evaluated_above_minimum(self):
+        results = self._check(self._params(10), _counters(10, 1, 9, 900))
+        assert any(isinstance(r, Result) and r.state == State.CRIT for r in results)
+
+    def test_insufficient_sample_is_ok(self):
+        results = self._check(self._params(20), _counters(10, 1, 9, 900))
+        assert all(r.state == State.OK for r in results if isinstance(r, Result))
+        notices = [r for r in results if isinstance(r, Result) and "insufficient sample" in r.details]
+        assert [r.summary for r in notices] == [""]
+        assert "insufficient sample (10 of 20 call attempts)" in notices[0].details
+        # the metric itself is still collected
+        assert "ingress_failed_call_ratio" in {r.name for r in results if isinstance(r, Metric)}
+
+    def test_last_hour_is_used_when_it_adds_up(self):
+        vs = {}
+        params = self._params(20)
+        self._check(params, _counters(15, 0, 15, 900), vs)
+        # a later interval, 10 attempts with 1 failure: 1 of 25 over the hour is 4%
+        with patch("cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks.time.time",
+                   return_value=vs["sansay_vsx.windows.ingress"][-1][0] + 900):
+            results = self._check(params, _counters(10, 1, 9, 900), vs)
+        assert all(r.state == State.OK for r in results if isinstance(r, Result))
+        params = self._params(20)
+        params["ingress"]["failed_call_ratio_levels"] = ("fixed", (3.0, 5.0))
+        with patch("cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks.time.time",
+                   return_value=vs["sansay_vsx.windows.ingress"][-1][0] + 60):
+            results = self._check(params, _counters(10, 1, 9, 900), vs)
+        assert any(isinstance(r, Result) and r.state == State.WARN
+                   and r.summary == "Ingress Failed Call Ratio (last 1h): 4.0" for r in results)
+
+    def test_summary_skips_insufficient_samples(self):
+        params = {**self._params(20), "problem_trunks_levels": ("fixed", (1, 10)), "worst_offenders": 10}
+        section = {"100": {**SECTION["100"], "counters": {"ingress": _counters(10, 1, 9, 900)}}}
+        results = list(check_sansay_vsx_trunks_summary(params=params, section=section))
+        assert {r.name: r.value for r in results if isinstance(r, Metric)}["trunks_crit"] == 0
+
+
+# ---------------------------------------------------------------------------
+# Check — metric cardinality
+# ---------------------------------------------------------------------------
+
+class TestMetricGroups:
+    def _metrics(self, trunk_data, **params):
+        with patch(
+            "cmk_addons.plugins.sansay_vsx.agent_based.sansay_vsx_trunks.get_value_store",
+            return_value={},
+        ):
+            results = check_sansay_vsx_trunks(
+                item="100 Carrier In", params={**DEFAULT_PARAMS, **params}, section={"100": trunk_data},
+            )
+            return {r.name for r in results if isinstance(r, Metric)}
+
+    def test_only_selected_groups(self):
+        trunk = {**SECTION["100"], "counters": {"ingress": _counters(10, 1, 9, 900)}}
+        names = self._metrics(trunk, metric_groups=["realtime"])
+        assert names and all(name.startswith("realtime_") for name in names)
+
+    def test_history_group(self):
+        trunk = {**SECTION["100"], "counters": {"ingress": _counters(10, 1, 9, 900)}}
+        assert "ingress_answer_seize_ratio_1h" in self._metrics(trunk, metric_groups=["history"])
+        assert "ingress_answer_seize_ratio_1h" not in self._metrics(trunk, metric_groups=["ingress"])
+
+    def test_levels_still_evaluated(self):
+        params = {**DEFAULT_PARAMS, "metric_groups": [],
+                  "ingress": {**DEFAULT_PARAMS["ingress"], "failed_call_ratio_levels": ("fixed", (5.0, 8.0))}}
+        results = list(check_sansay_vsx_trunks(item="100 Carrier In", params=params, section=SECTION))
+        assert not any(isinstance(r, Metric) for r in results)
+        assert any(isinstance(r, Result) and r.state == State.CRIT for r in results)
+
+    def test_legacy_duplicate_group_suppressed(self):
+        calculated = SECTION["100"]["calculated_stats"]
+        trunk = {**SECTION["100"], "calculated_stats": {**calculated, "gw_egress_stat": dict(calculated["egress"])}}
+        names = self._metrics(trunk)
+        assert "egress_answer_seize_ratio" in names
+        assert not any(name.startswith("gw_egress_stat_") for name in names)
+
+    def test_legacy_group_kept_without_current_group(self):
+        calculated = {k: v for k, v in SECTION["100"]["calculated_stats"].items() if k != "egress"}
+        trunk = {**SECTION["100"], "calculated_stats": {**calculated, "gw_egress_stat": dict(calculated["ingress"])}}
+        assert "gw_egress_stat_answer_seize_ratio" in self._metrics(trunk)
+
+    def test_idle_trunk_without_metrics(self):
+        idle = {**SECTION["200"], "counters": {"ingress": _counters(0, 0, 0, 0)}}
+        assert self._metrics(idle) != set()
+        assert self._metrics(idle, skip_idle_metrics=True) == set()
+
+    def test_busy_trunk_keeps_metrics_with_skip_idle(self):
+        trunk = {**SECTION["100"], "counters": {"ingress": _counters(10, 1, 9, 900)}}
+        assert "ingress_answer_seize_ratio" in self._metrics(trunk, skip_idle_metrics=True)